@@ -1,5 +1,11 @@
 __version__ = "1.0.0"
 
-from .mainwindow import DetectorBankGui
+def __getattr__(name):
+    # only import the GUI when it is used, so that the analysis engine can be 
+    # used without Qt
+    if name == "DetectorBankGui":
+        from .mainwindow import DetectorBankGui
+        return DetectorBankGui
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-__all__ = ["DetectorBankGui"]
\ No newline at end of file
+__all__ = ["DetectorBankGui"]
@@ -1 +1,9 @@
-from .analyser import Analyser
\ No newline at end of file
+from .engine import Engine
+
+def __getattr__(name):
+    # Analyser needs Qt, so only import it when it is used, so that the engine 
+    # can be used without Qt
+    if name == "Analyser":
+        from .analyser import Analyser
+        return Analyser
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
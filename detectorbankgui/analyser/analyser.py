@@ -1,135 +1,208 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Get absZ results from DetectorBank
+Qt adapter for the analysis :mod:`.engine`
 
-Created a QObject `AnalysisWorker` so that each instance can be run in a separate
-thread, however this is not (currently?) necessary, as the DetectorBank is already
-threaded.
+`Analyser` replaces the engine's events with Qt signals and runs each 
+`AnalysisWorker` in a QThreadPool, so the GUI thread is free while the analysis
+is running. As each worker lives in the GUI thread, its signals are queued to
+the `Analyser`, which passes results to the result widget.
+
+The segments on the result widget's current page are analysed first, and
+changing the page changes which queued segments are analysed next.
 """
-from qtpy.QtCore import QObject, Signal
-from detectorbank import DetectorBank, DetectorCache, Producer
+from qtpy.QtCore import QObject, QRunnable, QThreadPool, Signal
+from .engine import Worker, ProcessWorker, Engine
+from .calibration import calibrate
 import numpy as np
-from functools import partial
+import threading
 
 pytest_plugin = "pytest-qt"
 
-class AnalysisWorker(QObject):
-    """ Object to perform analysis for a given audio segment
+class AnalysisWorker(Worker, QObject):
+    """ :class:`.engine.Worker` with Qt signals
     
-        Paremeters
-        ----------
-        audio : np.ndarray
-            Array of audio samples
-        sr : int
-            Sample rate of audio
-        params : dict
-            Dict of DetectorBank parameters
-        n0 : int, optional
-            If provided, start analysis from this sample, rather than beginning of `audio`
-        n1 : int, optional
-            If provided, stop analysis at this sample, rather than end of `audio`
-        subsample : int, optional
-            If provided, subsample result by this factor
-        progressIncrement : int
-            Emit `progress` signal after every `progressIncrement` samples have
-            been processed (after downsampling)
+        Args are as :class:`.engine.Worker`.
     """
     
     progress = Signal(int)
-    """ **signal** progress(int `progressIncrement`)
+    """ **signal** progress(int `samples`)
+    
+        See :attr:`.engine.Worker.progress`
+    """
+    
+    blockReady = Signal(object, int)
+    """ **signal** blockReady(np.ndarray `block`, int `start`)
+        
+        See :attr:`.engine.Worker.blockReady`
+    """
+    
+    error = Signal(object)
+    """ **signal** error(Exception `exc`)
+    
+        See :attr:`.engine.Worker.error`
+    """
+    
+    finished = Signal(object, bool)
+    """ **signal** finished(np.ndarrray `result`, bool `complete`)
+    
+        See :attr:`.engine.Worker.finished`
+    """
+    
+class ProcessAnalysisWorker(ProcessWorker, AnalysisWorker):
+    """ :class:`.engine.ProcessWorker` with Qt signals
     
-        Emitted every time `progressIncrement`*`subsample` samples has been processed.
+        Args are as :class:`.engine.ProcessWorker`.
+    """
+    
+class CalibrationWorker(QObject):
+    """ Object to run :func:`.calibration.calibrate` 
+    
+        Args are passed to :func:`.calibration.calibrate`.
+    """
+    
+    progress = Signal(int, int)
+    """ **signal** progress(int `done`, int `total`)
+    
+        Emitted with the number of configurations timed so far and the total number
     """
     
     finished = Signal(object)
-    """ **signal** finished(np.ndarrray `result`)
+    """ **signal** finished(Calibration `calibration`)
     
-        Emitted when the analysis has finished, with the array of results.
+        Emitted with the fastest configuration, or None if cancelled
     """
     
-    def __init__(self, audio, sr, params, n0=None, n1=None, subsample=1, progressIncrement=1):
+    def __init__(self, sr, params, **kwargs):
         super().__init__()
-        
-        self.cacheSegDuration = 30 # cache segment size in ms
-        
-        self.audio = audio
         self.sr = sr
-        n0 = n0 if n0 is not None else 0
-        n1 = n1 if n1 is not None else len(audio)
-        if n0 < 0:
-            n0 = 0
-        if n1 > len(self.audio):
-            n1 = len(self.audio)
-        
-        self.channels = self._makeDetectorCache(params, audioSlice=(n0, n1))
-        self.subsample = int(subsample)
-        self.progressIncrement = progressIncrement
-        self.result = np.zeros((self.channels, (n1-n0)//subsample))
-        
-    def _makeDetectorCache(self, params, audioSlice=None):
-        features = params['method'] | params['freqNorm'] | params['ampNorm']
-        if audioSlice is not None:
-            n0, n1 = audioSlice
-            audio = self.audio[n0:n1]
-        else:
-            audio = self.audio
-        args = (self.sr, audio, params['numThreads'], params['detChars'], features,
-                params['damping'], params['gain'])
-        self.det = DetectorBank(*args)
-        self.p = Producer(self.det)
-        self.segSize = self.cacheSegDuration * self.sr // 1000
-        numSegs = 10
-        self.cache = DetectorCache(self.p, numSegs, self.segSize)
-        channels = self.det.getChans()
-        return channels
+        self.params = params
+        self.kwargs = kwargs
+        self._cancelled = threading.Event()
+        
+    def cancel(self):
+        """ Stop calibration after the current configuration has been timed """
+        self._cancelled.set()
         
     def start(self):
-        """ Get subsampled results """
-        n, idx = 0, 0
-        
-        while n < self.cache.end() and idx < self.result.shape[1]:
-            for k in range(self.channels):
-                self.result[k][idx] = self.cache[k,n]
-            idx += 1
-            n += self.subsample
-            if idx % self.progressIncrement == 0:
-                self.progress.emit(self.progressIncrement)
-            
-        self.finished.emit(self.result)
+        """ Run calibration """
+        calibration = calibrate(self.sr, self.params, callback=self.progress.emit, 
+                                checkState=lambda: not self._cancelled.is_set(), 
+                                **self.kwargs)
+        self.finished.emit(calibration)
+        
+class _AnalysisJob(QRunnable):
+    """ QRunnable to call :meth:`AnalysisWorker.start` in a QThreadPool thread 
+    
+        As `worker` lives in the GUI thread, its signals are queued to any slots
+        in the GUI thread.
+    """
+    def __init__(self, worker):
+        super().__init__()
+        self.worker = worker
         
-class Analyser(QObject):
+    def run(self):
+        self.worker.start()
+        
+class Analyser(Engine, QObject):
     """ Object to manage DetectorBank calculations for audio regions.
     
         Parameters
         ----------
         resultWidget : HopfPlot
             Widget for plotting results
+        numProcesses : int
+            If greater than 1, analyse segments in a pool of this many worker 
+            processes, rather than one after another in this process.
+        cacheSize : int
+            Memory budget, in bytes, of the result cache
+        maxContinuations : int
+            Number of DetectorBanks to keep after analysis, so that extended 
+            segments only need the new samples to be analysed.
+        
+        Results are passed to `resultWidget.addData` and, if :attr:`streamResults` 
+        is True, partial results are passed to `resultWidget.updateData` during 
+        the analysis. Segments with keys in `resultWidget.pageKeys()` are 
+        analysed first; this is updated when `resultWidget.pageChanged` is emitted.
+        
+        See :class:`.engine.Engine` for the other options.
     """
     
     progress = Signal(int)
     """ **signal** progress(int `samples`)
     
-        Emitted every time an AnalysisWorker has processed a given number of samples
+        See :attr:`.engine.Engine.progress`
+    """
+    
+    blockReady = Signal(object, object, object, object)
+    """ **signal** blockReady(object `key`, np.ndarray `block`, int `start`, int `size`)
+    
+        See :attr:`.engine.Engine.blockReady`
+    """
+    
+    resultReady = Signal(object, object, bool, object)
+    """ **signal** resultReady(object `key`, np.ndarray `result`, bool `complete`, int `stop`)
+    
+        See :attr:`.engine.Engine.resultReady`
+    """
+    
+    error = Signal(object)
+    """ **signal** error(Exception `exc`)
+    
+        See :attr:`.engine.Engine.error`
     """
     
     finished = Signal()
     """**signal** finished()
     
-        Emitted when all segments have been analysed.
+        Emitted when all segments have been analysed, or analysis has been cancelled.
     """
     
-    def __init__(self, resultWidget):
-        super().__init__()
+    workerClass = AnalysisWorker
+    processWorkerClass = ProcessAnalysisWorker
+    
+    def __init__(self, resultWidget, numProcesses=1, cacheSize=512*2**20, maxContinuations=8):
+        super().__init__(numProcesses, cacheSize, maxContinuations)
         self.resultWidget = resultWidget
+        self.streamResults = True
+        self.threadPool = QThreadPool()
+        self.threadPool.setMaxThreadCount(self.numProcesses)
+        self.blockReady.connect(self.resultWidget.updateData)
+        self.resultReady.connect(self._plotResult)
+        self.resultWidget.pageChanged.connect(self._pageChanged)
+        
+    def _setThreadCount(self, value):
+        self.threadPool.setMaxThreadCount(value)
+        
+    def _submit(self, worker):
+        self.threadPool.start(_AnalysisJob(worker))
+        
+    def _connect(self, signal, slot):
+        # workers live in the GUI thread, so Qt queues their signals to it
+        signal.connect(slot)
+            
+    def wait(self, msecs=-1) -> bool:
+        """ Block until all analysers have finished, or `msecs` have elapsed.
+        
+            Returns True if all analysers finished.
+        """
+        return self.threadPool.waitForDone(msecs)
         
     def start(self):
-        """ Begin analysis of all segments. """
-        for analyser in self.analysers:
-            analyser.start()
+        """ Begin analysis, starting with the segments on the current page """
+        self._pageChanged()
+        super().start()
+        
+    def _pageChanged(self, *args):
+        """ Analyse queued segments on the current page before the others """
+        self.setPriorityKeys(self.resultWidget.pageKeys())
+        
+    def setParams(self, audio, sr, detBankParams, segments, subsample, reduction="point", 
+                  dtype=np.float64) -> int:
+        """ Set all parameters needed for analysis and add a plot for each segment
         
-    def setParams(self, audio, sr, detBankParams, segments, subsample) -> int:
-        """ Set all parameters needed for analysis 
+            If the analysis is running, these segments are added to it when
+            :meth:`start` is called.
         
             Parameters
             ----------
@@ -143,37 +216,95 @@ class Analyser(QObject):
                 List of segments, as returned by AudioPlot.getSegments
             subsample : int
                 subsample factor
+            reduction : str
+                How to reduce each `subsample` samples to one value; see 
+                :data:`.extraction.REDUCTIONS`
+            dtype : np.dtype
+                dtype of results
                 
             Returns
             -------
             numSamples : int
-                Total number of samples that will be analysed, after downsampling
+                Number of samples that will be analysed for these segments, after downsampling
         """
-        self.analysers = [] 
-        self._finished = [] # list of completed analysers (can't remove from lst/dict, as they are blocking)
-        idxx = self.resultWidget.addPlots(detBankParams['detChars'][:,0], segments)
-        numSamples = 0
-        for idx, segment in zip(idxx, segments):
-            n0, n1 = segment.samples
-            numSamples += (n1-n0)
-            
-            analyser = AnalysisWorker(audio, sr, detBankParams, n0, n1, subsample)
-            
-            self.analysers.append(analyser)
-            
-            analyser.progress.connect(self.progress)
+        keys = self.resultWidget.addPlots(detBankParams['detChars'][:,0], segments)
+        return super().setParams(audio, sr, detBankParams, self._ranges(segments), subsample, 
+                                 reduction, dtype, keys=keys)
+        
+    def setSweep(self, audio, sr, variants, segment, subsample, reduction="point", 
+                 dtype=np.float64) -> int:
+        """ Set parameters to analyse `segment` with each of the sweep `variants`
+            and add a plot for each variant, labelled with its parameter values
+        
+            `segment` is one of the segments returned by AudioPlot.getSegments and
+            `variants` is a list of :class:`.sweep.SweepVariant`. Other args and 
+            return value are as :meth:`setParams`.
+        """
+        freqs = variants[0].params['detChars'][:,0]
+        keys = self.resultWidget.addPlots(freqs, [segment] * len(variants), 
+                                          labels=[variant.label for variant in variants])
+        return super().setSweep(audio, sr, variants, segment.samples, subsample, reduction, 
+                                dtype, keys=keys)
+        
+    def estimateMemory(self, audio, sr, detBankParams, segments, subsample, dtype=np.float64, 
+                       runs=1):
+        """ Return estimated peak memory use of analysing `segments` 
+        
+            Args are as :meth:`.engine.Engine.estimateMemory`, with `segments`
+            as :meth:`setParams`.
+        """
+        return super().estimateMemory(audio, sr, detBankParams, self._ranges(segments), 
+                                      subsample, dtype, runs)
+    
+    def suggestSettings(self, budget, audio, sr, detBankParams, segments, subsample, 
+                        dtype=np.float64, runs=1):
+        """ Return the smallest subsample factor (at least `subsample`) and result 
+            dtype for which analysing `segments` should use less than `budget` bytes,
+            and the memory estimate for them, or None if there isn't one.
             
-            kwargs = {'key':idx}
-            analyser.finished.connect(partial(self._analyserFinished, **kwargs))
+            Other args are as :meth:`estimateMemory`.
+        """
+        return super().suggestSettings(budget, audio, sr, detBankParams, self._ranges(segments), 
+                                       subsample, dtype, runs)
+    
+    @staticmethod
+    def _ranges(segments) -> list:
+        """ Return list of (n0, n1) sample ranges of AudioPlot `segments` """
+        return [segment.samples for segment in segments]
+    
+    def calibrate(self, sr, params, progress=None, finished=None, **kwargs) -> CalibrationWorker:
+        """ Start calibration for DetectorBank `params` in the thread pool 
+        
+            Parameters
+            ----------
+            sr : int
+                Sample rate
+            params : dict
+                Dict of DetectorBank parameters, as returned by ArgsWidget.getArgs
+            progress : callable, optional
+                Slot for :attr:`CalibrationWorker.progress`
+            finished : callable, optional
+                Slot for :attr:`CalibrationWorker.finished`
             
-        numSamples //= subsample
+            Other `kwargs` are passed to :func:`.calibration.calibrate`.
             
-        return numSamples
-        
-    def _analyserFinished(self, result, key):
-        """ Plot `result` and check if all analysers are finished. """
-        self.resultWidget.addData(key, result)
-        self._finished.append(key)
-        
-        if len(self._finished) == len(self.analysers):
-            self.finished.emit()
\ No newline at end of file
+            Returns
+            -------
+            worker : CalibrationWorker
+                Worker running the calibration, which can be cancelled
+        """
+        kwargs.setdefault('defaultBlockDuration', self._applyCalibration(sr, params)[1])
+        worker = CalibrationWorker(sr, params, **kwargs)
+        if progress is not None:
+            worker.progress.connect(progress)
+        if finished is not None:
+            worker.finished.connect(finished)
+        self.threadPool.start(_AnalysisJob(worker))
+        return worker
+    
+    def _plotResult(self, key, result, complete, stop):
+        """ Pass `result` to the result widget """
+        if complete:
+            self.resultWidget.addData(key, result)
+        else:
+            self.resultWidget.addData(key, result, complete=False, stop=stop)
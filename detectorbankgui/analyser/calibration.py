@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Find the number of DetectorBank threads and extraction block duration which
+analyse audio fastest on this machine, for a given set of detectors and sample rate.
+
+This is done by timing the analysis of a short synthetic signal (see `calibrate`).
+Calibrations can be stored in, and read from, a QSettings object, and the
+calibration nearest to the detectors being analysed is then used (see
+`nearestCalibration`).
+"""
+from .extraction import makeDetectorBank, extractResults, withoutProfile
+from dataclasses import dataclass
+import numpy as np
+import os
+import time
+
+@dataclass
+class Calibration:
+    """ Fastest configuration found by :func:`calibrate` """
+    sr: int
+    channels: int
+    numThreads: int
+    blockDuration: int # ms
+    rate: float # seconds of audio analysed per second
+    
+    @property
+    def key(self) -> str:
+        """ Name of settings group for this calibration """
+        return f"{self.sr}-{self.channels}"
+    
+    def __str__(self):
+        return (f"{self.numThreads} threads and {self.blockDuration} ms blocks "
+                f"({self.rate:.3g}x real time)")
+
+def testSignal(sr, duration, fMin, fMax) -> np.ndarray:
+    """ Return `duration` seconds of exponential sine sweep from `fMin` to `fMax` Hz """
+    t = np.arange(int(sr * duration)) / sr
+    if fMax > fMin:
+        k = np.log(fMax / fMin) / duration
+        phase = 2 * np.pi * fMin * (np.exp(k * t) - 1) / k
+    else:
+        phase = 2 * np.pi * fMin * t
+    return 0.5 * np.sin(phase)
+
+def defaultThreadCounts(maxThreads=None) -> list:
+    """ Return powers of two less than `maxThreads` and `maxThreads` itself.
+        
+        If `maxThreads` is not given, the number of cores is used.
+    """
+    if maxThreads is None:
+        maxThreads = os.cpu_count() or 1
+    counts = {maxThreads}
+    n = 1
+    while n < maxThreads:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+def benchmark(sr, audio, params, blockDuration, subsample=1000) -> float:
+    """ Return time, in seconds, taken to make a DetectorBank and analyse `audio` 
+        with `params`, reading results in blocks of `blockDuration` ms
+        
+        If `params` has a 'profile', the DetectorBank is made from it (see
+        :func:`.extraction.makeDetectorBank`), so this can be compared with the
+        time taken to make it from the parameters.
+    """
+    start = time.perf_counter()
+    det = makeDetectorBank(sr, audio, params)
+    result = np.zeros((len(params['detChars']), len(audio) // subsample))
+    blockSize = max(1, int(blockDuration * sr) // 1000)
+    for _ in extractResults(det, result, subsample, blockSize):
+        pass
+    return time.perf_counter() - start
+
+def calibrate(sr, params, duration=1, threadCounts=None, blockDurations=(10, 30, 100, 300),
+              defaultBlockDuration=30, subsample=1000, callback=None, checkState=None):
+    """ Time analysis of a sine sweep across the detectors' frequency range with
+        different numbers of threads and block durations, and return the fastest.
+        
+        Each of the `threadCounts` is timed with `defaultBlockDuration`, then each
+        of the `blockDurations` is timed with the fastest number of threads.
+        
+        Parameters
+        ----------
+        sr : int
+            Sample rate
+        params : dict
+            DetectorBank parameters, as returned by ArgsWidget.getArgs.
+            `numThreads` is ignored.
+        duration : float
+            Length of test signal in seconds
+        threadCounts : list, optional
+            Numbers of threads to try. Defaults to :func:`defaultThreadCounts`
+        blockDurations : list
+            Block durations, in ms, to try
+        defaultBlockDuration : int
+            Block duration with which to time the different numbers of threads
+        subsample : int
+            Subsample factor
+        callback : callable, optional
+            Called with the number of configurations timed and the total number
+            after each one
+        checkState : callable, optional
+            Called before each configuration is timed; if it returns False,
+            calibration is stopped.
+        
+        Returns
+        -------
+        calibration : Calibration
+            Fastest configuration, or None if calibration was stopped
+    """
+    if threadCounts is None:
+        threadCounts = defaultThreadCounts()
+    blockDurations = [d for d in blockDurations if d != defaultBlockDuration]
+    total = len(threadCounts) + len(blockDurations)
+    
+    freqs = np.asarray(params['detChars'])[:, 0]
+    audio = testSignal(sr, duration, freqs.min(), freqs.max())
+    
+    times = {}
+    def run(numThreads, blockDuration):
+        if checkState is not None and not checkState():
+            return False
+        seconds = benchmark(sr, audio, withoutProfile(params, numThreads=numThreads), 
+                            blockDuration, subsample)
+        times[(numThreads, blockDuration)] = seconds
+        if callback is not None:
+            callback(len(times), total)
+        return True
+    
+    for numThreads in threadCounts:
+        if not run(numThreads, defaultBlockDuration):
+            return None
+    numThreads = min(threadCounts, key=lambda n: times[(n, defaultBlockDuration)])
+    for blockDuration in blockDurations:
+        if not run(numThreads, blockDuration):
+            return None
+    
+    (numThreads, blockDuration), seconds = min(times.items(), key=lambda item: item[1])
+    return Calibration(int(sr), len(freqs), numThreads, blockDuration, duration / seconds)
+
+def nearestCalibration(calibrations, sr, channels, maxRatio=2):
+    """ Return the calibration with the closest number of detectors and sample
+        rate to `channels` and `sr`, or None if there isn't one for which both
+        are within a factor of `maxRatio`
+    """
+    maxDistance = abs(np.log(maxRatio))
+    def distances(calibration):
+        return (abs(np.log(channels / calibration.channels)), abs(np.log(sr / calibration.sr)))
+    candidates = [calibration for calibration in calibrations 
+                  if max(distances(calibration)) <= maxDistance]
+    return min(candidates, key=lambda calibration: sum(distances(calibration)), default=None)
+
+def readCalibrations(settings) -> list:
+    """ Return list of calibrations stored in QSettings object `settings` """
+    calibrations = []
+    settings.beginGroup("calibration")
+    for key in settings.childGroups():
+        try:
+            sr, channels = (int(value) for value in key.split("-"))
+            calibration = Calibration(
+                sr, channels,
+                int(settings.value(f"{key}/numThreads")),
+                int(settings.value(f"{key}/blockDuration")),
+                float(settings.value(f"{key}/rate")))
+        except (TypeError, ValueError):
+            continue
+        calibrations.append(calibration)
+    settings.endGroup()
+    return calibrations
+
+def writeCalibration(settings, calibration):
+    """ Store `calibration` in QSettings object `settings` """
+    settings.beginGroup(f"calibration/{calibration.key}")
+    settings.setValue("numThreads", calibration.numThreads)
+    settings.setValue("blockDuration", calibration.blockDuration)
+    settings.setValue("rate", calibration.rate)
+    settings.endGroup()
@@ -0,0 +1,1752 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analysis engine, with no Qt dependency, so that scripts and services can get
+absZ results from DetectorBank without a Qt application.
+
+:class:`Engine` analyses segments of audio and returns or yields the results
+(see :meth:`Engine.analyse` and :meth:`Engine.iterResults`). Progress, partial
+results and finished results are reported through events, which have the
+`connect` and `emit` methods of a Qt signal (see :class:`Event`).
+`Analyser` is a Qt adapter over it, which replaces these with signals.
+
+Each segment is analysed by a `Worker`. These are run in a pool of threads,
+but their events are handled in the thread that runs the engine, so no locking
+is needed. By default, the pool only has one thread, as the DetectorBank is
+already threaded. Workers are queued in the engine's `JobScheduler`, which
+runs those for the segments in `Engine.priorityKeys` first (e.g. the plots
+being shown), then the rest in order. More segments can be added while the
+analysis is running.
+
+Alternatively, the engine can send segments to a pool of worker processes
+(see `ProcessWorker`), with the audio and results in shared memory.
+
+Completed results are kept in the engine's `ResultCache` and, optionally,
+its `DiskResultCache`, so unchanged segments are not recalculated.
+The DetectorBank for each segment is also kept for a while (see `Continuation`),
+so if the end of a segment is moved later, only the new samples are analysed.
+Similarly, if detectors are added, only the new detectors are analysed and
+their results merged with the cached ones. If only the gain has changed and the
+amplitude isn't normalised, cached results are scaled, rather than recalculated.
+If only the subsample factor has changed, results are re-decimated from a cached
+result with a finer factor, if there is one. To make this more likely, segments
+can be analysed at a finer 'base' subsample factor (see `Engine.baseSubsample`).
+DetectorBanks that aren't kept for continuation are returned to the engine's
+`DetectorBankPool`, so that later segments with the same detectors can reuse them
+rather than constructing new ones.
+
+Segments that start at the same sample are analysed in a single DetectorBank pass
+(see `planner`), so their common samples are only integrated once. Long passes
+can also be split into time shards, and large sets of detectors into groups,
+which are analysed in parallel. If 'numThreads' is less than 1, the CPU cores
+are shared between the shards and groups that run at the same time.
+
+Results are read from the DetectorBank in blocks of `Worker.blockDuration` ms,
+rather than one sample at a time. If the engine has a calibration for the
+detectors (see `calibration`), the calibrated block duration is used instead,
+as is the calibrated number of threads if 'numThreads' is less than 1.
+
+Results that would be too large to hold in memory can be memory-mapped to files
+in a scratch directory instead (see `Engine.setScratchEnabled`).
+
+A segment can also be analysed with each combination of a grid of parameter
+values (see `sweep` and `Engine.setSweep`). Each combination is a separate
+DetectorBank run, so these are analysed in parallel by the worker processes.
+"""
+from .extraction import (DetectorBankPool, makeDetectorBank, withoutProfile, isLinearInGain,
+                         extractResults, samplesRequired, Continuation, scaleResult,
+                         redecimate, BlockRedecimator,
+                         channelMap, mergeChannels,
+                         SharedArray, ScratchArray, ProcessJob, analyseInProcess,
+                         CANCELLED, PAUSED, PROGRESS, CONTROL_SIZE)
+from .planner import (SegmentRequest, TimeShard, planPasses, timeShards, channelGroups,
+                      preRollForTolerance)
+from .memory import MemoryEstimate, estimateMemory, suggestSettings
+from .calibration import nearestCalibration
+from .scheduler import JobScheduler
+from .sweep import sweepVariants, numRuns
+from .resultcache import ResultCache, DiskResultCache, ResultKey, audioHash
+import numpy as np
+from functools import partial
+from dataclasses import dataclass, replace
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, CancelledError, wait
+import multiprocessing
+import threading
+import queue
+import tempfile
+import shutil
+import time
+import math
+import os
+
+class _Callbacks:
+    """ Callables connected to an :class:`Event` of one object """
+    def __init__(self):
+        self._slots = []
+        self._lock = threading.Lock()
+    
+    def connect(self, slot):
+        with self._lock:
+            self._slots.append(slot)
+    
+    def disconnect(self, slot=None):
+        """ Disconnect `slot` or, if not given, all slots """
+        with self._lock:
+            if slot is None:
+                self._slots.clear()
+            else:
+                self._slots.remove(slot)
+    
+    def emit(self, *args):
+        with self._lock:
+            slots = list(self._slots)
+        for slot in slots:
+            slot(*args)
+
+class Event:
+    """ Stand-in for a Qt signal, with `connect`, `disconnect` and `emit` methods.
+        
+        Like a Signal, it is declared as a class attribute and each instance has
+        its own connections. Connected callables are called in the thread that
+        emits the event. Qt subclasses can replace events with signals of the
+        same name.
+    """
+    def __set_name__(self, owner, name):
+        self._attr = f"_{name}Callbacks"
+    
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        callbacks = obj.__dict__.get(self._attr, None)
+        if callbacks is None:
+            callbacks = obj.__dict__.setdefault(self._attr, _Callbacks())
+        return callbacks
+
+class Worker:
+    """ Object to perform analysis for a given audio segment
+        
+        Paremeters
+        ----------
+        audio : np.ndarray
+            Array of audio samples
+        sr : int
+            Sample rate of audio
+        params : dict
+            Dict of DetectorBank parameters
+        n0 : int, optional
+            If provided, start analysis from this sample, rather than beginning of `audio`
+        n1 : int, optional
+            If provided, stop analysis at this sample, rather than end of `audio`
+        subsample : int, optional
+            If provided, subsample result by this factor
+        progressIncrement : int
+            Emit `progress` once at least `progressIncrement` samples have
+            been processed (after downsampling)
+        progressInterval : float
+            Minimum time, in seconds, between `progress` events
+        stream : bool
+            If True, emit `blockReady` with new results during the analysis
+        reduction : str
+            How to reduce each `subsample` values to one result value; see
+            :data:`.extraction.REDUCTIONS`
+        dtype : np.dtype
+            dtype of result array
+        continuation : Continuation, optional
+            If provided, continue from the end of this earlier analysis of a
+            segment starting at `n0`, rather than from `n0`.
+        keepAlive : bool
+            If True, keep the DetectorBank when the analysis is complete, so that
+            :attr:`continuation` can be used to extend the segment later.
+        taps : list, optional
+            Offsets from `n0` at which to take extra subsampled results from the
+            same DetectorBank pass. These are stored in :attr:`tapResults`.
+            Cannot be used with `continuation`.
+        scratchDir : str, optional
+            If given, :attr:`result` and :attr:`tapResults` are memory-mapped to
+            files in this directory (see :class:`.extraction.ScratchArray`),
+            rather than held in memory.
+        preRoll : int
+            Number of samples before `n0` with which to drive the detectors
+            before the first result. Cannot be used with `continuation` or `taps`,
+            and the DetectorBank is not kept, even if `keepAlive` is True.
+        bankPool : DetectorBankPool, optional
+            If given, the DetectorBank is taken from this pool, and returned to
+            it when the analysis is finished (unless it is kept for :attr:`continuation`).
+    """
+    
+    progress = Event()
+    """ **event** progress(int `samples`)
+        
+        Emitted with the number of (downsampled) samples processed since it was
+        last emitted, once this is at least `progressIncrement` and at least
+        `progressInterval` seconds have passed.
+    """
+    
+    blockReady = Event()
+    """ **event** blockReady(np.ndarray `block`, int `start`)
+        
+        If `stream` is True, emitted during the analysis with the columns of the
+        result calculated since it was last emitted, starting at column `start`.
+        It is emitted at most every `streamInterval` seconds.
+    """
+    
+    error = Event()
+    """ **event** error(Exception `exc`)
+        
+        Emitted if the analysis failed with `exc`. `finished` is then emitted
+        with the samples that were processed and `complete` False.
+    """
+    
+    finished = Event()
+    """ **event** finished(np.ndarrray `result`, bool `complete`)
+        
+        Emitted when the analysis has finished, with the array of results.
+        If the analysis was cancelled, `result` only contains the samples that
+        were processed and `complete` is False.
+    """
+    
+    blockDuration = 30 # extraction block size in ms
+    
+    def __init__(self, audio, sr, params, n0=None, n1=None, subsample=1, progressIncrement=1,
+                 progressInterval=0.1, stream=False, continuation=None, keepAlive=False,
+                 taps=(), reduction="point", dtype=np.float64, scratchDir=None, preRoll=0,
+                 bankPool=None):
+        super().__init__()
+        
+        self.audio = audio
+        self.sr = sr
+        self.params = params
+        n0 = n0 if n0 is not None else 0
+        n1 = n1 if n1 is not None else len(audio)
+        if n0 < 0:
+            n0 = 0
+        if n1 > len(self.audio):
+            n1 = len(self.audio)
+        self.n0, self.n1 = n0, n1
+        
+        self.channels = len(params['detChars'])
+        self.subsample = int(subsample)
+        self.reduction = reduction
+        self.dtype = np.dtype(dtype)
+        self.progressIncrement = progressIncrement
+        self.progressInterval = progressInterval
+        self.stream = stream
+        self.streamInterval = 0.5
+        self.det = None
+        self.result = None
+        self.preRoll = min(preRoll, self.n0)
+        self.continuation = continuation
+        self.keepAlive = keepAlive and self.preRoll == 0
+        self.taps = list(taps)
+        self.tapResults = {}
+        self.scratchDir = scratchDir
+        self.bankPool = bankPool
+        self._releaseBank = None
+        
+        self._reported = 0
+        self._reportTime = time.monotonic()
+        self._streamed = 0
+        self._streamTime = time.monotonic()
+        
+        self._cancelled = threading.Event()
+        self._unpaused = threading.Event()
+        self._unpaused.set()
+    
+    def _makeDetectorBank(self, params, audioSlice=None):
+        if audioSlice is not None:
+            n0, n1 = audioSlice
+            audio = self.audio[n0:n1]
+        else:
+            audio = self.audio
+        if self.bankPool is not None:
+            self.det = self.bankPool.acquire(self.sr, audio, params)
+            self._releaseBank = partial(self.bankPool.release, self.det, self.sr, params)
+        else:
+            self.det = makeDetectorBank(self.sr, audio, params)
+        channels = self.det.getChans()
+        return channels
+    
+    @property
+    def blockSize(self) -> int:
+        """ Number of samples in each extraction block """
+        return max(1, self.blockDuration * self.sr // 1000)
+    
+    @property
+    def numCols(self) -> int:
+        """ Number of samples in the result, after downsampling """
+        return (self.n1-self.n0) // self.subsample
+    
+    def tapCols(self, skip) -> int:
+        """ Number of columns in the result of the tap at offset `skip` """
+        return max(0, (self.n1-self.n0-skip) // self.subsample)
+    
+    @property
+    def mapped(self) -> bool:
+        """ Return True if results are memory-mapped to scratch files """
+        return self.scratchDir is not None
+    
+    def _newResult(self, numCols) -> np.ndarray:
+        """ Return array of zeros for `numCols` columns of results, which is
+            memory-mapped if :attr:`mapped` is True
+        """
+        if not self.mapped:
+            return np.zeros((self.channels, numCols), dtype=self.dtype)
+        scratch = ScratchArray((self.channels, numCols), self.dtype, self.scratchDir)
+        # the mapping keeps the data after the file has been deleted
+        scratch.unlink()
+        return scratch.array
+    
+    @property
+    def cancelled(self) -> bool:
+        """ Return True if :meth:`cancel` has been called """
+        return self._cancelled.is_set()
+    
+    @property
+    def paused(self) -> bool:
+        """ Return True if the analysis is paused """
+        return not self._unpaused.is_set()
+    
+    def cancel(self):
+        """ Stop the analysis after the current block.
+            
+            `finished` will be emitted with the results calculated so far.
+        """
+        self._cancelled.set()
+        self._unpaused.set() # if paused, wake so we can return
+    
+    def pause(self):
+        """ Pause the analysis after the current block. """
+        self._unpaused.clear()
+    
+    def resume(self):
+        """ Resume paused analysis. """
+        self._unpaused.set()
+    
+    def _checkState(self) -> bool:
+        """ Wait while paused, then return False if cancelled. """
+        self._unpaused.wait()
+        return not self.cancelled
+    
+    def start(self):
+        """ Get subsampled results
+            
+            absZ for all channels is calculated for a block of samples at a time
+            and every `subsample`th sample of the block is copied into `result`.
+            
+            Between blocks, the analysis will wait if paused and stop if cancelled.
+            
+            If the analysis fails, `error` is emitted, then `finished` with the
+            samples that were processed.
+        """
+        idx = 0
+        start, skip, pos = 0, 0, 0
+        failed = False
+        self.result = None
+        
+        try:
+            if self._checkState():
+                if self.continuation is not None:
+                    self.det = self.continuation.det
+                    self._releaseBank = self.continuation.release
+                    self.channels = self.det.getChans()
+                    start = self.continuation.result.shape[1]
+                    skip = self.continuation.skip(self.subsample)
+                    pos = self.continuation.pos
+                else:
+                    # give DetectorBank the rest of the audio, so that it can be continued later
+                    end = len(self.audio) if self.keepAlive else self.n1
+                    self.channels = self._makeDetectorBank(self.params, 
+                                                           audioSlice=(self.n0-self.preRoll, end))
+                    skip = self.preRoll
+                
+                self.result = self._newResult(self.numCols)
+                self.tapResults = {skip:self._newResult(self.tapCols(skip)) for skip in self.taps}
+                if start > 0:
+                    self.result[:, :start] = self.continuation.result
+                    idx = start
+                    self._reportProgress(idx, force=True)
+                    self._streamBlock(self.result, idx, force=True)
+                self.continuation = None
+                
+                blocks = extractResults(self.det, self.result[:, start:], self.subsample, 
+                                        self.blockSize, checkState=self._checkState, skip=skip,
+                                        taps=list(self.tapResults.items()), reduction=self.reduction)
+                for n in blocks:
+                    idx = start + n
+                    self._reportProgress(idx)
+                    self._streamBlock(self.result, idx)
+            
+            if self.keepAlive and idx == self.numCols:
+                pos += samplesRequired(self.numCols - start, self.subsample, skip, self.reduction)
+                self.continuation = Continuation(self.det, self.result, self.n1, pos,
+                                                 release=self._releaseBank)
+                self._releaseBank = None
+        except Exception as exc:
+            failed = True
+            self.continuation = None
+            self.error.emit(exc)
+        finally:
+            if self._releaseBank is not None:
+                self._releaseBank()
+            self._releaseBank = None
+            # don't hold on to DetectorBank (and its buffers) any longer than necessary
+            self.det = None
+        
+        if self.result is None:
+            # cancelled (or failed) before starting
+            self.result = np.zeros((self.channels, 0), dtype=self.dtype)
+        self._finish(idx, failed)
+    
+    def _reportProgress(self, idx, force=False):
+        """ Emit `progress` if at least `progressIncrement` more columns have been
+            done and `progressInterval` has passed since it was last emitted
+            (or if `force` is True)
+        """
+        if idx <= self._reported:
+            return
+        now = time.monotonic()
+        due = (idx - self._reported >= self.progressIncrement
+               and now - self._reportTime >= self.progressInterval)
+        if due or force:
+            self.progress.emit(idx - self._reported)
+            self._reported = idx
+            self._reportTime = now
+    
+    def _streamBlock(self, result, idx, force=False):
+        """ If streaming, emit `blockReady` with the columns of `result` up to `idx`
+            that haven't been emitted, if `streamInterval` has passed since it was
+            last emitted (or if `force` is True)
+        """
+        if not self.stream or idx <= self._streamed:
+            return
+        now = time.monotonic()
+        if force or now - self._streamTime >= self.streamInterval:
+            self.blockReady.emit(result[:, self._streamed:idx].copy(), self._streamed)
+            self._streamed = idx
+            self._streamTime = now
+    
+    def _finish(self, idx, failed=False):
+        """ Emit final progress and `finished`, given that `idx` columns were 
+            calculated and whether the analysis `failed`
+        """
+        self._reportProgress(idx, force=True)
+        
+        complete = idx == self.numCols and not failed
+        # keep a copy of a partial result, so the full buffer can be freed
+        # (unless it is memory-mapped, when the copy might not fit in memory)
+        truncate = (lambda arr, n: arr[:, :n]) if self.mapped else (lambda arr, n: arr[:, :n].copy())
+        if self.result.shape[1] > idx:
+            self.result = truncate(self.result, idx)
+        if not complete:
+            # taps are at most one column behind the result
+            self.tapResults = {skip:truncate(tap, max(0, idx-1)) for skip, tap in self.tapResults.items()}
+        
+        self.finished.emit(self.result, complete)
+
+class ProcessWorker(Worker):
+    """ Worker that runs the DetectorBank in a worker process.
+        
+        The audio is read from `sharedAudio`, rather than being pickled, and the
+        result is written to shared memory by the worker process.
+        :meth:`start` blocks the calling thread until the process has finished,
+        emitting `progress` as it goes.
+        
+        Parameters
+        ----------
+        sharedAudio : SharedArray
+            Audio in shared memory
+        executor : concurrent.futures.ProcessPoolExecutor
+            Process pool in which to run the analysis
+        
+        Other args are as :class:`Worker`.
+    """
+    
+    def __init__(self, sharedAudio, executor, *args, pollInterval=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sharedAudio = sharedAudio
+        self.executor = executor
+        self.pollInterval = pollInterval
+    
+    def start(self):
+        """ Analyse segment in worker process and wait for the result
+            
+            If the job fails, `error` is emitted, then `finished` with the
+            samples that were written before it failed.
+        """
+        idx = 0
+        
+        if not self._checkState():
+            # cancelled before starting
+            self.result = np.zeros((self.channels, 0), dtype=self.dtype)
+            self._finish(idx)
+            return
+        
+        result = self._newSharedResult(self.numCols)
+        control = SharedArray((CONTROL_SIZE,), np.int64)
+        control.array[:] = 0
+        taps = {skip:self._newSharedResult(self.tapCols(skip)) for skip in self.taps}
+        job = ProcessJob(self.sharedAudio.spec, result.spec, control.spec, self.sr,
+                         self.params, self.n0, self.n1, self.subsample, self.blockSize,
+                         taps=tuple((skip, tap.spec) for skip, tap in taps.items()),
+                         reduction=self.reduction, scratch=self.mapped, preRoll=self.preRoll)
+        
+        failed = False
+        try:
+            future = self.executor.submit(analyseInProcess, job)
+            done = False
+            while not done:
+                done, _ = wait([future], timeout=self.pollInterval)
+                # pass state to worker process and get its progress
+                control.array[CANCELLED] = self.cancelled
+                control.array[PAUSED] = self.paused
+                progress = int(control.array[PROGRESS])
+                self._reportProgress(progress)
+                self._streamBlock(result.array, progress)
+            idx = future.result()
+        except CancelledError:
+            # job was cancelled (e.g. the pool was shut down); keep whatever had been written
+            idx = int(control.array[PROGRESS])
+        except Exception as exc:
+            # keep whatever had been written, but it isn't a complete result
+            idx = int(control.array[PROGRESS])
+            failed = True
+            self.error.emit(exc)
+        
+        if self.mapped:
+            # parent's mapping of the scratch files is kept after they're deleted
+            self.result = result.array[:, :idx]
+            self.tapResults = {skip:tap.array for skip, tap in taps.items()}
+        else:
+            self.result = result.array[:, :idx].copy()
+            self.tapResults = {skip:tap.array.copy() for skip, tap in taps.items()}
+        for arr in [result, control] + list(taps.values()):
+            arr.unlink()
+        
+        self._finish(idx, failed)
+    
+    def _newSharedResult(self, numCols):
+        """ Return SharedArray of zeros for `numCols` columns of results, or a
+            ScratchArray if :attr:`mapped` is True
+        """
+        shape = (self.channels, numCols)
+        if self.mapped:
+            # new file is already zeros
+            return ScratchArray(shape, self.dtype, self.scratchDir)
+        shared = SharedArray(shape, self.dtype)
+        shared.array[:] = 0
+        return shared
+
+class _ChannelBlocks:
+    """ Joins partial results from workers analysing groups of channels of the
+        same samples into blocks of all channels, which are passed to `callback`
+        with the column at which they start
+    """
+    def __init__(self, numGroups, callback):
+        self._pending = [[] for _ in range(numGroups)]
+        self._start = 0
+        self._callback = callback
+    
+    def add(self, group, block, start):
+        """ Add `block` from channel `group`; `start` is ignored, as each group's
+            blocks arrive in order
+        """
+        self._pending[group].append(block)
+        numCols = min(sum(b.shape[1] for b in blocks) for blocks in self._pending)
+        if numCols == 0:
+            return
+        pending = [np.concatenate(blocks, axis=1) for blocks in self._pending]
+        self._pending = [[blocks[:, numCols:]] for blocks in pending]
+        joined = np.concatenate([blocks[:, :numCols] for blocks in pending], axis=0)
+        self._callback(joined, self._start)
+        self._start += numCols
+
+class _ShardedPass:
+    """ Combines the results of the workers analysing parts of a pass
+        
+        `workers` is a list with a list of workers for each time shard (see
+        :func:`.planner.timeShards`), each of which analyses one group of
+        channels (see :func:`.planner.channelGroups`). `offsets` are the
+        columns of the pass result at which the time shards start.
+        
+        Partial results are joined into blocks of all channels and passed to
+        `blockReady`, with the column of the pass result at which they start
+        and this object. When all workers have finished, `finished` is called
+        with the combined result, whether it is complete and this object,
+        which has the attributes of Worker that `Engine._analyserFinished` uses.
+        
+        Workers' events are connected with `connect(event, slot)`.
+        
+        If `scratchDir` is given, the combined result is memory-mapped.
+    """
+    def __init__(self, workers, offsets, subsample, finished, blockReady, connect, scratchDir=None):
+        self.subsample = subsample
+        self.tapResults = {}
+        self.continuation = None
+        self.scratchDir = scratchDir
+        self._results = [[None] * len(row) for row in workers]
+        self._finished = finished
+        for t, (row, offset) in enumerate(zip(workers, offsets)):
+            callback = partial(self._blockReady, blockReady, offset)
+            if len(row) > 1:
+                callback = _ChannelBlocks(len(row), callback).add
+            for g, worker in enumerate(row):
+                connect(worker.finished, partial(self._workerFinished, t, g))
+                if len(row) > 1:
+                    connect(worker.blockReady, partial(callback, g))
+                else:
+                    connect(worker.blockReady, callback)
+    
+    def _blockReady(self, blockReady, offset, block, start):
+        """ Pass `block` of time shard starting at column `offset` to `blockReady` """
+        blockReady(block, start + offset, analyser=self)
+    
+    def _workerFinished(self, t, g, result, complete):
+        """ Store `result` of channel group `g` of time shard `t` and, if it is
+            the last, combine all results
+        """
+        self._results[t][g] = (result, complete)
+        if any(item is None for row in self._results for item in row):
+            return
+        # combined result is only contiguous as far as the first incomplete shard
+        # and, within that, the shortest group
+        shards = []
+        for row in self._results:
+            numCols = min(result.shape[1] for result, _ in row)
+            complete = all(c for _, c in row)
+            shards.append(([result for result, _ in row], numCols))
+            if not complete:
+                break
+        results, _ = shards[0]
+        shape = (sum(result.shape[0] for result in results), sum(numCols for _, numCols in shards))
+        if self.scratchDir is not None:
+            scratch = ScratchArray(shape, results[0].dtype, self.scratchDir)
+            scratch.unlink()
+            combined = scratch.array
+        else:
+            combined = np.empty(shape, dtype=results[0].dtype)
+        c0 = 0
+        for results, numCols in shards:
+            r0 = 0
+            for result in results:
+                combined[r0:r0+result.shape[0], c0:c0+numCols] = result[:, :numCols]
+                r0 += result.shape[0]
+            c0 += numCols
+        self._results = [[None] * len(row) for row in self._results]
+        self._finished(combined, complete, analyser=self)
+
+@dataclass(frozen=True)
+class _BaseKey:
+    """ Key of a segment analysed at a finer subsample factor, whose result is
+        re-decimated by `factor` to give the result for `key`
+    """
+    key: object
+    factor: int
+    reduction: str
+
+class Engine:
+    """ Object to manage DetectorBank calculations for audio segments.
+        
+        Parameters
+        ----------
+        numProcesses : int
+            If greater than 1, analyse segments in a pool of this many worker
+            processes, rather than one after another in this process.
+        cacheSize : int
+            Memory budget, in bytes, of the result cache
+        maxContinuations : int
+            Number of DetectorBanks to keep after analysis, so that extended
+            segments only need the new samples to be analysed. Each holds the
+            audio from the start of its segment to the end of the file, which
+            is included in :meth:`estimateMemory`.
+        
+        Segments are given to :meth:`setParams` and analysed with :meth:`run`,
+        or both can be done at once with :meth:`analyse` or :meth:`iterResults`.
+        
+        If :attr:`streamResults` is True, `blockReady` is emitted with partial
+        results during the analysis.
+        
+        :attr:`calibrations` is a list of :class:`.calibration.Calibration`; the
+        one nearest to the current detectors and sample rate (if it is within
+        a factor of 2 of both; see :func:`.calibration.nearestCalibration`) sets
+        the block duration and, if 'numThreads' is less than 1, the number of threads.
+        
+        If :attr:`scratchDir` is set (see :meth:`setScratchEnabled`), results
+        of at least :attr:`scratchThreshold` bytes are memory-mapped to files
+        in that directory. These results are not streamed, as that would need
+        a copy of them in memory.
+        
+        Segments that start at the same sample are analysed by a single DetectorBank.
+        If :attr:`mergeOverlapping` is True, all overlapping segments are; see
+        :mod:`.planner` for why this is not the default.
+        
+        If :attr:`timeShards` is greater than 1, each pass is split into this many
+        shards, which are analysed in parallel if :attr:`numProcesses` is greater
+        than 1. Each shard after the first has a pre-roll of :attr:`shardPreRoll`
+        seconds or, if that is None, long enough that the results are within
+        :attr:`shardTolerance` of the serial result (see :mod:`.planner`).
+        As they are approximate, sharded results are not cached.
+        
+        If :attr:`frequencyShards` is greater than 1, the detectors are split
+        into this many groups, each of which is analysed by its own DetectorBank
+        (in parallel, if :attr:`numProcesses` is greater than 1) and the results
+        are joined. These results are exact.
+        
+        If only the subsample factor has changed, results are re-decimated
+        from a cached result whose factor divides the new one, rather than
+        analysed again. If :attr:`baseSubsample` is set, segments are analysed
+        at the greatest common divisor of this and the subsample factor (if it
+        is smaller than the subsample factor), so the finer result is cached.
+        This is only done if the finer results (apart from those that are 
+        memory-mapped) would use at most :attr:`baseResultBudget` bytes.
+    """
+    
+    progress = Event()
+    """ **event** progress(int `samples`)
+        
+        Emitted with the number of samples processed, when a cached result is
+        used and at most every `Worker.progressInterval` seconds by each Worker.
+    """
+    
+    blockReady = Event()
+    """ **event** blockReady(object `key`, np.ndarray `block`, int `start`, int `size`)
+        
+        If :attr:`streamResults` is True, emitted during the analysis with the
+        partial result `block` for segment `key`, which starts at column `start`
+        of the result, which will have `size` columns.
+    """
+    
+    resultReady = Event()
+    """ **event** resultReady(object `key`, np.ndarray `result`, bool `complete`, int `stop`)
+        
+        Emitted with the result for segment `key`. If the analysis was cancelled,
+        `complete` is False and `stop` is the sample at which `result` ends,
+        otherwise it is None.
+    """
+    
+    error = Event()
+    """ **event** error(Exception `exc`)
+        
+        Emitted if a worker failed with `exc`. The results of its segments are
+        emitted as incomplete.
+    """
+    
+    finished = Event()
+    """ **event** finished()
+        
+        Emitted when all segments have been analysed, or analysis has been cancelled.
+    """
+    
+    workerClass = Worker
+    processWorkerClass = ProcessWorker
+    
+    def __init__(self, numProcesses=1, cacheSize=512*2**20, maxContinuations=8):
+        super().__init__()
+        self.analysers = []
+        self._cached = []
+        self._finished = []
+        self._numSegments = 0
+        self._started = False
+        self._queued = []
+        self._derived = {}
+        self._paused = False
+        self._toAnalyse = 0
+        self._analysed = 0
+        self._startTime = None
+        self._pauseTime = None
+        self.mergeOverlapping = False
+        self.streamResults = False
+        self._threadExecutor = None
+        self._futures = []
+        self._errors = []
+        self._events = queue.SimpleQueue()
+        self._executor = None
+        self._sharedAudio = {}
+        self._numProcesses = max(1, int(numProcesses))
+        self.scheduler = JobScheduler(self._submit, self._numProcesses)
+        self.resultCache = ResultCache(cacheSize)
+        self.diskCache = None
+        self._audioHash = (None, None)
+        self._continuations = OrderedDict()
+        self.maxContinuations = maxContinuations
+        self.bankPool = DetectorBankPool()
+        self.scratchDir = None
+        self.scratchThreshold = 256*2**20
+        self.calibrations = []
+        self._blockDuration = self.workerClass.blockDuration
+        self.timeShards = 1
+        self.frequencyShards = 1
+        self.shardPreRoll = None
+        self.shardTolerance = 1e-3
+        self.baseSubsample = None
+        self.baseResultBudget = 256*2**20
+        self._decimators = {}
+    
+    @property
+    def numProcesses(self) -> int:
+        """ Number of worker processes used to analyse segments """
+        return self._numProcesses
+    
+    @numProcesses.setter
+    def numProcesses(self, value):
+        value = max(1, int(value))
+        if self._executor is not None and value != self._numProcesses:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._numProcesses = value
+        # each thread waits on one process, so segments are analysed concurrently
+        self._setThreadCount(value)
+        self.scheduler.maxRunning = value
+    
+    def _setThreadCount(self, value):
+        """ Set number of threads in which workers are run """
+        if self._threadExecutor is not None:
+            self._threadExecutor.shutdown(wait=False)
+            self._threadExecutor = None
+    
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """ Process pool, created the first time it is needed """
+        if self._executor is None:
+            # don't fork the GUI process
+            context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.numProcesses, mp_context=context)
+        return self._executor
+    
+    def shutdown(self):
+        """ Cancel analysis and stop any worker processes """
+        self.cancel()
+        self.wait()
+        if self._threadExecutor is not None:
+            self._threadExecutor.shutdown()
+            self._threadExecutor = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._releaseSharedAudio()
+        self._continuations.clear()
+        self.bankPool.clear()
+        self.setScratchEnabled(False)
+    
+    def _releaseSharedAudio(self):
+        for sharedAudio in self._sharedAudio.values():
+            sharedAudio.unlink()
+        self._sharedAudio.clear()
+    
+    def start(self):
+        """ Emit `resultReady` for cached results and queue the workers for the
+            other segments in :attr:`scheduler`, which runs them in the thread pool.
+            
+            If the analysis is already running, the new segments are added to it.
+        """
+        cached, self._cached = self._cached, []
+        queued, self._queued = self._queued, []
+        if self._startTime is None:
+            self._startTime = time.monotonic()
+        self._started = True
+        for key, result in cached:
+            self.progress.emit(result.shape[1])
+            self._addResult(key, result)
+        for analyser, keys in queued:
+            if self._paused:
+                analyser.pause()
+            self.scheduler.add(analyser, keys)
+        self.scheduler.dispatch()
+    
+    @property
+    def priorityKeys(self) -> frozenset:
+        """ Keys of segments which are analysed before the others """
+        return self.scheduler.priorityKeys
+    
+    def setPriorityKeys(self, keys):
+        """ Analyse the segments with any of `keys` before the others.
+            
+            Workers that are already running are not interrupted.
+        """
+        self.scheduler.setPriorityKeys(keys)
+    
+    def _submit(self, worker):
+        """ Run `worker` in the thread pool """
+        if self._threadExecutor is None:
+            self._threadExecutor = ThreadPoolExecutor(max_workers=self.numProcesses)
+        self._futures.append(self._threadExecutor.submit(worker.start))
+    
+    def _connect(self, event, slot):
+        """ Connect worker `event` to `slot`, which will be called in the thread
+            running :meth:`run`, rather than the worker's thread
+        """
+        events = self._events
+        event.connect(lambda *args: events.put((slot, args)))
+    
+    def run(self, pollInterval=0.1):
+        """ Start the analysis and handle workers' events in this thread until
+            it has finished.
+            
+            If a worker fails, the analysis is cancelled and its exception is
+            raised here.
+        """
+        self.start()
+        for _ in self._handleEvents(pollInterval):
+            pass
+    
+    def _handleEvents(self, pollInterval=0.1):
+        """ Handle workers' events, yielding after each one, until the analysis
+            has finished
+        """
+        while self.running:
+            try:
+                slot, args = self._events.get(timeout=pollInterval)
+            except queue.Empty:
+                for future in self._futures:
+                    if future.done() and future.exception() is not None:
+                        self.cancel()
+                        raise future.exception()
+                continue
+            slot(*args)
+            if self._errors:
+                exc, self._errors = self._errors[0], []
+                self.cancel()
+                raise exc
+            yield
+    
+    def iterResults(self, audio, sr, detBankParams, segments, subsample=1, reduction="point",
+                    dtype=np.float64):
+        """ Analyse `segments` of `audio` in this thread, yielding results as
+            they are finished.
+            
+            Args are as :meth:`setParams`.
+            
+            Yields
+            ------
+            idx : int
+                Index of segment in `segments`
+            result : np.ndarray
+                Result for the segment
+            complete : bool
+                False if the analysis was cancelled before the segment was finished
+        """
+        yield from self._iterResults(partial(self.setParams, audio, sr, detBankParams, segments,
+                                             subsample, reduction, dtype))
+    
+    def _iterResults(self, setup):
+        """ Call `setup` to set the segments to analyse, then analyse them in
+            this thread, yielding key, result and whether it is complete as
+            each one is finished.
+        """
+        done = []
+        collect = lambda key, result, complete, stop: done.append((key, result, complete))
+        self.resultReady.connect(collect)
+        try:
+            setup()
+            self.start()
+            for _ in self._handleEvents():
+                while done:
+                    yield done.pop(0)
+            yield from done
+        finally:
+            self.resultReady.disconnect(collect)
+            if self.running:
+                # generator was closed early, so stop the workers and handle their results
+                self.cancel()
+                for _ in self._handleEvents():
+                    pass
+    
+    def analyse(self, audio, sr, detBankParams, segments, subsample=1, reduction="point",
+                dtype=np.float64, progress=None) -> list:
+        """ Analyse `segments` of `audio` in this thread and return list of results.
+            
+            If given, `progress` is called with the number of (downsampled) samples
+            analysed since it was last called.
+            
+            Other args are as :meth:`setParams`.
+        """
+        results = [None] * len(segments)
+        if progress is not None:
+            self.progress.connect(progress)
+        try:
+            for idx, result, _ in self.iterResults(audio, sr, detBankParams, segments,
+                                                   subsample, reduction, dtype):
+                results[idx] = result
+        finally:
+            if progress is not None:
+                self.progress.disconnect(progress)
+        return results
+    
+    def sweep(self, audio, sr, detBankParams, grid, segment, subsample=1, reduction="point",
+              dtype=np.float64) -> list:
+        """ Analyse `segment` of `audio` in this thread with each combination of
+            the parameter values in `grid`.
+            
+            `grid` is a dict of parameter names and lists of values (see
+            :func:`.sweep.sweepVariants`). Other args are as :meth:`setSweep`.
+            
+            Returns
+            -------
+            results : list
+                List of (:class:`.sweep.SweepVariant`, np.ndarray) pairs
+        """
+        variants = sweepVariants(detBankParams, grid)
+        results = [None] * len(variants)
+        setup = partial(self.setSweep, audio, sr, variants, segment, subsample, reduction, dtype)
+        for idx, result, _ in self._iterResults(setup):
+            results[idx] = result
+        return list(zip(variants, results))
+    
+    def wait(self, msecs=-1) -> bool:
+        """ Block until all workers have finished, or `msecs` have elapsed.
+            
+            Returns True if all workers finished.
+        """
+        timeout = None if msecs < 0 else msecs / 1000
+        _, notDone = wait(self._futures, timeout=timeout)
+        return len(notDone) == 0
+    
+    @property
+    def running(self) -> bool:
+        """ Return True if any workers have not finished """
+        return len(self._finished) < self._numSegments
+    
+    @property
+    def started(self) -> bool:
+        """ Return True if :meth:`start` has been called and the analysis hasn't finished """
+        return self._started and self.running
+    
+    @property
+    def paused(self) -> bool:
+        """ Return True if the analysis is paused """
+        return self._paused
+    
+    @property
+    def eta(self):
+        """ Estimated time, in seconds, until the analysis is finished, or None
+            if it can't be estimated yet
+        """
+        if self._startTime is None or self._analysed == 0 or self.paused:
+            return None
+        elapsed = time.monotonic() - self._startTime
+        return max(0, self._toAnalyse - self._analysed) * elapsed / self._analysed
+    
+    def _workerProgress(self, inc):
+        """ Count `inc` more samples analysed and emit `progress` """
+        self._analysed += inc
+        self.progress.emit(inc)
+    
+    def cancel(self):
+        """ Cancel all workers.
+            
+            Those that are running will stop after their current block; those
+            that have not yet started will finish immediately without analysing.
+            Partial results are still emitted.
+        """
+        self._paused = False
+        for analyser in self.analysers:
+            analyser.cancel()
+        if self._started:
+            # queued workers finish immediately, with empty results
+            self.scheduler.flush()
+    
+    def pause(self):
+        """ Pause all workers. """
+        if not self._paused:
+            self._pauseTime = time.monotonic()
+        self._paused = True
+        for analyser in self.analysers:
+            analyser.pause()
+    
+    def resume(self):
+        """ Resume all workers. """
+        if self._paused and self._startTime is not None:
+            # don't count time spent paused in the ETA
+            self._startTime += time.monotonic() - self._pauseTime
+        self._paused = False
+        for analyser in self.analysers:
+            analyser.resume()
+    
+    def setParams(self, audio, sr, detBankParams, segments, subsample, reduction="point",
+                  dtype=np.float64, keys=None) -> int:
+        """ Set all parameters needed for analysis
+            
+            Parameters
+            ----------
+            audio : np.ndarray
+                Array of audio samples
+            sr : int
+                Sample rate of audio
+            detBankParams : dict
+                Dict of DetectorBank parameters, as returned by ArgsWidget.getArgs
+            segments : list
+                List of (n0, n1) sample ranges
+            subsample : int
+                subsample factor
+            reduction : str
+                How to reduce each `subsample` samples to one value; see
+                :data:`.extraction.REDUCTIONS`
+            dtype : np.dtype
+                dtype of results
+            keys : list, optional
+                Key for each segment, with which results are emitted.
+                Defaults to the index of each segment.
+            
+            If the analysis has been started and hasn't finished, these segments
+            are added to it when :meth:`start` is called, so `keys` should be
+            different to those of the segments already being analysed.
+            
+            Returns
+            -------
+            numSamples : int
+                Number of samples that will be analysed for these segments, after downsampling
+        """
+        if not self.started:
+            self._reset()
+        return self._addSegments(audio, sr, detBankParams, segments, subsample, reduction,
+                                 dtype, keys)
+    
+    def setSweep(self, audio, sr, variants, segment, subsample, reduction="point",
+                 dtype=np.float64, keys=None) -> int:
+        """ Set parameters to analyse `segment` with each of the sweep `variants`
+            
+            Variants that are scaled from another's result are emitted when 
+            that result is ready. The others are analysed in parallel if 
+            :attr:`numProcesses` is greater than 1, in which case, if their 
+            'numThreads' is less than 1, the CPU cores are shared between them.
+            
+            Parameters
+            ----------
+            audio : np.ndarray
+                Array of audio samples
+            sr : int
+                Sample rate of audio
+            variants : list
+                List of :class:`.sweep.SweepVariant`, as returned by 
+                :func:`.sweep.sweepVariants`
+            segment : tuple
+                (n0, n1) sample range
+            subsample : int
+                subsample factor
+            reduction : str
+                How to reduce each `subsample` samples to one value; see
+                :data:`.extraction.REDUCTIONS`
+            dtype : np.dtype
+                dtype of results
+            keys : list, optional
+                Key for each variant, with which results are emitted.
+                Defaults to the index of each variant.
+            
+            Returns
+            -------
+            numSamples : int
+                Number of samples that will be analysed, after downsampling
+        """
+        if not self.started:
+            self._reset()
+        if keys is None:
+            keys = range(len(variants))
+        keys = list(keys)
+        runs = numRuns(variants)
+        parallel = max(1, min(self.numProcesses, runs))
+        numThreads = max(1, (os.cpu_count() or 1) // parallel)
+        n0, n1 = max(segment[0], 0), min(segment[1], len(audio))
+        numSamples = 0
+        for key, variant in zip(keys, variants):
+            params = variant.params
+            if parallel > 1 and params['numThreads'] < 1:
+                params = dict(params, numThreads=numThreads)
+            if variant.analysed:
+                # share the budget for finer results between the runs
+                numSamples += self._addSegments(audio, sr, params, [(n0, n1)], subsample,
+                                                reduction, dtype, keys=[key],
+                                                baseBudget=self.baseResultBudget // runs)
+            else:
+                self._derived.setdefault(keys[variant.source], []).append(
+                    (key, partial(scaleResult, scale=variant.scale, scratchDir=self.scratchDir)))
+                self._numSegments += 1
+        return numSamples
+    
+    def _reset(self):
+        """ Clear the segments and workers of the previous analysis """
+        self.analysers = []
+        self._cached = [] # list of (key, result) pairs from cache
+        self._queued = [] # list of (worker, keys) pairs to add to the scheduler
+        self._finished = [] # list of keys of segments that have been finished
+        self._derived = {} # keys of segments with lists of (key, function) of results derived from them
+        self._decimators = {} # BlockRedecimator for each streamed _BaseKey
+        self._numSegments = 0
+        self._started = False
+        self._paused = False
+        self._analysed = 0
+        self._toAnalyse = 0
+        self._startTime = None
+        self._futures = []
+        self._errors = []
+        self._events = queue.SimpleQueue()
+        self.scheduler.clear()
+        self._releaseSharedAudio()
+    
+    def _addSegments(self, audio, sr, detBankParams, segments, subsample, reduction, dtype,
+                     keys=None, baseBudget=None, autoThreads=None) -> int:
+        """ Add workers or cached results for `segments`
+            
+            `baseBudget` is the budget for finer results of these segments; if
+            not given, it is :attr:`baseResultBudget`. `autoThreads` is whether
+            the number of threads was 'Auto' before calibration; if not given,
+            it is whether `detBankParams['numThreads']` is less than 1. Other 
+            args and return value are as :meth:`setParams`.
+        """
+        numAnalysers, numCached = len(self.analysers), len(self._cached)
+        self._numSegments += len(segments)
+        if autoThreads is None:
+            autoThreads = detBankParams['numThreads'] < 1
+        detBankParams, self._blockDuration = self._applyCalibration(sr, detBankParams)
+        if keys is None:
+            keys = range(len(segments))
+        audioKey = self._getAudioHash(audio)
+        requests = []
+        for idx, (n0, n1) in zip(keys, segments):
+            n0, n1 = max(n0, 0), min(n1, len(audio))
+            
+            cacheKey = ResultKey.make(audioKey, n0, n1, detBankParams, subsample, reduction, dtype)
+            if (result := self._getCachedResult(cacheKey)) is not None:
+                self._cached.append((idx, result))
+                continue
+            if (result := self._getRescaledResult(cacheKey, detBankParams)) is not None:
+                # only the gain has changed, so scale the previous result
+                self.resultCache.put(cacheKey, result)
+                self._cached.append((idx, result))
+                continue
+            if (result := self._getRedecimatedResult(cacheKey)) is not None:
+                # only the subsample factor has changed, so re-decimate a finer result
+                self.resultCache.put(cacheKey, result)
+                self._cached.append((idx, result))
+                continue
+            requests.append(SegmentRequest(idx, n0, n1, cacheKey))
+        
+        if baseBudget is None:
+            baseBudget = self.baseResultBudget
+        if (base := self._baseSubsampleFor(requests, subsample, detBankParams, dtype,
+                                           baseBudget)) is not None:
+            # analyse at a finer subsample factor, and re-decimate the results when finished
+            factor = subsample // base
+            baseKeys = []
+            for request in requests:
+                baseKey = _BaseKey(request.key, factor, reduction)
+                baseKeys.append(baseKey)
+                self._derived.setdefault(baseKey, []).append(
+                    (request.key, partial(redecimate, factor=factor, reduction=reduction)))
+            numSamples = sum(result.shape[1] for _, result in self._cached[numCached:])
+            return numSamples + self._addSegments(audio, sr, detBankParams, 
+                                                  [(r.n0, r.n1) for r in requests], base,
+                                                  reduction, dtype, keys=baseKeys,
+                                                  autoThreads=autoThreads)
+        
+        for analysisPass in planPasses(requests, self.mergeOverlapping):
+            n0, n1 = analysisPass.n0, analysisPass.n1
+            passKey = ResultKey.make(audioKey, n0, n1, detBankParams, subsample, reduction, dtype)
+            taps = analysisPass.tapSkips(subsample)
+            
+            if len(taps) > 0:
+                # segments with different subsample phases can't use cached results
+                analyser = self._makeWorker(audio, sr, detBankParams, n0, n1, subsample,
+                                            reduction, dtype, keepAlive=False, taps=taps)
+                self._addWorker(analyser, analysisPass, passKey)
+                continue
+            
+            if (passKey not in [segment.cacheKey for segment in analysisPass.segments]
+                    and (result := self._getCachedResult(passKey)) is not None):
+                # merged segments have been analysed together before
+                self._addCachedPass(analysisPass, result, subsample)
+                continue
+            
+            chanMap, source = self._getChannelSource(passKey)
+            if source is not None and np.all(chanMap >= 0):
+                # only removed (or reordered) detectors, so take rows from cached result
+                result = source[chanMap]
+                self.resultCache.put(passKey, result)
+                self._addCachedPass(analysisPass, result, subsample)
+                continue
+            elif source is not None:
+                # only analyse new detectors and merge with cached result when finished
+                params = withoutProfile(detBankParams, detChars=detBankParams['detChars'][chanMap < 0])
+                analyser = self._makeWorker(audio, sr, params, n0, n1, subsample,
+                                            reduction, dtype, keepAlive=False)
+                self._addWorker(analyser, analysisPass, passKey, channelSource=(chanMap, source))
+                continue
+            
+            continuation = self._getContinuation(passKey)
+            if continuation is not None and continuation.n1 >= n1:
+                # segment has been shortened, so result is the start of the previous one
+                result = continuation.result[:, :(n1-n0)//subsample]
+                self._continuations[self._continuationKey(passKey)] = continuation
+                self.resultCache.put(passKey, result)
+                self._addCachedPass(analysisPass, result, subsample)
+                continue
+            
+            if continuation is None and self._shouldShard(analysisPass, subsample,
+                                                          len(detBankParams['detChars'])):
+                self._addShards(audio, sr, detBankParams, analysisPass, passKey, subsample,
+                                reduction, dtype, autoThreads)
+                continue
+            
+            analyser = self._makeWorker(audio, sr, detBankParams, n0, n1, subsample,
+                                        reduction, dtype, continuation=continuation,
+                                        keepAlive=self.maxContinuations > 0)
+            self._addWorker(analyser, analysisPass, passKey)
+        
+        toAnalyse = sum(analyser.numCols for analyser in self.analysers[numAnalysers:])
+        self._toAnalyse += toAnalyse
+        numSamples = sum(result.shape[1] for _, result in self._cached[numCached:]) + toAnalyse
+        
+        return numSamples
+    
+    def estimateMemory(self, audio, sr, detBankParams, segments, subsample,
+                       dtype=np.float64, runs=1) -> MemoryEstimate:
+        """ Return estimated peak memory use of analysing `segments`
+            
+            If `segments` are analysed with more than one set of parameters (e.g.
+            in a sweep), `runs` is the number of sets.
+            
+            Other args are as :meth:`setParams`.
+        """
+        return estimateMemory(subsample=subsample, dtype=dtype,
+                              **self._memoryArgs(audio, sr, detBankParams, segments, runs))
+    
+    def suggestSettings(self, budget, audio, sr, detBankParams, segments, subsample,
+                        dtype=np.float64, runs=1):
+        """ Return the smallest subsample factor (at least `subsample`) and result
+            dtype for which analysing `segments` should use less than `budget` bytes,
+            and the memory estimate for them, or None if there isn't one.
+            
+            Other args are as :meth:`estimateMemory`.
+        """
+        return suggestSettings(budget, subsample, dtype,
+                               **self._memoryArgs(audio, sr, detBankParams, segments, runs))
+    
+    def _memoryArgs(self, audio, sr, detBankParams, segments, runs=1) -> dict:
+        """ Return dict of args for :func:`.memory.estimateMemory` """
+        return {'numSamples':len(audio),
+                'segments':list(segments),
+                'runs':runs,
+                'channels':len(detBankParams['detChars']),
+                'blockSize':max(1, self._applyCalibration(sr, detBankParams)[1] * sr // 1000),
+                'numProcesses':self.numProcesses,
+                'mergeOverlapping':self.mergeOverlapping,
+                'scratchThreshold':self.scratchThreshold if self.scratchDir is not None else None,
+                'timeShards':self.timeShards,
+                'frequencyShards':self.frequencyShards,
+                'maxContinuations':self.maxContinuations}
+    
+    def _makeWorker(self, audio, sr, params, n0, n1, subsample, reduction, dtype,
+                    continuation=None, keepAlive=True, taps=(), preRoll=0, passShape=None):
+        """ Return :attr:`workerClass` or :attr:`processWorkerClass`, depending on
+            :attr:`numProcesses`
+            
+            If the worker is analysing part of a pass, `passShape` is the shape
+            of the result of the whole pass.
+        """
+        if passShape is None:
+            passShape = (len(params['detChars']), (n1-n0) // subsample)
+        scratchDir = self._scratchDirFor(passShape, dtype)
+        stream = self.streamResults and scratchDir is None
+        if self.numProcesses > 1:
+            audioKey = self._getAudioHash(audio)
+            if audioKey not in self._sharedAudio:
+                # copy audio to shared memory once, for all worker processes
+                self._sharedAudio[audioKey] = SharedArray.fromArray(audio)
+            analyser = self.processWorkerClass(self._sharedAudio[audioKey], self.executor,
+                                               audio, sr, params, n0, n1, subsample,
+                                               stream=stream, taps=taps, reduction=reduction,
+                                               dtype=dtype, scratchDir=scratchDir, preRoll=preRoll)
+        else:
+            analyser = self.workerClass(audio, sr, params, n0, n1, subsample,
+                                        stream=stream, continuation=continuation,
+                                        keepAlive=keepAlive, taps=taps, reduction=reduction,
+                                        dtype=dtype, scratchDir=scratchDir, preRoll=preRoll,
+                                        bankPool=self.bankPool)
+        analyser.blockDuration = self._blockDuration
+        return analyser
+    
+    def _scratchDirFor(self, shape, dtype):
+        """ Return :attr:`scratchDir` if a result of `shape` should be memory-mapped,
+            otherwise None
+        """
+        if self.scratchDir is None:
+            return None
+        resultSize = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return self.scratchDir if resultSize >= self.scratchThreshold else None
+    
+    def _numTimeShards(self, analysisPass, subsample) -> int:
+        """ Return number of time shards into which to split `analysisPass` """
+        numCols = (analysisPass.n1 - analysisPass.n0) // subsample
+        return self.timeShards if numCols >= 2 * self.timeShards else 1
+    
+    def _shouldShard(self, analysisPass, subsample, channels) -> bool:
+        """ Return True if `analysisPass` should be split into time shards or
+            channel groups
+        """
+        return (self._numTimeShards(analysisPass, subsample) > 1
+                or min(self.frequencyShards, channels) > 1)
+    
+    def _addShards(self, audio, sr, params, analysisPass, passKey, subsample, reduction, dtype,
+                   autoThreads=False):
+        """ Add workers for each group of channels in each time shard of `analysisPass`
+            
+            If `autoThreads` is True, the CPU cores are shared between the
+            workers that run at the same time.
+        """
+        numShards = self._numTimeShards(analysisPass, subsample)
+        if numShards > 1:
+            preRoll = self.shardPreRoll
+            if preRoll is None:
+                preRoll = preRollForTolerance(params['damping'], sr, self.shardTolerance)
+            shards = timeShards(analysisPass, numShards, subsample, int(preRoll * sr))
+            # results are approximate, so don't cache them
+            analysisPass = replace(analysisPass, exact=False)
+            passKey = None
+        else:
+            shards = [TimeShard(analysisPass.n0, analysisPass.n1, 0, 0)]
+        
+        detChars = params['detChars']
+        ranges = channelGroups(len(detChars), self.frequencyShards)
+        concurrent = min(self.numProcesses, len(shards) * len(ranges))
+        if autoThreads and concurrent > 1:
+            # each worker has its own DetectorBank, so don't give them all every core
+            params = self._shareThreads(params, concurrent)
+        
+        if len(ranges) > 1:
+            groups = [withoutProfile(params, detChars=detChars[c0:c1]) for c0, c1 in ranges]
+        else:
+            groups = [params]
+        passShape = (len(detChars), (analysisPass.n1 - analysisPass.n0) // subsample)
+        workers = [[self._makeWorker(audio, sr, groupParams, shard.n0, shard.n1, subsample,
+                                     reduction, dtype, keepAlive=False, preRoll=shard.preRoll,
+                                     passShape=passShape)
+                    for groupParams in groups]
+                   for shard in shards]
+        
+        finished = partial(self._analyserFinished, analysisPass=analysisPass, cacheKey=passKey)
+        blockReady = partial(self._blockReady, analysisPass=analysisPass)
+        _ShardedPass(workers, [shard.offset for shard in shards], subsample, finished, blockReady,
+                     self._connect, scratchDir=self._scratchDirFor(passShape, dtype))
+        keys = [segment.key for segment in analysisPass.segments]
+        for worker in (worker for row in workers for worker in row):
+            self._queue(worker, keys)
+    
+    def _baseSubsampleFor(self, requests, subsample, params, dtype, budget):
+        """ Return finer subsample factor at which to analyse `requests`, or None
+            if they should be analysed at `subsample` or their finer results 
+            would use more than `budget` bytes of memory
+            
+            See :attr:`baseSubsample`.
+        """
+        if self.baseSubsample is None or len(requests) == 0:
+            return None
+        base = math.gcd(subsample, self.baseSubsample)
+        if base >= subsample:
+            return None
+        channels = len(params['detChars'])
+        sizes = [channels * ((r.n1 - r.n0) // base) * np.dtype(dtype).itemsize for r in requests]
+        if max(sizes) > self.resultCache.maxBytes:
+            # finer result wouldn't be kept, so there's no point
+            return None
+        inMemory = sum(size for size, r in zip(sizes, requests) 
+                       if self._scratchDirFor((channels, (r.n1 - r.n0) // base), dtype) is None)
+        return base if inMemory <= budget else None
+    
+    @staticmethod
+    def _shareThreads(params, concurrent):
+        """ Return `params` with the number of threads reduced so that 
+            `concurrent` DetectorBanks don't use more threads than there are cores
+        """
+        numThreads = max(1, (os.cpu_count() or 1) // concurrent)
+        if params['numThreads'] >= 1:
+            # calibrated number of threads
+            numThreads = min(numThreads, params['numThreads'])
+        return withoutProfile(params, numThreads=numThreads)
+    
+    def _applyCalibration(self, sr, params):
+        """ Return `params`, with the calibrated number of threads if 'numThreads'
+            is less than 1, and the block duration to use
+        """
+        calibration = nearestCalibration(self.calibrations, sr, len(params['detChars']))
+        if calibration is None:
+            return params, self.workerClass.blockDuration
+        if params['numThreads'] < 1:
+            params = withoutProfile(params, numThreads=calibration.numThreads)
+        return params, calibration.blockDuration
+    
+    def _addWorker(self, analyser, analysisPass, cacheKey, channelSource=None):
+        """ Add `analyser` for `analysisPass` to list and connect its events """
+        self._queue(analyser, [segment.key for segment in analysisPass.segments])
+        kwargs = {'analysisPass':analysisPass, 'analyser':analyser, 'channelSource':channelSource}
+        self._connect(analyser.blockReady, partial(self._blockReady, **kwargs))
+        self._connect(analyser.finished, partial(self._analyserFinished, cacheKey=cacheKey, **kwargs))
+    
+    def _queue(self, worker, keys):
+        """ Add `worker`, for the segments with `keys`, to be queued when the
+            analysis is started, and connect its progress
+        """
+        # prioritise finer results by the keys of the segments they are for
+        keys = [key.key if isinstance(key, _BaseKey) else key for key in keys]
+        self.analysers.append(worker)
+        self._queued.append((worker, keys))
+        self._connect(worker.progress, self._workerProgress)
+        self._connect(worker.error, self._workerError)
+        self._connect(worker.finished, partial(self._workerFinished, worker))
+    
+    def _workerError(self, exc):
+        """ Keep `exc` from a failed worker and emit `error` """
+        self._errors.append(exc)
+        self.error.emit(exc)
+    
+    def _workerFinished(self, worker, *args):
+        """ Let the scheduler run the next worker """
+        self.scheduler.jobFinished(worker)
+    
+    def _addCachedPass(self, analysisPass, result, subsample):
+        """ Add results for the segments in `analysisPass` to :attr:`_cached`,
+            given the complete `result` of the pass
+        """
+        for segment, segResult, _ in self._segmentResults(analysisPass, result, {}, subsample):
+            self._cached.append((segment.key, segResult))
+    
+    def _segmentResults(self, analysisPass, result, tapResults, subsample):
+        """ Yield segment, result and whether it is complete for each segment in
+            `analysisPass`, caching the complete results that are exact.
+        """
+        for segment in analysisPass.segments:
+            segResult, complete = analysisPass.segmentResult(segment, result, tapResults, subsample)
+            if segResult.shape != result.shape and not isinstance(segResult, np.memmap):
+                # don't keep whole pass result alive for a slice of it (unless it
+                # is memory-mapped, as then the copy might not fit in memory)
+                segResult = segResult.copy()
+            if complete and analysisPass.isExact(segment):
+                self._cacheResult(segment.cacheKey, segResult)
+            yield segment, segResult, complete
+    
+    def setDiskCacheEnabled(self, enable, maxBytes=2*2**30, directory=None):
+        """ Create or remove :attr:`diskCache` """
+        if enable:
+            self.diskCache = DiskResultCache(maxBytes, directory)
+        else:
+            self.diskCache = None
+    
+    def setScratchEnabled(self, enable, directory=None, threshold=None):
+        """ Create or remove :attr:`scratchDir`, for memory-mapped results
+            
+            Parameters
+            ----------
+            enable : bool
+                Whether large results should be memory-mapped
+            directory : str, optional
+                Directory in which to make the scratch directory. If not given,
+                the system's temporary directory is used.
+            threshold : int, optional
+                If given, set :attr:`scratchThreshold`
+        """
+        if threshold is not None:
+            self.scratchThreshold = threshold
+        if self.scratchDir is not None:
+            # results that are still mapped are kept until they are freed, as
+            # their files have already been deleted (where possible)
+            shutil.rmtree(self.scratchDir, ignore_errors=True)
+            self.scratchDir = None
+        if enable:
+            self.scratchDir = tempfile.mkdtemp(prefix="detectorbank-gui-", dir=directory)
+    
+    def clearCache(self):
+        """ Remove all results from memory and disk caches """
+        self.resultCache.clear()
+        self._continuations.clear()
+        if self.diskCache is not None:
+            self.diskCache.clear()
+    
+    @property
+    def cacheStats(self) -> str:
+        """ Return string describing use of the memory and disk caches """
+        stats = f"memory: {self.resultCache.stats}"
+        if self.diskCache is not None:
+            stats += f"; disk: {self.diskCache.stats}"
+        return stats
+    
+    def _getCachedResult(self, key):
+        """ Return result for `key` from the memory or disk cache, or None if not cached """
+        result = self.resultCache.get(key)
+        if result is None and self.diskCache is not None:
+            result = self.diskCache.get(key)
+            if result is not None:
+                self.resultCache.put(key, result)
+        return result
+    
+    def _cacheResult(self, key, result):
+        """ Store `result` in the memory and disk caches """
+        self.resultCache.put(key, result)
+        if self.diskCache is not None:
+            self.diskCache.put(key, result)
+    
+    @staticmethod
+    def _continuationKey(cacheKey):
+        """ Return key for continuation store, i.e. `cacheKey` without the end of the segment """
+        return replace(cacheKey, n1=-1)
+    
+    def _getContinuation(self, cacheKey):
+        """ Remove and return Continuation matching `cacheKey`, or None
+            
+            Continuations can't be passed to worker processes, so this always
+            returns None if :attr:`numProcesses` is greater than 1.
+        """
+        if self.numProcesses > 1:
+            return None
+        return self._continuations.pop(self._continuationKey(cacheKey), None)
+    
+    def _storeContinuation(self, cacheKey, continuation):
+        """ Store `continuation`, discarding the least recently used if necessary
+            
+            The DetectorBanks of discarded continuations are returned to :attr:`bankPool`.
+        """
+        key = self._continuationKey(cacheKey)
+        previous = self._continuations.pop(key, None)
+        if previous is not None and previous is not continuation:
+            previous.discard()
+        self._continuations[key] = continuation
+        while len(self._continuations) > self.maxContinuations:
+            _, discarded = self._continuations.popitem(last=False)
+            discarded.discard()
+    
+    def _getChannelSource(self, cacheKey):
+        """ Find cached result which differs from `cacheKey` only by detectors
+            
+            Returns
+            -------
+            chanMap : np.ndarray
+                Index of each detector in the cached result, or -1 if it is not there
+            result : np.ndarray
+                Cached result with the most detectors in common with `cacheKey`,
+                or None if there isn't one
+        """
+        match = lambda key: replace(key, detChars=b"") == replace(cacheKey, detChars=b"")
+        detChars = cacheKey.detCharsArray
+        best, bestCount = (None, None), 0
+        for key, result in self.resultCache.find(match):
+            chanMap = channelMap(detChars, key.detCharsArray)
+            count = np.count_nonzero(chanMap >= 0)
+            if count > bestCount:
+                best, bestCount = (chanMap, result), count
+        return best
+    
+    def _getRescaledResult(self, cacheKey, params):
+        """ Return cached result which differs from `cacheKey` only by gain, 
+            scaled to the gain in `cacheKey`, or None if there isn't one.
+            
+            This is only possible if results are proportional to the gain
+            (see :func:`.extraction.isLinearInGain`). The cached array is not 
+            changed, as it may still be plotted or used by a continuation.
+        """
+        if not isLinearInGain(params):
+            return None
+        withoutGain = lambda key: replace(key, params=tuple(item for item in key.params 
+                                                            if item[0] != 'gain'))
+        target = withoutGain(cacheKey)
+        gain = cacheKey.paramsDict['gain']
+        for key, result in self.resultCache.find(lambda key: withoutGain(key) == target):
+            sourceGain = key.paramsDict['gain']
+            if sourceGain != 0:
+                return scaleResult(result, gain / sourceGain, self.scratchDir)
+        return None
+    
+    def _getRedecimatedResult(self, cacheKey):
+        """ Return cached result which differs from `cacheKey` only by a
+            subsample factor that divides the subsample factor of `cacheKey`, 
+            re-decimated to that factor, or None if there isn't one.
+            
+            If there is more than one, the one with the greatest factor is used.
+        """
+        def match(key):
+            return (key.subsample < cacheKey.subsample 
+                    and cacheKey.subsample % key.subsample == 0
+                    and replace(key, subsample=cacheKey.subsample) == cacheKey)
+        found = max(self.resultCache.find(match), key=lambda item: item[0].subsample, default=None)
+        if found is None:
+            return None
+        key, result = found
+        return redecimate(result, cacheKey.subsample // key.subsample, cacheKey.reduction)
+    
+    def _getAudioHash(self, audio) -> str:
+        """ Return hash of `audio`, which is only recalculated if the array has changed """
+        lastAudio, digest = self._audioHash
+        if audio is not lastAudio:
+            digest = audioHash(audio)
+            self._audioHash = (audio, digest)
+        return digest
+    
+    def _blockReady(self, block, start, analysisPass, analyser, channelSource=None):
+        """ Emit `blockReady` with partial result `block`, starting at column
+            `start` of the result for `analysisPass`, for each segment in the pass
+        """
+        if channelSource is not None:
+            chanMap, source = channelSource
+            block = mergeChannels(chanMap, source[:, start:], block)
+        for segment in analysisPass.segments:
+            segBlock, segStart = analysisPass.segmentBlock(segment, block, start, analyser.subsample)
+            if segBlock.shape[1] > 0:
+                numCols = (segment.n1 - segment.n0) // analyser.subsample
+                self._emitBlock(segment.key, segBlock, segStart, numCols)
+    
+    def _emitBlock(self, key, block, start, size):
+        """ Emit `blockReady`, re-decimating `block` first if `key` is a :class:`_BaseKey` """
+        if isinstance(key, _BaseKey):
+            if (decimator := self._decimators.get(key, None)) is None:
+                decimator = self._decimators[key] = BlockRedecimator(key.factor, key.reduction)
+            if (decimated := decimator.add(block, start)) is None:
+                return
+            block, start = decimated
+            key, size = key.key, size // key.factor
+        self.blockReady.emit(key, block, start, size)
+    
+    def _analyserFinished(self, result, complete, analysisPass, analyser, cacheKey, channelSource=None):
+        """ Cache `result`, emit the result for each segment in `analysisPass`
+            and check if all workers are finished.
+            
+            If a segment's result is not complete, it is not cached and is
+            marked as such.
+            
+            If `channelSource` is given, it is a tuple of channel map and cached
+            result, which `result` should be merged with.
+            
+            If `cacheKey` is None, the result of the pass is not cached.
+        """
+        if channelSource is not None:
+            chanMap, source = channelSource
+            result = mergeChannels(chanMap, source, result)
+        if complete and cacheKey is not None:
+            self._cacheResult(cacheKey, result)
+            if analyser.continuation is not None:
+                self._storeContinuation(cacheKey, analyser.continuation)
+                analyser.continuation = None
+        segResults = self._segmentResults(analysisPass, result, analyser.tapResults, analyser.subsample)
+        for segment, segResult, segComplete in segResults:
+            if segComplete:
+                self._addResult(segment.key, segResult)
+            else:
+                stop = segment.n0 + segResult.shape[1] * analyser.subsample
+                self._addResult(segment.key, segResult, complete=False, stop=stop)
+    
+    def _addResult(self, key, result, complete=True, stop=None):
+        """ Emit `resultReady`, for this result and any scaled from it, and emit
+            `finished` if all segments are done
+        """
+        # results derived from this one, e.g. re-decimated or scaled by gain, 
+        # which aren't cached, as they can be derived again from the cached result
+        results = [(key, result)]
+        for key, result in results:
+            for derivedKey, derive in self._derived.pop(key, []):
+                results.append((derivedKey, derive(result)))
+        for key, result in results:
+            if isinstance(key, _BaseKey):
+                self._decimators.pop(key, None)
+            else:
+                self.resultReady.emit(key, result, complete, stop)
+            self._finished.append(key)
+        
+        if not self.running:
+            self._started = False
+            self._releaseSharedAudio()
+            self.finished.emit()
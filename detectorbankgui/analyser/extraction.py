@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions to get results from a DetectorBank, with no Qt dependency, so that they
+can be used in worker processes as well as in `AnalysisWorker`.
+
+Audio and results are passed to and from worker processes in shared memory
+(see `SharedArray`), rather than being pickled. Results that are too large to 
+hold in RAM can instead be memory-mapped to files in a scratch directory 
+(see `ScratchArray`).
+
+Constructing a DetectorBank can take a while, particularly with search 
+normalisation, so banks can be kept in a `DetectorBankPool` and given new 
+audio, rather than being made again for each segment.
+"""
+from detectorbank import DetectorBank
+import numpy as np
+from multiprocessing import shared_memory
+from dataclasses import dataclass
+from collections import OrderedDict
+import threading
+import tempfile
+import time
+import os
+
+def makeDetectorBank(sr, audio, params):
+    """ Return DetectorBank for `audio`, made with dict of `params`, as returned by ArgsWidget.getArgs
+        
+        If `params` has a 'profile', the name of a saved profile with exactly these
+        parameters, the DetectorBank is made from the profile, so the detectors' 
+        normalisation isn't calculated again. If that isn't possible, it is made 
+        from the parameters. Anything that changes the parameters should remove 
+        the 'profile' (see :func:`withoutProfile`).
+    """
+    if (profile := params.get('profile', None)) is not None and sr == params['sr']:
+        try:
+            return DetectorBank(profile, audio)
+        except (TypeError, ValueError, RuntimeError):
+            # profile is missing, or this version of DetectorBank can't load profiles
+            pass
+    features = params['method'] | params['freqNorm'] | params['ampNorm']
+    args = (sr, audio, params['numThreads'], params['detChars'], features,
+            params['damping'], params['gain'])
+    return DetectorBank(*args)
+
+def isLinearInGain(params) -> bool:
+    """ Return True if results with DetectorBank `params` are proportional to
+        the gain, i.e. if the amplitude is not normalised
+    """
+    return params['ampNorm'] == DetectorBank.amp_unnormalized
+
+def withoutProfile(params, **changes) -> dict:
+    """ Return copy of `params` with `changes` and no 'profile' """
+    params = dict(params, **changes)
+    params.pop('profile', None)
+    return params
+
+def detectorBankKey(sr, params) -> tuple:
+    """ Return tuple of the args, other than the audio, with which `makeDetectorBank`
+        would make a DetectorBank
+    """
+    features = params['method'] | params['freqNorm'] | params['ampNorm']
+    detChars = np.ascontiguousarray(params['detChars'], dtype=np.float64)
+    return (int(sr), detChars.tobytes(), int(features), float(params['damping']),
+            float(params['gain']), int(params['numThreads']))
+
+def resetDetectorBank(det, audio) -> bool:
+    """ Give DetectorBank `det` new input `audio` and reset its detectors.
+        
+        Returns False if this version of DetectorBank can't change its input.
+    """
+    setInputBuffer = getattr(det, "setInputBuffer", None)
+    if setInputBuffer is None:
+        return False
+    setInputBuffer(np.ascontiguousarray(audio, dtype=np.float32))
+    # seeking to the start zeros the detectors
+    det.seek(0)
+    return True
+
+class DetectorBankPool:
+    """ DetectorBanks which have been used and can be given new audio.
+        
+        Banks are only reused for the same sample rate, detectors, features, 
+        damping, gain and number of threads. If DetectorBank can't change its
+        input (see :func:`resetDetectorBank`), a new bank is always made.
+        
+        Parameters
+        ----------
+        maxBanks : int
+            Number of unused banks to keep; the least recently used are discarded.
+    """
+    def __init__(self, maxBanks=4):
+        self.maxBanks = maxBanks
+        self._banks = OrderedDict() # (key, serial) : DetectorBank
+        self._serial = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._banks)
+    
+    def acquire(self, sr, audio, params):
+        """ Return DetectorBank for `audio`, from the pool if possible, otherwise
+            made with :func:`makeDetectorBank`
+        """
+        key = detectorBankKey(sr, params)
+        with self._lock:
+            match = next((item for item in self._banks if item[0] == key), None)
+            det = self._banks.pop(match) if match is not None else None
+        reused = det is not None and resetDetectorBank(det, audio)
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return det if reused else makeDetectorBank(sr, audio, params)
+    
+    def release(self, det, sr, params):
+        """ Return `det`, made with `sr` and `params`, to the pool """
+        if self.maxBanks < 1 or not resetDetectorBank(det, np.zeros(1, dtype=np.float32)):
+            # can't be reused; idle banks also shouldn't keep a copy of the audio
+            return
+        with self._lock:
+            self._banks[(detectorBankKey(sr, params), self._serial)] = det
+            self._serial += 1
+            while len(self._banks) > self.maxBanks:
+                self._banks.popitem(last=False)
+    
+    def clear(self):
+        """ Discard all banks """
+        with self._lock:
+            self._banks.clear()
+    
+    @property
+    def stats(self) -> str:
+        """ Return string describing banks reused and made """
+        return f"{self.hits} reused, {self.misses} made"
+
+REDUCTIONS = ("point", "max", "mean", "rms")
+""" Ways of reducing `subsample` absZ values to one result value:
+    
+    - 'point' takes the first value
+    - 'max' takes the maximum value
+    - 'mean' takes the mean value
+    - 'rms' takes the root mean square value
+"""
+
+def reduceWindows(windows, reduction) -> np.ndarray:
+    """ Reduce (channels, numWindows, subsample) array of absZ values to 
+        (channels, numWindows) array, using `reduction` mode (see `REDUCTIONS`)
+    """
+    if reduction == "point":
+        return windows[:, :, 0]
+    elif reduction == "max":
+        return windows.max(axis=2)
+    elif reduction == "mean":
+        return windows.mean(axis=2)
+    elif reduction == "rms":
+        return np.sqrt(np.mean(np.square(windows), axis=2))
+    else:
+        raise ValueError(f"Unknown reduction '{reduction}'; should be one of {REDUCTIONS}")
+
+def redecimate(result, factor, reduction="point", chunkSize=2**22) -> np.ndarray:
+    """ Subsample `result` by a further `factor`, reducing each `factor` columns
+        to one with `reduction` mode.
+        
+        If `result` was subsampled by `subsample`, this is the same result as
+        subsampling by `subsample*factor` (for every reduction mode, as each
+        window of the new result is made of `factor` whole windows of `result`).
+        
+        `result` is read `chunkSize` values at a time, so that memory-mapped
+        results don't have to be read into memory all at once.
+    """
+    channels = result.shape[0]
+    numCols = result.shape[1] // factor
+    if reduction == "point":
+        return np.array(result[:, :numCols*factor:factor])
+    out = np.empty((channels, numCols), dtype=result.dtype)
+    chunk = max(1, chunkSize // (channels * factor))
+    for w0 in range(0, numCols, chunk):
+        w1 = min(w0 + chunk, numCols)
+        windows = np.asarray(result[:, w0*factor:w1*factor]).reshape(channels, w1-w0, factor)
+        out[:, w0:w1] = reduceWindows(windows, reduction)
+    return out
+
+class BlockRedecimator:
+    """ Re-decimate partial results (see :func:`redecimate`) as they are 
+        streamed, carrying over columns that don't make a whole window to the
+        next block.
+        
+        If a block doesn't follow on from the previous one, the carried 
+        columns are discarded and it starts at the next whole window.
+    """
+    def __init__(self, factor, reduction="point"):
+        self.factor = factor
+        self.reduction = reduction
+        self._carry = None
+        self._carryStart = 0
+    
+    def add(self, block, start):
+        """ Return re-decimated `block`, which starts at column `start` of the
+            result, and the column at which it starts in the re-decimated result, 
+            or None if there is not yet a whole window.
+        """
+        if self._carry is not None and start == self._carryStart + self._carry.shape[1]:
+            block = np.concatenate([self._carry, block], axis=1)
+            start = self._carryStart
+        else:
+            skip = -start % self.factor
+            block, start = block[:, skip:], start + skip
+        n = (block.shape[1] // self.factor) * self.factor
+        self._carry, self._carryStart = block[:, n:].copy(), start + n
+        if n == 0:
+            return None
+        return redecimate(block[:, :n], self.factor, self.reduction), start // self.factor
+
+def scaleResult(result, scale, scratchDir=None, chunkSize=2**22) -> np.ndarray:
+    """ Return new array of `result` multiplied by `scale`, with the same dtype
+        
+        `result` is read `chunkSize` values at a time, as in :func:`redecimate`.
+        If it is memory-mapped, the new array is a :class:`ScratchArray` in 
+        `scratchDir`, so that neither has to be held in memory.
+    """
+    channels, numCols = result.shape
+    if isinstance(result, np.memmap):
+        scratch = ScratchArray(result.shape, result.dtype, scratchDir)
+        # the mapping keeps the data after the file has been deleted
+        scratch.unlink()
+        out = scratch.array
+    else:
+        out = np.empty(result.shape, dtype=result.dtype)
+    chunk = max(1, chunkSize // max(1, channels))
+    for c0 in range(0, numCols, chunk):
+        c1 = min(c0 + chunk, numCols)
+        np.multiply(result[:, c0:c1], scale, out=out[:, c0:c1], dtype=result.dtype)
+    return out
+
+def extractResults(det, result, subsample, blockSize, checkState=None, skip=0, taps=(), 
+                   reduction="point"):
+    """ Fill `result` with every `subsample`th absZ value from DetectorBank `det`.
+        
+        absZ for all channels is calculated for `blockSize` samples at a time
+        and every `subsample`th sample of the block is copied into `result`.
+        The DetectorBank is only run as far as the last sample that is kept.
+        
+        If `reduction` is not 'point', each value of `result` is instead the 
+        max, mean or RMS (see `REDUCTIONS`) of a window of `subsample` values.
+        Windows can span blocks, so any values left over at the end of a block
+        are carried over to the next one.
+        
+        This is a generator, yielding the number of columns of `result` that
+        have been filled after each block.
+        
+        If `checkState` is given, it is called before each block; if it returns
+        False, no more blocks are processed.
+        
+        If `skip` is given, this many samples are integrated before the first 
+        sample that is kept, e.g. when continuing from part way through a segment.
+        
+        `taps` can be a list of (skip, array) pairs, which are filled in the 
+        same way as `result`, from the same DetectorBank pass.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction '{reduction}'; should be one of {REDUCTIONS}")
+    # each output is skip, array, number of columns filled and values carried over
+    outputs = [[skip, result, 0, None]] + [[tapSkip, tap, 0, None] for tapSkip, tap in taps]
+    channels = result.shape[0]
+    numSamples = max(samplesRequired(arr.shape[1], subsample, s, reduction) 
+                     for s, arr, _, _ in outputs)
+    
+    z = np.zeros((channels, min(blockSize, numSamples)), dtype=np.complex128)
+    r = np.zeros(z.shape)
+    
+    n = 0
+    
+    while n < numSamples:
+        if checkState is not None and not checkState():
+            return
+        size = min(blockSize, numSamples-n)
+        if size < z.shape[1]:
+            # final, short block (getZ fills the whole array, so make a smaller one)
+            z = np.zeros((channels, size), dtype=np.complex128)
+            r = np.zeros(z.shape)
+        det.getZ(z)
+        det.absZ(r, z)
+        
+        for output in outputs:
+            outSkip, arr, idx, carry = output
+            if reduction == "point":
+                # index in this block of the first sample that we're keeping
+                first = outSkip - n if n <= outSkip else (outSkip - n) % subsample
+                block = r[:, first::subsample][:, :arr.shape[1]-idx]
+            else:
+                values = r[:, max(outSkip-n, 0):]
+                if carry is not None:
+                    values = np.concatenate((carry, values), axis=1)
+                numWindows = min(values.shape[1] // subsample, arr.shape[1]-idx)
+                end = numWindows * subsample
+                windows = values[:, :end].reshape((channels, numWindows, subsample))
+                block = reduceWindows(windows, reduction)
+                # r is overwritten by the next block, so copy any remainder
+                output[3] = values[:, end:].copy() if idx + numWindows < arr.shape[1] else None
+            arr[:, idx:idx+block.shape[1]] = block
+            output[2] = idx + block.shape[1]
+        n += size
+        
+        yield outputs[0][2]
+        
+def samplesRequired(numCols, subsample, skip=0, reduction="point") -> int:
+    """ Return number of samples that must be integrated to get `numCols` results """
+    if numCols <= 0:
+        return 0
+    elif reduction == "point":
+        return skip + (numCols-1) * subsample + 1
+    else:
+        return skip + numCols * subsample
+
+def channelMap(detChars, sourceDetChars) -> np.ndarray:
+    """ Return array of the index of each row of `detChars` in `sourceDetChars`.
+        
+        Rows that are not in `sourceDetChars` have index -1.
+    """
+    lookup = {tuple(row): idx for idx, row in enumerate(np.asarray(sourceDetChars))}
+    return np.array([lookup.get(tuple(row), -1) for row in np.asarray(detChars)], dtype=int)
+
+def mergeChannels(chanMap, sourceResult, newResult) -> np.ndarray:
+    """ Return array of results, where each row is taken from `sourceResult` or `newResult`
+        
+        Rows where `chanMap` is -1 are taken, in order, from `newResult`; other
+        rows are taken from row `chanMap[k]` of `sourceResult`. 
+        The result is the same length as `newResult`.
+    """
+    numCols = newResult.shape[1]
+    result = np.zeros((len(chanMap), numCols), dtype=newResult.dtype)
+    cached = chanMap >= 0
+    result[cached] = sourceResult[chanMap[cached], :numCols]
+    result[~cached] = newResult
+    return result
+
+@dataclass
+class Continuation:
+    """ DetectorBank kept after analysing a segment, so that the segment can be extended.
+        
+        The DetectorBank's input starts at the beginning of the segment and
+        continues to the end of the audio, so it can be run on past the end of 
+        the segment.
+    """
+    det: object # DetectorBank
+    result: np.ndarray
+    n1: int # end of segment
+    pos: int # number of samples DetectorBank has integrated
+    release: object = None # callable to return `det` to its DetectorBankPool
+    
+    def skip(self, subsample) -> int:
+        """ Return number of samples to integrate before the next result """
+        return self.result.shape[1] * subsample - self.pos
+    
+    def discard(self):
+        """ Return DetectorBank to its pool, if it came from one """
+        if self.release is not None:
+            self.release()
+            self.release = None
+        
+class SharedArray:
+    """ numpy array in shared memory, which can be attached to in another process.
+        
+        Parameters
+        ----------
+        shape : tuple
+            Shape of array
+        dtype : np.dtype
+            Data type of array
+        name : str, optional
+            If given, attach to existing shared memory block `name`, rather than
+            creating a new one.
+    """
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if name is None:
+            size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = _attachSharedMemory(name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+    
+    @classmethod
+    def fromArray(cls, arr):
+        """ Return new SharedArray containing a copy of `arr` """
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+    
+    @classmethod
+    def attach(cls, spec):
+        """ Attach to SharedArray from `spec` tuple, as returned by :attr:`spec` """
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+    
+    @property
+    def name(self):
+        """ Name of shared memory block """
+        return self._shm.name
+    
+    @property
+    def spec(self):
+        """ Picklable tuple of (name, shape, dtype) that can be passed to :meth:`attach` """
+        return (self.name, self.shape, self.dtype.str)
+    
+    def close(self):
+        """ Close access to the shared memory from this instance """
+        self.array = None
+        self._shm.close()
+    
+    def unlink(self):
+        """ Close and destroy the shared memory block.
+            
+            Should only be called once, by the process that created it.
+        """
+        self.close()
+        self._shm.unlink()
+
+def _attachSharedMemory(name):
+    """ Attach to existing shared memory block, without tracking it where possible.
+        
+        Spawned worker processes share their parent's resource tracker, so 
+        the block is not destroyed when a worker exits either way.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+class ScratchArray:
+    """ numpy array memory-mapped to a file in a scratch directory, so that it
+        can be larger than RAM. Like :class:`SharedArray`, it can be attached 
+        to in another process.
+        
+        Parameters
+        ----------
+        shape : tuple
+            Shape of array
+        dtype : np.dtype
+            Data type of array
+        directory : str, optional
+            Directory in which to create the file. If not given, the system's 
+            temporary directory is used.
+        path : str, optional
+            If given, attach to existing file `path`, rather than creating a new one.
+    """
+    def __init__(self, shape, dtype, directory=None, path=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="result-", suffix=".dat", dir=directory)
+            os.close(fd)
+            mode = "w+"
+        else:
+            mode = "r+"
+        self.path = path
+        if int(np.prod(self.shape)) == 0:
+            # can't map an empty file
+            self.array = np.zeros(self.shape, dtype=self.dtype)
+        else:
+            self.array = np.memmap(path, dtype=self.dtype, mode=mode, shape=self.shape)
+    
+    @classmethod
+    def attach(cls, spec):
+        """ Attach to ScratchArray from `spec` tuple, as returned by :attr:`spec` """
+        path, shape, dtype = spec
+        return cls(shape, dtype, path=path)
+    
+    @property
+    def spec(self):
+        """ Picklable tuple of (path, shape, dtype) that can be passed to :meth:`attach` """
+        return (self.path, self.shape, self.dtype.str)
+    
+    def close(self):
+        """ Flush and close access to the file from this instance """
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        self.array = None
+    
+    def unlink(self):
+        """ Delete the file.
+            
+            Unlike :meth:`SharedArray.unlink`, this does not close the array: 
+            on most platforms, the mapped data remains available until 
+            :attr:`array` (and any views of it) are garbage collected. Where the
+            file can't be deleted while it is open, it is left in the directory.
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+@dataclass
+class ProcessJob:
+    """ Args for :func:`analyseInProcess` """
+    audio: tuple # SharedArray spec
+    result: tuple # SharedArray spec
+    control: tuple # SharedArray spec
+    sr: int
+    params: dict
+    n0: int
+    n1: int
+    subsample: int
+    blockSize: int
+    taps: tuple = () # (skip, SharedArray spec) pairs
+    reduction: str = "point"
+    scratch: bool = False # if True, result and taps are ScratchArray specs
+    preRoll: int = 0 # number of samples before n0 to integrate first
+
+# indices in `ProcessJob.control` array
+CANCELLED = 0
+PAUSED = 1
+PROGRESS = 2
+CONTROL_SIZE = 3
+
+# DetectorBanks kept between jobs in each worker process
+_processBankPool = DetectorBankPool()
+
+def analyseInProcess(job: ProcessJob, pollInterval=0.05) -> int:
+    """ Analyse audio segment in worker process
+        
+        Audio is read from, and results written to, shared memory (or results
+        are written to scratch files, if `job.scratch` is True).
+        The parent process can cancel or pause the analysis by setting the
+        CANCELLED or PAUSED flags in the `control` array, and can read how many
+        result columns have been written from its PROGRESS value.
+        
+        Returns the number of columns of the result that were written.
+    """
+    audio = SharedArray.attach(job.audio)
+    control = SharedArray.attach(job.control)
+    resultType = ScratchArray if job.scratch else SharedArray
+    result = resultType.attach(job.result)
+    taps = [(skip, resultType.attach(spec)) for skip, spec in job.taps]
+    
+    def checkState():
+        while control.array[PAUSED] and not control.array[CANCELLED]:
+            time.sleep(pollInterval)
+        return not control.array[CANCELLED]
+    
+    idx = 0
+    try:
+        det = _processBankPool.acquire(job.sr, audio.array[job.n0-job.preRoll:job.n1], job.params)
+        blocks = extractResults(det, result.array, job.subsample, job.blockSize, checkState,
+                                skip=job.preRoll, taps=[(skip, tap.array) for skip, tap in taps], 
+                                reduction=job.reduction)
+        for idx in blocks:
+            control.array[PROGRESS] = idx
+        _processBankPool.release(det, job.sr, job.params)
+        del det
+    finally:
+        for arr in [audio, result, control] + [tap for _, tap in taps]:
+            arr.close()
+    return idx
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estimate the memory needed to analyse a set of segments, and find a subsample
+factor and result dtype that fit within a budget.
+"""
+from .planner import SegmentRequest, planPasses
+from dataclasses import dataclass
+import numpy as np
+import os
+
+def physicalMemory():
+    """ Return total physical memory in bytes, or None if it can't be found """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def formatBytes(nbytes) -> str:
+    """ Return `nbytes` as string in MB or GB """
+    if nbytes >= 2**30:
+        return f"{nbytes/2**30:.1f} GB"
+    return f"{nbytes/2**20:.0f} MB"
+
+@dataclass
+class MemoryEstimate:
+    """ Estimated peak memory use, in bytes, of an analysis """
+    audio: int = 0 # shared memory copy and DetectorBank input
+    blocks: int = 0 # extraction buffers
+    results: int = 0 # result arrays
+    plots: int = 0 # plotted data
+    continuations: int = 0 # input of DetectorBanks kept after analysis
+    mapped: int = 0 # result arrays memory-mapped to scratch files (not in total)
+    
+    @property
+    def total(self) -> int:
+        return self.audio + self.blocks + self.results + self.plots + self.continuations
+    
+    def __str__(self):
+        names = ["audio", "blocks", "results", "plots"]
+        if self.continuations > 0:
+            names.append("continuations")
+        parts = ", ".join(f"{name} {formatBytes(getattr(self, name))}" for name in names)
+        s = f"{formatBytes(self.total)} ({parts})"
+        if self.mapped > 0:
+            s += f" and {formatBytes(self.mapped)} of scratch files"
+        return s
+
+def estimateMemory(numSamples, segments, channels, subsample, blockSize, numProcesses=1,
+                   dtype=np.float64, mergeOverlapping=False, scratchThreshold=None, 
+                   mappedPlotPoints=20000, timeShards=1, frequencyShards=1, 
+                   runs=1, maxContinuations=0) -> MemoryEstimate:
+    """ Return :class:`MemoryEstimate` for analysing `segments`
+        
+        Parameters
+        ----------
+        numSamples : int
+            Number of samples in the audio
+        segments : list
+            List of (n0, n1) sample ranges
+        channels : int
+            Number of detectors
+        subsample : int
+            Subsample factor
+        blockSize : int
+            Number of samples in each extraction block
+        numProcesses : int
+            Number of segments that are analysed at the same time. If greater
+            than 1, the audio is also copied to shared memory.
+        dtype : np.dtype
+            Result dtype
+        mergeOverlapping : bool
+            Whether overlapping segments are analysed in one pass
+        scratchThreshold : int, optional
+            If given, pass results of at least this many bytes are memory-mapped
+            to scratch files, so are counted in :attr:`MemoryEstimate.mapped`
+        mappedPlotPoints : int
+            Maximum number of points per line that are plotted for a 
+            memory-mapped result
+        timeShards : int
+            Number of time shards each pass is split into. The shards' results 
+            are copied into the pass result, so are counted twice.
+        frequencyShards : int
+            Number of groups of detectors each pass is split into. As with
+            `timeShards`, results are counted twice.
+        runs : int
+            Number of sets of parameters with which each segment is analysed
+            (see :mod:`.sweep`)
+        maxContinuations : int
+            Number of DetectorBanks kept after analysis so that segments can be
+            extended (see :class:`.engine.Engine`). These are only kept if
+            `numProcesses` is 1.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    requests = [SegmentRequest(idx, max(n0, 0), min(n1, numSamples), None)
+                for idx, (n0, n1) in enumerate(segments)]
+    passes = [p for p in planPasses(requests, mergeOverlapping) for _ in range(max(1, runs))]
+    concurrent = min(max(1, numProcesses), len(passes))
+    
+    estimate = MemoryEstimate()
+    
+    # DetectorBank is given the audio from the start of the pass to the end (as float32)
+    inputSizes = sorted((numSamples - p.n0 for p in passes), reverse=True)
+    estimate.audio = 4 * sum(inputSizes[:concurrent])
+    if numProcesses > 1:
+        estimate.audio += 4 * numSamples
+    
+    # getZ and absZ arrays for each DetectorBank
+    estimate.blocks = concurrent * channels * blockSize * (np.dtype(np.complex128).itemsize
+                                                           + np.dtype(np.float64).itemsize)
+    
+    keptSizes = []
+    for p in passes:
+        numTaps = len(p.tapSkips(subsample))
+        passSize = channels * ((p.n1 - p.n0) // subsample) * itemsize
+        mapped = scratchThreshold is not None and passSize >= scratchThreshold
+        sharded = numTaps == 0 and ((timeShards > 1 and (p.n1 - p.n0) // subsample >= 2 * timeShards)
+                                    or min(frequencyShards, channels) > 1)
+        if numTaps == 0 and not sharded:
+            keptSizes.append(numSamples - p.n0)
+        if mapped:
+            estimate.mapped += (1 + numTaps + sharded) * passSize
+        else:
+            estimate.results += (1 + numTaps + sharded) * passSize
+        for segment in p.segments:
+            numCols = (segment.n1 - segment.n0) // subsample
+            if mapped:
+                # segment results are views of the mapped pass, and only part is plotted
+                numCols = min(numCols, mappedPlotPoints)
+            elif (segment.n0, segment.n1) != (p.n0, p.n1):
+                # segment results that are slices of the pass are copied
+                estimate.results += channels * numCols * itemsize
+            # time and response for each line are stored as float64
+            estimate.plots += (channels + 1) * numCols * np.dtype(np.float64).itemsize
+    
+    # kept DetectorBanks hold on to their input (their results are counted above)
+    if numProcesses <= 1 and maxContinuations > 0:
+        keptSizes.sort(reverse=True)
+        estimate.continuations = 4 * sum(keptSizes[:maxContinuations])
+    
+    return estimate
+
+def suggestSettings(budget, subsample, dtype=np.float64, dtypes=(np.float64, np.float32), **kwargs):
+    """ Find the smallest subsample factor, at least `subsample`, for which the
+        estimated memory use is within `budget` bytes.
+        
+        Each of `dtypes` is tried and the dtype giving the smallest factor is
+        returned; if more than one gives the same factor, `dtype` is preferred,
+        otherwise the first in `dtypes`.
+        
+        `kwargs` are passed to :func:`estimateMemory`.
+        
+        Returns
+        -------
+        suggestion : tuple
+            (subsample, dtype, MemoryEstimate), or None if nothing fits
+    """
+    candidates = [np.dtype(dtype)] + [np.dtype(dt) for dt in dtypes if np.dtype(dt) != np.dtype(dtype)]
+    maxLength = max((n1 - n0 for n0, n1 in kwargs.get('segments', [])), default=1)
+    best = None
+    for dt in candidates:
+        estimate = lambda sub: estimateMemory(subsample=sub, dtype=dt, **kwargs)
+        hi = max(subsample, maxLength)
+        if estimate(hi).total > budget:
+            continue
+        # estimate decreases with subsample factor, so binary search for smallest that fits
+        lo = subsample
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if estimate(mid).total <= budget:
+                hi = mid
+            else:
+                lo = mid + 1
+        if best is None or lo < best[0]:
+            best = (lo, dt, estimate(lo))
+    return best
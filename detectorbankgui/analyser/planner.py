@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plan the DetectorBank passes needed to analyse a set of segments.
+
+Segments which start at the same sample are analysed in one pass, as far as the
+end of the longest one. Each shorter segment's result is the start of that
+result, so is identical to analysing it on its own.
+
+Overlapping segments which start at different samples can also be merged into
+one pass (see `planPasses`), but this is not exact. By the time a later segment
+starts, the detectors in the merged pass have already been driven by the audio
+before it, so their response differs from that of a DetectorBank started at the
+beginning of the segment until that earlier input has decayed.
+
+Conversely, a long pass can be split into time shards (see `timeShards`), which are
+analysed in parallel. Each shard after the first starts with a pre-roll: the 
+detectors are driven by the audio before the shard, but the results for it are 
+discarded. The detectors in a shard start from rest, whereas in the serial pass
+they have already been driven by all of the audio before the pre-roll. The
+detectors are linear, so the difference in their response is the decay of their 
+response to that earlier audio. This decays at least as fast as the response of a
+minimum bandwidth detector (see `relaxationTime`), so after a pre-roll of `t` 
+seconds, each value in a shard differs from the serial result by at most
+
+    exp(-t / relaxationTime(damping, sr)) * max|response at the start of the pre-roll|
+
+which is given, relative to the largest response, by `shardErrorBound`.
+
+A pass can also be split by detector (see `channelGroups`), as each detector's
+response is independent of the others. This is exact.
+"""
+from dataclasses import dataclass, field
+import numpy as np
+
+MIN_BANDWIDTH_FACTOR = 0.192
+""" Minimum detector bandwidth in Hz is approximately `MIN_BANDWIDTH_FACTOR * damping * sr`.
+    (Fitted to the table of minimum bandwidths in the user guide.)
+"""
+
+@dataclass
+class SegmentRequest:
+    """ Segment to be analysed """
+    key: object # key of plot in result widget
+    n0: int
+    n1: int
+    cacheKey: object # ResultKey
+    
+@dataclass
+class TimeShard:
+    """ Part of an :class:`AnalysisPass`, which is analysed separately """
+    n0: int
+    n1: int
+    preRoll: int # number of samples before `n0` to analyse first
+    offset: int # column of pass result at which shard result starts
+
+@dataclass
+class AnalysisPass:
+    """ Range of audio to be analysed by one DetectorBank, and the segments in it """
+    n0: int
+    n1: int
+    segments: list = field(default_factory=list)
+    exact: bool = True # False if pass result is only approximate, e.g. if it is sharded
+    
+    def isExact(self, segment) -> bool:
+        """ Return True if the result for `segment` is identical to analysing it separately """
+        return self.exact and segment.n0 == self.n0
+    
+    def tapSkips(self, subsample) -> list:
+        """ Return offsets from the start of the pass at which extra results must
+            be taken, so that segments whose start is not a multiple of `subsample`
+            samples from the start of the pass get the right samples.
+        """
+        return sorted({(s.n0 - self.n0) % subsample for s in self.segments} - {0})
+    
+    def segmentResult(self, segment, result, tapResults, subsample):
+        """ Return result for `segment`, sliced from the results of this pass
+            
+            Parameters
+            ----------
+            segment : SegmentRequest
+                Segment in this pass
+            result : np.ndarray
+                Result of the pass
+            tapResults : dict
+                Results at each of the :meth:`tapSkips`
+            subsample : int
+                Subsample factor
+            
+            Returns
+            -------
+            result : np.ndarray
+                Result for the segment. This may have fewer columns than expected
+                if the analysis was cancelled.
+            complete : bool
+                True if all of the segment's samples have been analysed
+        """
+        offset = segment.n0 - self.n0
+        skip = offset % subsample
+        # if a tap has no result, the pass was cancelled before it started
+        source = result if skip == 0 else tapResults.get(skip, result[:, :0])
+        start = (offset - skip) // subsample
+        numCols = (segment.n1 - segment.n0) // subsample
+        segResult = source[:, start:start+numCols]
+        return segResult, segResult.shape[1] == numCols
+
+    def segmentBlock(self, segment, block, start, subsample):
+        """ Return the part of `block`, which starts at column `start` of the 
+            pass result, that is in `segment`'s result, and the column of the 
+            segment's result at which it starts.
+            
+            Segments that need a tap (see :meth:`tapSkips`) are not in the pass 
+            result, so an empty block is returned for them.
+        """
+        offset = segment.n0 - self.n0
+        if offset % subsample != 0:
+            return block[:, :0], 0
+        segStart = offset // subsample
+        numCols = (segment.n1 - segment.n0) // subsample
+        lo = max(start, segStart)
+        hi = min(start + block.shape[1], segStart + numCols)
+        if hi <= lo:
+            return block[:, :0], 0
+        return block[:, lo-start:hi-start], lo-segStart
+
+def planPasses(segments, mergeOverlapping=False) -> list:
+    """ Return list of :class:`AnalysisPass` to analyse all `segments`
+        
+        Parameters
+        ----------
+        segments : list
+            List of :class:`SegmentRequest`
+        mergeOverlapping : bool
+            If True, all overlapping segments are analysed in one pass. Otherwise,
+            only segments that start at the same sample are.
+    """
+    passes = []
+    for segment in sorted(segments, key=lambda s: (s.n0, -s.n1)):
+        last = passes[-1] if len(passes) > 0 else None
+        if last is not None and (segment.n0 == last.n0 or (mergeOverlapping and segment.n0 < last.n1)):
+            last.segments.append(segment)
+            last.n1 = max(last.n1, segment.n1)
+        else:
+            passes.append(AnalysisPass(segment.n0, segment.n1, [segment]))
+    return passes
+
+def timeShards(analysisPass, numShards, subsample, preRoll) -> list:
+    """ Return list of :class:`TimeShard` splitting `analysisPass` into `numShards`
+        parts of (almost) the same length.
+        
+        Shards start at multiples of `subsample` samples from the start of the 
+        pass, so their results line up with those of the whole pass.
+        Each shard is given a pre-roll of `preRoll` samples, or as many as there
+        are between the start of the pass and the start of the shard.
+    """
+    numCols = (analysisPass.n1 - analysisPass.n0) // subsample
+    numShards = max(1, min(numShards, numCols))
+    bounds = [round(k * numCols / numShards) for k in range(numShards + 1)]
+    shards = []
+    for k, (c0, c1) in enumerate(zip(bounds[:-1], bounds[1:])):
+        n0 = analysisPass.n0 + c0 * subsample
+        n1 = analysisPass.n0 + c1 * subsample if k < numShards - 1 else analysisPass.n1
+        shards.append(TimeShard(n0, n1, min(preRoll, n0 - analysisPass.n0), c0))
+    return shards
+
+def channelGroups(numChannels, numGroups) -> list:
+    """ Return list of (c0, c1) ranges splitting `numChannels` channels into 
+        `numGroups` contiguous groups of (almost) the same size.
+        
+        There are never more groups than channels.
+    """
+    numGroups = max(1, min(numGroups, numChannels))
+    bounds = [round(k * numChannels / numGroups) for k in range(numGroups + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def relaxationTime(damping, sr) -> float:
+    """ Return time constant, in seconds, of the decay of a minimum bandwidth 
+        detector's response after its input stops 
+    """
+    return 1 / (np.pi * MIN_BANDWIDTH_FACTOR * damping * sr)
+
+def shardErrorBound(damping, sr, preRoll) -> float:
+    """ Return bound on difference between a time shard's results and the serial
+        result, relative to the largest response, after `preRoll` seconds
+    """
+    return float(np.exp(-preRoll / relaxationTime(damping, sr)))
+
+def preRollForTolerance(damping, sr, tolerance=1e-3) -> float:
+    """ Return pre-roll, in seconds, for which :func:`shardErrorBound` is `tolerance` """
+    return -np.log(tolerance) * relaxationTime(damping, sr)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory and on-disk LRU caches of analysis results.
+
+Results are keyed by the audio content, the segment's sample range, the
+DetectorBank parameters and the subsample factor, so re-analysing a segment
+that hasn't changed doesn't need a DetectorBank.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import hashlib
+import tempfile
+import os
+
+def audioHash(audio) -> str:
+    """ Return hex digest of the content of `audio` array """
+    audio = np.ascontiguousarray(audio)
+    return hashlib.blake2b(memoryview(audio).cast("B"), digest_size=16).hexdigest()
+
+def detCharsBytes(detChars) -> bytes:
+    """ Return hashable representation of `detChars` array """
+    return np.ascontiguousarray(detChars, dtype=np.float64).tobytes()
+
+@dataclass(frozen=True)
+class ResultKey:
+    """ Hashable key for :class:`ResultCache`
+        
+        `params` is a sorted tuple of (name, value) pairs of all DetectorBank
+        parameters except `detChars` (which is stored as bytes) and `numThreads`,
+        which does not change the result.
+    """
+    audio: str
+    n0: int
+    n1: int
+    params: tuple
+    detChars: bytes
+    subsample: int
+    reduction: str = "point"
+    dtype: str = "float64"
+    
+    ignoreParams = ("numThreads", "detChars", "profile")
+    
+    @classmethod
+    def make(cls, audioHash, n0, n1, params, subsample, reduction="point", dtype=np.float64):
+        """ Make key from audio hash string, segment range, dict of DetectorBank
+            `params` (as returned by ArgsWidget.getArgs), subsample factor,
+            reduction mode and result dtype
+        """
+        items = tuple(sorted((name, float(value) if isinstance(value, np.floating) else value)
+                             for name, value in params.items() if name not in cls.ignoreParams))
+        return cls(audioHash, int(n0), int(n1), items, detCharsBytes(params['detChars']),
+                   int(subsample), reduction, np.dtype(dtype).name)
+    
+    @property
+    def paramsDict(self) -> dict:
+        """ Return dict of the parameters in the key """
+        return dict(self.params)
+    
+    @property
+    def detCharsArray(self) -> np.ndarray:
+        """ Return `detChars` as (N,2) array """
+        return np.frombuffer(self.detChars, dtype=np.float64).reshape((-1, 2))
+    
+    @property
+    def digest(self) -> str:
+        """ Return hex digest of key, which is the same between sessions """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(repr((self.audio, self.n0, self.n1, self.params, self.subsample)).encode())
+        if self.reduction != "point":
+            # point results have the same digest as before reduction modes were added
+            h.update(self.reduction.encode())
+        if self.dtype != "float64":
+            h.update(self.dtype.encode())
+        h.update(self.detChars)
+        return h.hexdigest()
+
+class ResultCache:
+    """ LRU cache of result arrays, with a memory budget.
+        
+        Parameters
+        ----------
+        maxBytes : int
+            Maximum total size of cached arrays. When this is exceeded, the least
+            recently used results are discarded.
+    """
+    def __init__(self, maxBytes=512*2**20):
+        self._cache = OrderedDict()
+        self._maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def maxBytes(self) -> int:
+        """ Memory budget in bytes """
+        return self._maxBytes
+    
+    @maxBytes.setter
+    def maxBytes(self, value):
+        self._maxBytes = value
+        self._evict()
+    
+    def __len__(self):
+        return len(self._cache)
+    
+    def __contains__(self, key):
+        return key in self._cache
+    
+    def get(self, key):
+        """ Return result for `key`, or None if it is not cached """
+        result = self._cache.get(key, None)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return result
+    
+    def find(self, match):
+        """ Yield (key, result) pairs for which `match(key)` returns True, 
+            most recently used first.
+            
+            This does not count as a hit or miss, or change the order of the cache.
+        """
+        for key in reversed(self._cache):
+            if match(key):
+                yield key, self._cache[key]
+    
+    def put(self, key, result):
+        """ Cache `result` array for `key`
+            
+            If `result` is larger than the memory budget, it is not cached.
+        """
+        if result.nbytes > self.maxBytes:
+            return
+        if key in self._cache:
+            self.nbytes -= self._cache.pop(key).nbytes
+        self._cache[key] = result
+        self.nbytes += result.nbytes
+        self._evict()
+    
+    def clear(self):
+        """ Remove all results and reset hit and miss counts """
+        self._cache.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def _evict(self):
+        """ Remove least recently used results until within memory budget """
+        while self.nbytes > self.maxBytes and len(self._cache) > 0:
+            _, result = self._cache.popitem(last=False)
+            self.nbytes -= result.nbytes
+    
+    @property
+    def stats(self) -> str:
+        """ Return string describing cache hits, misses and memory use """
+        return (f"{self.hits} hits, {self.misses} misses, {len(self)} results "
+                f"({self.nbytes/2**20:.1f}/{self.maxBytes/2**20:.0f} MB)")
+
+def defaultCacheDir() -> Path:
+    """ Return directory for on-disk result cache in the user's cache directory """
+    cacheHome = os.environ.get("XDG_CACHE_HOME", None)
+    cacheHome = Path(cacheHome) if cacheHome else Path.home().joinpath(".cache")
+    return cacheHome.joinpath("detectorbank-gui", "results")
+
+class DiskResultCache:
+    """ Cache of result arrays as .npy files, with LRU eviction by total file size.
+        
+        Files are named by :attr:`ResultKey.digest`, so results persist between 
+        sessions. Results are returned as read-only memory-mapped arrays.
+        
+        Parameters
+        ----------
+        maxBytes : int
+            Maximum total size of cache files. When this is exceeded, the least
+            recently used files are deleted.
+        directory : Path, optional
+            Directory in which to store files. Defaults to :func:`defaultCacheDir`
+    """
+    def __init__(self, maxBytes=2*2**30, directory=None):
+        self.directory = Path(directory) if directory is not None else defaultCacheDir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def maxBytes(self) -> int:
+        """ Maximum size of cache, in bytes """
+        return self._maxBytes
+    
+    @maxBytes.setter
+    def maxBytes(self, value):
+        self._maxBytes = value
+        self._evict()
+    
+    def _path(self, key) -> Path:
+        return self.directory.joinpath(f"{key.digest}.npy")
+    
+    def _files(self) -> list[Path]:
+        return list(self.directory.glob("*.npy"))
+    
+    def __len__(self):
+        return len(self._files())
+    
+    def __contains__(self, key):
+        return self._path(key).exists()
+    
+    @property
+    def nbytes(self) -> int:
+        """ Total size of cache files """
+        return sum(f.stat().st_size for f in self._files())
+    
+    def get(self, key):
+        """ Return memory-mapped result for `key`, or None if it is not cached """
+        path = self._path(key)
+        try:
+            result = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+        os.utime(path) # mark as recently used
+        self.hits += 1
+        return result
+    
+    def put(self, key, result):
+        """ Write `result` array to cache for `key` 
+            
+            If `result` is larger than the cache size, it is not written.
+        """
+        if result.nbytes > self.maxBytes:
+            return
+        path = self._path(key)
+        # write to temp file and rename, so a partly written file is never read
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fileobj:
+                np.save(fileobj, np.ascontiguousarray(result))
+            os.replace(tmp, path)
+        except OSError:
+            Path(tmp).unlink(missing_ok=True)
+            return
+        self._evict()
+    
+    def clear(self):
+        """ Delete all cache files and reset hit and miss counts """
+        for f in self._files():
+            f.unlink(missing_ok=True)
+        self.hits = 0
+        self.misses = 0
+    
+    def _evict(self):
+        """ Delete least recently used files until within size limit """
+        files = [(f.stat().st_mtime, f.stat().st_size, f) for f in self._files()]
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if total <= self.maxBytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+    
+    @property
+    def stats(self) -> str:
+        """ Return string describing cache hits, misses and disk use """
+        return (f"{self.hits} hits, {self.misses} misses, {len(self)} files "
+                f"({self.nbytes/2**20:.1f}/{self.maxBytes/2**20:.0f} MB)")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Queue of analysis jobs, run in order of priority.
+
+Each job is a worker analysing one pass (see `planner`), tagged with the keys of
+the segments whose results it produces. At most `maxRunning` jobs are submitted
+at once; when one finishes, the pending job with the highest priority is
+submitted next. A job has high priority if any of its keys are in
+`JobScheduler.priorityKeys` (e.g. the plots on the page being shown), otherwise
+jobs are run in the order they were added.
+
+Changing the priority keys reorders the pending jobs, but doesn't interrupt
+those that are already running.
+"""
+from dataclasses import dataclass
+import itertools
+
+@dataclass
+class Job:
+    """ Worker waiting to be run, with the keys of the segments it analyses """
+    worker: object
+    keys: frozenset
+    order: int
+
+class JobScheduler:
+    """ Submit jobs in order of priority, with at most `maxRunning` running at once
+        
+        Parameters
+        ----------
+        submit : callable
+            Called with a worker to run it
+        maxRunning : int
+            Maximum number of workers to run at once
+    """
+    def __init__(self, submit, maxRunning=1):
+        self._submit = submit
+        self.maxRunning = maxRunning
+        self._pending = []
+        self._running = []
+        self._priorityKeys = frozenset()
+        self._count = itertools.count()
+    
+    @property
+    def numPending(self) -> int:
+        """ Number of jobs waiting to be run """
+        return len(self._pending)
+    
+    @property
+    def numRunning(self) -> int:
+        """ Number of jobs submitted that haven't finished """
+        return len(self._running)
+    
+    @property
+    def priorityKeys(self) -> frozenset:
+        """ Keys of segments whose jobs are run first """
+        return self._priorityKeys
+    
+    def setPriorityKeys(self, keys):
+        """ Run pending jobs for any of `keys` before the others """
+        self._priorityKeys = frozenset(keys)
+    
+    def add(self, worker, keys):
+        """ Queue `worker`, which analyses the segments with the given `keys` """
+        self._pending.append(Job(worker, frozenset(keys), next(self._count)))
+    
+    def _rank(self, job):
+        return (job.keys.isdisjoint(self._priorityKeys), job.order)
+    
+    def dispatch(self):
+        """ Submit pending jobs, highest priority first, until `maxRunning` are running """
+        while self._pending and len(self._running) < max(1, self.maxRunning):
+            job = min(self._pending, key=self._rank)
+            self._pending.remove(job)
+            self._running.append(job.worker)
+            self._submit(job.worker)
+    
+    def flush(self):
+        """ Submit all pending jobs, regardless of `maxRunning`
+            
+            This is used when the workers have been cancelled, so they will
+            finish as soon as they start.
+        """
+        for job in sorted(self._pending, key=self._rank):
+            self._running.append(job.worker)
+            self._submit(job.worker)
+        self._pending.clear()
+    
+    def jobFinished(self, worker):
+        """ Remove `worker` from the running jobs and submit the next """
+        if worker in self._running:
+            self._running.remove(worker)
+        self.dispatch()
+    
+    def clear(self):
+        """ Forget all pending and running jobs """
+        self._pending.clear()
+        self._running.clear()
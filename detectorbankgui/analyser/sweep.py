@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps, in which one segment is analysed with every combination of
+a grid of DetectorBank parameter values, so the results can be compared.
+
+:func:`sweepVariants` returns a :class:`SweepVariant` for each combination.
+If the results are proportional to the gain (see :func:`.extraction.isLinearInGain`),
+variants that only differ by gain don't all need to be analysed: the first is
+analysed and the others are scaled from its result. The remaining variants
+are independent runs, so the engine can analyse them in parallel (see
+:meth:`.engine.Engine.setSweep`).
+"""
+from .extraction import isLinearInGain, withoutProfile
+from detectorbank import DetectorBank
+from dataclasses import dataclass, field
+import itertools
+
+SWEEP_PARAMS = {"damping":"Damping", "gain":"Gain", "method":"Method",
+                "freqNorm":"Frequency normalization", "ampNorm":"Amplitude normalization"}
+""" Names of the parameters that can be swept, and their labels """
+
+FEATURE_NAMES = {
+    "method":{DetectorBank.runge_kutta:"Runge-Kutta",
+              DetectorBank.central_difference:"central difference"},
+    "freqNorm":{DetectorBank.freq_unnormalized:"unnormalized",
+                DetectorBank.search_normalized:"search normalized"},
+    "ampNorm":{DetectorBank.amp_unnormalized:"unnormalized",
+               DetectorBank.amp_normalized:"normalized"}}
+""" Names of the values of DetectorBank features, for labels """
+
+@dataclass
+class SweepVariant:
+    """ One combination of the swept parameter values
+        
+        `values` is a dict of the swept parameters' values and `params` is the
+        dict of DetectorBank parameters with these values. If `source` is not
+        None, it is the index of the variant whose result is scaled by `scale`
+        to give this one, rather than analysing it.
+    """
+    values: dict
+    params: dict = field(repr=False)
+    source: int = None
+    scale: float = 1
+    
+    @property
+    def analysed(self) -> bool:
+        """ Return True if this variant is analysed, rather than scaled """
+        return self.source is None
+    
+    @property
+    def label(self) -> str:
+        """ Return string of the swept parameters' values """
+        return ", ".join(f"{SWEEP_PARAMS[name]} {formatValue(name, value)}"
+                         for name, value in self.values.items())
+
+def formatValue(name, value) -> str:
+    """ Return string of parameter `name`'s `value` """
+    if name in FEATURE_NAMES:
+        return FEATURE_NAMES[name].get(value, str(value))
+    return f"{value:g}"
+
+def sweepVariants(params, grid) -> list[SweepVariant]:
+    """ Return :class:`SweepVariant` for each combination of values in `grid`
+        
+        Parameters
+        ----------
+        params : dict
+            Dict of DetectorBank parameters, as returned by ArgsWidget.getArgs
+        grid : dict
+            Dict of parameter names (see :data:`SWEEP_PARAMS`) and lists of
+            values. The parameters that aren't in `grid` are taken from `params`.
+    """
+    if (unknown := set(grid) - set(SWEEP_PARAMS)):
+        raise ValueError(f"Cannot sweep parameter(s) {', '.join(sorted(unknown))}")
+    names = list(grid)
+    variants = []
+    sources = {}
+    for values in itertools.product(*(grid[name] for name in names)):
+        values = dict(zip(names, values))
+        variant = SweepVariant(values, withoutProfile(params, **values))
+        if isLinearInGain(variant.params):
+            # variants with the same values, other than gain, can be scaled from one result
+            others = tuple((name, value) for name, value in values.items() if name != "gain")
+            source = sources.get(others, None)
+            if source is not None:
+                variant.source = source
+                variant.scale = variant.params['gain'] / variants[source].params['gain']
+            elif variant.params['gain'] != 0:
+                sources[others] = len(variants)
+        variants.append(variant)
+    return variants
+
+def numRuns(variants) -> int:
+    """ Return number of `variants` that need to be analysed """
+    return sum(variant.analysed for variant in variants)
@@ -1,20 +1,38 @@
 from detectorbankgui.analyser.analyser import Analyser, AnalysisWorker
+from detectorbankgui.analyser.engine import Event
+from detectorbankgui.analyser.planner import shardErrorBound, preRollForTolerance
+from detectorbankgui.analyser.sweep import sweepVariants
+from detectorbankgui.analyser.calibration import Calibration
 from detectorbank import DetectorBank
 import numpy as np
 import os
+import time
 import pytest 
 
 pytest_plugin = "pytest-qt"
 
 class MockResultsWidget:
+    pageChanged = Event()
+    
     def __init__(self):
         self.results = {}
+        self.complete = {}
+        self.blocks = {}
+        self.labels = None
         
-    def addPlots(self, det_chars, segments):
+    def addPlots(self, det_chars, segments, labels=None):
+        self.labels = labels
         return list(range(len(segments)))
     
-    def addData(self, key, result): 
+    def pageKeys(self):
+        return []
+    
+    def addData(self, key, result, complete=True, stop=None): 
         self.results[key] = result
+        self.complete[key] = complete
+    
+    def updateData(self, key, block, start, size):
+        self.blocks.setdefault(key, []).append((start, block))
 
 class Segment:
     def __init__(self, n0, n1):
@@ -51,7 +69,145 @@ def test_analyser(audio2, audio2_results, qtbot, atol):
         expected = np.loadtxt(result_file)
         result = results_widget.results[key]
         assert np.all(np.isclose(result, expected, atol=atol))
-        
+
+def test_process_pool(audio2, audio2_results, qtbot, atol, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget, numProcesses=2)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, 48000*4), Segment(48000*5, 48000*9)]
+    subsample = 1000
+    analyser.setParams(audio, sr, params, segments, subsample)
+    
+    with qtbot.waitSignal(analyser.finished, timeout=60000):
+        analyser.start()
+    analyser.shutdown()
+    
+    for result_file in audio2_results:
+        key = int(result_file.stem)
+        expected = np.loadtxt(result_file)
+        result = results_widget.results[key]
+        assert results_widget.complete[key]
+        assert np.all(np.isclose(result, expected, atol=atol))
+
+def test_result_cache(audio2, qtbot, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    subsample = 1000
+    segments = [Segment(0, 48000*4)]
+    analyser.setParams(audio, sr, params, segments, subsample)
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    first = results_widget.results[0]
+    assert (analyser.resultCache.hits, analyser.resultCache.misses) == (0, 1)
+    
+    # add a second segment; first should come from cache
+    segments = [Segment(0, 48000*4), Segment(48000*5, 48000*9)]
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert len(analyser.analysers) == 1
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert (analyser.resultCache.hits, analyser.resultCache.misses) == (1, 2)
+    assert results_widget.results[0] is first
+
+def test_extend_segment(audio2, qtbot, atol, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    subsample = 100
+    
+    analyser.setParams(audio, sr, params, [Segment(1000, 48000*2)], subsample)
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    # extended segment should continue from previous DetectorBank
+    n1 = 48000*3 + 17
+    analyser.setParams(audio, sr, params, [Segment(1000, n1)], subsample)
+    assert analyser.analysers[0].continuation is not None
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    extended = results_widget.results[0]
+    
+    worker = AnalysisWorker(audio, sr, params, 1000, n1, subsample)
+    with qtbot.waitSignal(worker.finished, timeout=30000):
+        worker.start()
+    assert extended.shape == worker.result.shape
+    assert np.all(np.isclose(extended, worker.result, atol=atol))
+    
+    # shortened segment is sliced from extended result
+    analyser.setParams(audio, sr, params, [Segment(1000, 48000*2)], subsample)
+    assert len(analyser.analysers) == 0
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert np.array_equal(results_widget.results[0], extended[:, :(48000*2-1000)//subsample])
+
+def test_same_start(audio2, qtbot, atol, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, 48000*3), Segment(0, 48000), Segment(48000, 48000*2)]
+    subsample = 100
+    
+    # segments starting at the same sample are analysed together
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert len(analyser.analysers) == 2
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    for key, segment in enumerate(segments):
+        worker = AnalysisWorker(audio, sr, params, *segment.samples, subsample)
+        with qtbot.waitSignal(worker.finished, timeout=30000):
+            worker.start()
+        assert results_widget.complete[key]
+        assert results_widget.results[key].shape == worker.result.shape
+        assert np.all(np.isclose(results_widget.results[key], worker.result, atol=atol))
+
+def test_add_detectors(audio2, qtbot, atol, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    det_char = params['detChars']
+    detBankParams = dict(params, detChars=det_char[::2])
+    segments = [Segment(0, 48000*2)]
+    subsample = 100
+    
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    # only the new detectors should be analysed
+    detBankParams["detChars"] = det_char
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    assert len(analyser.analysers) == 1
+    assert analyser.analysers[0].params["detChars"].shape == det_char[1::2].shape
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    merged = results_widget.results[0]
+    
+    worker = AnalysisWorker(audio, sr, detBankParams, *segments[0].samples, subsample)
+    with qtbot.waitSignal(worker.finished, timeout=30000):
+        worker.start()
+    assert merged.shape == worker.result.shape
+    assert np.all(np.isclose(merged, worker.result, atol=atol))
+    
+    # removing detectors doesn't need any analysis
+    detBankParams["detChars"] = det_char[3:7]
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    assert len(analyser.analysers) == 0
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert np.array_equal(results_widget.results[0], merged[3:7])
+
 def test_subsample(audio2, audio2_results, qtbot):
     results_widget = MockResultsWidget()
     analyser = Analyser(results_widget)
@@ -85,6 +241,31 @@ def test_subsample(audio2, audio2_results, qtbot):
         assert result.shape[1] < expected.shape[1]
         assert result.shape[1]  == expected.shape[1] // 10
         
+@pytest.mark.parametrize("reduction", ["point", "max", "mean", "rms"])
+def test_reduction(audio2, qtbot, reduction, params):
+    audio, sr = audio2
+    
+    n0, n1 = 1000, 48000*2 + 17
+    subsample = 1000
+    
+    worker = AnalysisWorker(audio, sr, params, n0, n1)
+    with qtbot.waitSignal(worker.finished, timeout=30000):
+        worker.start()
+    full = worker.result
+    
+    worker = AnalysisWorker(audio, sr, params, n0, n1, subsample, reduction=reduction)
+    with qtbot.waitSignal(worker.finished, timeout=30000):
+        worker.start()
+        
+    numCols = (n1-n0) // subsample
+    windows = full[:, :numCols*subsample].reshape((len(params['detChars']), numCols, subsample))
+    expected = {"point":windows[:, :, 0], 
+                "max":windows.max(axis=2), 
+                "mean":windows.mean(axis=2),
+                "rms":np.sqrt(np.mean(windows**2, axis=2))}[reduction]
+    assert worker.result.shape == expected.shape
+    assert np.allclose(worker.result, expected)
+        
 def test_analyse_full_audio(audio, audio_results, qtbot, atol):
     
     audio, sr = audio
@@ -108,4 +289,313 @@ def test_analyse_full_audio(audio, audio_results, qtbot, atol):
         analyser.start()
         
     expected = np.loadtxt(audio_results)
-    assert np.all(np.isclose(analyser.result, expected, atol=atol))
\ No newline at end of file
+    assert np.all(np.isclose(analyser.result, expected, atol=atol))
+
+def test_progress(audio2, qtbot, params):
+    audio, sr = audio2
+    
+    worker = AnalysisWorker(audio, sr, params, subsample=1, progressInterval=0.1)
+    progress = []
+    worker.progress.connect(progress.append)
+    
+    t0 = time.monotonic()
+    with qtbot.waitSignal(worker.finished, timeout=30000):
+        worker.start()
+    elapsed = time.monotonic() - t0
+    
+    # all samples are reported, but signals are limited by time, not number of samples
+    assert sum(progress) == worker.numCols
+    assert len(progress) <= elapsed / worker.progressInterval + 2
+
+def test_stream(audio2, qtbot, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, len(audio)), Segment(0, 48000)]
+    subsample = 1
+    analyser.setParams(audio, sr, params, segments, subsample)
+    for worker in analyser.analysers:
+        worker.streamInterval = 0.05
+    
+    with qtbot.waitSignal(analyser.finished, timeout=60000):
+        analyser.start()
+    
+    # blocks are contiguous and match the final result
+    for key in range(len(segments)):
+        blocks = results_widget.blocks[key]
+        assert len(blocks) > 1
+        assert [start for start, _ in blocks] == list(np.cumsum([0] + [b.shape[1] for _, b in blocks[:-1]]))
+        streamed = np.hstack([block for _, block in blocks])
+        result = results_widget.results[key]
+        assert np.array_equal(streamed, result[:, :streamed.shape[1]])
+
+def test_cancel(audio2, qtbot, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    f = np.array([440*2**(k/12) for k in range(-48,40)])
+    detBankParams = dict(params, detChars=np.column_stack((f, np.zeros(len(f)))))
+    
+    segments = [Segment(0, len(audio)), Segment(0, len(audio))]
+    subsample = 1
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    
+    analyser.pause()
+    analyser.start()
+    qtbot.wait(100)
+    assert analyser.paused
+    assert analyser.running
+    
+    analyser.resume()
+    qtbot.wait(100)
+    
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.cancel()
+    
+    assert not analyser.running
+    for key in range(len(segments)):
+        assert results_widget.complete[key] is False
+        assert results_widget.results[key].shape[1] < len(audio)
+    for worker in analyser.analysers:
+        assert worker.det is None
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_memory_mapped(audio2, qtbot, tmp_path, atol, num_processes, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget, numProcesses=num_processes)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, 48000*2), Segment(48000, 48000*2), Segment(48000*3, 48000*3+500)]
+    subsample = 10
+    
+    # only the first two segments' results are large enough to be memory-mapped
+    analyser.setScratchEnabled(True, directory=tmp_path, threshold=len(params['detChars'])*4800*8)
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert [worker.mapped for worker in analyser.analysers] == [True, True, False]
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+        
+    assert isinstance(results_widget.results[0], np.memmap)
+    assert isinstance(results_widget.results[1], np.memmap)
+    assert not isinstance(results_widget.results[2], np.memmap)
+    # mapped results aren't streamed
+    assert set(results_widget.blocks.keys()) <= {2}
+    
+    for key, segment in enumerate(segments):
+        worker = AnalysisWorker(audio, sr, params, *segment.samples, subsample)
+        with qtbot.waitSignal(worker.finished, timeout=30000):
+            worker.start()
+        assert results_widget.results[key].shape == worker.result.shape
+        assert np.all(np.isclose(results_widget.results[key], worker.result, atol=atol))
+    
+    analyser.shutdown()
+    assert not any(tmp_path.iterdir())
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_time_shards(audio2, qtbot, atol, num_processes, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget, numProcesses=num_processes)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, 48000*3), Segment(24000, 48000*2), Segment(48000*3, 48000*3+500)]
+    subsample = 100
+    
+    # last segment is too short to be sharded
+    analyser.timeShards = 3
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert len(analyser.analysers) == 7
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    preRoll = preRollForTolerance(params['damping'], sr, analyser.shardTolerance)
+    bound = shardErrorBound(params['damping'], sr, preRoll)
+    for key, segment in enumerate(segments):
+        worker = AnalysisWorker(audio, sr, params, *segment.samples, subsample)
+        with qtbot.waitSignal(worker.finished, timeout=30000):
+            worker.start()
+        assert results_widget.complete[key]
+        assert results_widget.results[key].shape == worker.result.shape
+        tol = bound * np.abs(worker.result).max() + atol
+        assert np.all(np.abs(results_widget.results[key] - worker.result) <= tol)
+        for start, block in results_widget.blocks.get(key, []):
+            size = block.shape[1]
+            assert np.array_equal(block, results_widget.results[key][:, start:start+size])
+    
+    # sharded results are approximate, so aren't cached
+    assert len(analyser.resultCache) == 1
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_frequency_shards(audio2, qtbot, atol, num_processes, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget, numProcesses=num_processes)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(0, 48000*2), Segment(24000, 48000*2)]
+    subsample = 100
+    
+    analyser.frequencyShards = 3
+    analyser.timeShards = 2
+    analyser.shardPreRoll = 0.25
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert len(analyser.analysers) == 12
+    assert [len(worker.params['detChars']) for worker in analyser.analysers[:3]] == [8, 9, 8]
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    bound = shardErrorBound(params['damping'], sr, analyser.shardPreRoll)
+    for key, segment in enumerate(segments):
+        worker = AnalysisWorker(audio, sr, params, *segment.samples, subsample)
+        with qtbot.waitSignal(worker.finished, timeout=30000):
+            worker.start()
+        assert results_widget.complete[key]
+        assert results_widget.results[key].shape == worker.result.shape
+        tol = bound * np.abs(worker.result).max() + atol
+        assert np.all(np.abs(results_widget.results[key] - worker.result) <= tol)
+        for start, block in results_widget.blocks.get(key, []):
+            assert block.shape[0] == len(params['detChars'])
+            size = block.shape[1]
+            assert np.array_equal(block, results_widget.results[key][:, start:start+size])
+    
+    # without time shards, results are exact, so are cached
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget, numProcesses=num_processes)
+    analyser.frequencyShards = 3
+    analyser.setParams(audio, sr, params, segments, subsample)
+    assert len(analyser.analysers) == 6
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert len(analyser.resultCache) == 2
+    for key, segment in enumerate(segments):
+        worker = AnalysisWorker(audio, sr, params, *segment.samples, subsample)
+        worker.start()
+        assert np.all(np.isclose(results_widget.results[key], worker.result, atol=atol))
+
+
+class PagedResultsWidget(MockResultsWidget):
+    """ Results widget with unique keys for each call to addPlots """
+    def __init__(self, page):
+        super().__init__()
+        self.page = page
+        self.numPlots = 0
+        self.order = []
+        
+    def addPlots(self, det_chars, segments):
+        keys = list(range(self.numPlots, self.numPlots + len(segments)))
+        self.numPlots += len(segments)
+        return keys
+    
+    def pageKeys(self):
+        return self.page
+    
+    def addData(self, key, result, complete=True, stop=None):
+        super().addData(key, result, complete, stop)
+        self.order.append(key)
+
+def test_priority(audio2, qtbot, params):
+    results_widget = PagedResultsWidget(page=[2, 3])
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    
+    segments = [Segment(k*24000, (k+1)*24000) for k in range(4)]
+    subsample = 100
+    
+    analyser.setParams(audio, sr, params, segments, subsample)
+    analyser.start()
+    assert analyser.started
+    
+    # segments can be added while the analysis is running
+    segments = [Segment(k*24000, (k+1)*24000) for k in range(4, 6)]
+    analyser.setParams(audio, sr, params, segments, subsample)
+    # changing page changes which queued segments are analysed next
+    results_widget.page = [5]
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        results_widget.pageChanged.emit(1)
+        analyser.start()
+    
+    assert not analyser.running
+    assert results_widget.order[:2] == [2, 5]
+    assert sorted(results_widget.order) == list(range(6))
+    for key in range(6):
+        worker = AnalysisWorker(audio, sr, params, key*24000, (key+1)*24000, subsample)
+        worker.start()
+        assert results_widget.complete[key]
+        assert np.array_equal(results_widget.results[key], worker.result)
+
+def test_sweep(audio2, qtbot, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    
+    audio, sr = audio2
+    variants = sweepVariants(params, {"damping":[0.0001, 0.0002], "gain":[25, 50]})
+    
+    # each variant is plotted, labelled with its values
+    analyser.setSweep(audio, sr, variants, Segment(0, 48000), 100)
+    assert results_widget.labels == [variant.label for variant in variants]
+    assert len(analyser.analysers) == 2
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert sorted(results_widget.results) == [0, 1, 2, 3]
+    assert np.allclose(results_widget.results[1], 2 * results_widget.results[0])
+    assert not np.allclose(results_widget.results[2], results_widget.results[0])
+
+def test_apply_calibration(audio2, qtbot, params):
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    analyser.calibrations = [Calibration(48000, 25, 2, 10, 5.0)]
+    
+    audio, sr = audio2
+    detBankParams = dict(params, numThreads=0)
+    segments = [Segment(0, 48000)]
+    subsample = 100
+    
+    # calibrated number of threads is only used for 'Auto' (0)
+    analyser.setParams(audio, sr, dict(detBankParams, numThreads=4), segments, subsample)
+    assert analyser.analysers[0].params['numThreads'] == 4
+    assert analyser.analysers[0].blockDuration == 10
+    
+    analyser.clearCache()
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    worker, = analyser.analysers
+    assert worker.params['numThreads'] == 2
+    assert worker.blockSize == 480
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    
+    expected = AnalysisWorker(audio, sr, detBankParams, *segments[0].samples, subsample)
+    expected.start()
+    assert np.array_equal(results_widget.results[0], expected.result)
+    
+    # calibration for many more detectors isn't used
+    analyser.calibrations = [Calibration(48000, 400, 2, 10, 5.0)]
+    analyser.clearCache()
+    analyser.setParams(audio, sr, detBankParams, segments, subsample)
+    worker, = analyser.analysers
+    assert worker.params['numThreads'] == 0
+    assert worker.blockDuration == AnalysisWorker.blockDuration
+
+def test_worker_error(audio2, qtbot, monkeypatch, params):
+    def extractResults(*args, **kwargs):
+        raise RuntimeError("extraction failed")
+    monkeypatch.setattr("detectorbankgui.analyser.engine.extractResults", extractResults)
+    
+    results_widget = MockResultsWidget()
+    analyser = Analyser(results_widget)
+    audio, sr = audio2
+    analyser.setParams(audio, sr, params, [Segment(0, 48000)], 100)
+    
+    # error is reported and the analysis still finishes
+    errors = []
+    analyser.error.connect(errors.append)
+    with qtbot.waitSignal(analyser.finished, timeout=30000):
+        analyser.start()
+    assert [str(exc) for exc in errors] == ["extraction failed"]
+    assert not results_widget.complete[0]
+    assert not analyser.running
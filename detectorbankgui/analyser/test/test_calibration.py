@@ -0,0 +1,35 @@
+from detectorbankgui.analyser.calibration import (Calibration, calibrate, nearestCalibration,
+                                                  readCalibrations, writeCalibration)
+from qtpy.QtCore import QSettings
+import pytest
+
+def test_calibrate(params):
+    progress = []
+    calibration = calibrate(48000, params, duration=0.1, threadCounts=[1, 2],
+                            blockDurations=[10, 30], callback=lambda *args: progress.append(args))
+    assert isinstance(calibration, Calibration)
+    assert calibration.numThreads in [1, 2]
+    assert calibration.blockDuration in [10, 30]
+    assert calibration.channels == 25
+    assert calibration.rate > 0
+    # default block duration isn't timed twice
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    
+    assert calibrate(48000, params, duration=0.1, checkState=lambda: False) is None
+
+def test_settings(tmp_path):
+    settings = QSettings(str(tmp_path.joinpath("settings.ini")), QSettings.IniFormat)
+    calibrations = [Calibration(48000, 25, 2, 10, 5.0), Calibration(44100, 88, 8, 100, 1.5)]
+    for calibration in calibrations:
+        writeCalibration(settings, calibration)
+    assert sorted(readCalibrations(settings), key=lambda c: c.sr) == sorted(calibrations, key=lambda c: c.sr)
+    
+    assert nearestCalibration(calibrations, 48000, 30) == calibrations[0]
+    assert nearestCalibration(calibrations, 48000, 80) == calibrations[1]
+    assert nearestCalibration([], 48000, 80) is None
+    
+    # calibrations for very different detectors or sample rates aren't used
+    assert nearestCalibration(calibrations, 96000, 2000) is None
+    assert nearestCalibration(calibrations, 16000, 25) is None
+    assert nearestCalibration(calibrations, 48000, 200) is None
+    assert nearestCalibration(calibrations, 48000, 200, maxRatio=4) == calibrations[1]
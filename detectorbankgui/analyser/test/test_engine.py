@@ -0,0 +1,364 @@
+from detectorbankgui.analyser.engine import Engine, Worker, ProcessWorker, Event
+from detectorbankgui.analyser.extraction import (REDUCTIONS, redecimate, BlockRedecimator, scaleResult,
+                                                 ScratchArray, SharedArray, makeDetectorBank)
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from detectorbankgui.profilemanager import ProfileManager
+from detectorbank import DetectorBank
+import numpy as np
+import subprocess
+import sys
+import pytest
+
+def test_no_qt():
+    code = ("import sys, detectorbankgui.analyser.engine; "
+            "sys.exit(any(name.split('.')[0] in ('qtpy', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6') "
+            "for name in sys.modules))")
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+def test_event():
+    class Emitter:
+        changed = Event()
+    a, b = Emitter(), Emitter()
+    received = []
+    a.changed.connect(lambda *args: received.append(args))
+    a.changed.emit(1, "x")
+    b.changed.emit(2, "y")
+    assert received == [(1, "x")]
+    a.changed.disconnect()
+    a.changed.emit(3, "z")
+    assert received == [(1, "x")]
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_analyse(audio2, atol, num_processes, params):
+    engine = Engine(numProcesses=num_processes)
+    audio, sr = audio2
+    segments = [(0, 48000*2), (0, 48000), (24000, 48000*2)]
+    subsample = 100
+    
+    progress = []
+    results = engine.analyse(audio, sr, params, segments, subsample, progress=progress.append)
+    assert sum(progress) == sum(n1-n0 for n0, n1 in segments[::2]) // subsample
+    assert not engine.running
+    
+    for (n0, n1), result in zip(segments, results):
+        worker = Worker(audio, sr, params, n0, n1, subsample)
+        worker.start()
+        assert result.shape == worker.result.shape
+        assert np.all(np.isclose(result, worker.result, atol=atol))
+    
+    # second time, all results are cached
+    engine.resultCache.clear()
+    engine.analyse(audio, sr, params, segments, subsample)
+    cached = engine.analyse(audio, sr, params, segments, subsample)
+    assert engine.resultCache.hits == len(segments)
+    assert all(np.array_equal(a, b) for a, b in zip(results, cached))
+    engine.shutdown()
+
+def test_worker_error(audio2, monkeypatch, params):
+    audio, sr = audio2
+    
+    def extractResults(*args, **kwargs):
+        yield 10
+        raise RuntimeError("extraction failed")
+    monkeypatch.setattr("detectorbankgui.analyser.engine.extractResults", extractResults)
+    
+    class Pool:
+        released = []
+        def acquire(self, sr, audio, params):
+            return makeDetectorBank(sr, audio, params)
+        def release(self, det, sr, params):
+            self.released.append(det)
+    
+    # error is emitted, then the partial result, and the bank is still released
+    worker = Worker(audio, sr, params, 0, 48000, 100, bankPool=Pool())
+    errors, finished = [], []
+    worker.error.connect(errors.append)
+    worker.finished.connect(lambda result, complete: finished.append((result, complete)))
+    worker.start()
+    assert [str(exc) for exc in errors] == ["extraction failed"]
+    (result, complete), = finished
+    assert result.shape == (len(params['detChars']), 10)
+    assert not complete
+    assert len(Pool.released) == 1
+    assert worker.det is None
+    
+    # engine re-raises the error, and isn't left running
+    engine = Engine()
+    engineErrors = []
+    engine.error.connect(engineErrors.append)
+    with pytest.raises(RuntimeError):
+        engine.analyse(audio, sr, params, [(0, 48000)], 100)
+    assert len(engineErrors) == 1
+    assert not engine.running
+    assert len(engine.resultCache) == 0
+    engine.shutdown()
+
+@pytest.mark.parametrize("cancelled", [False, True])
+def test_process_worker_error(audio2, params, cancelled):
+    audio, sr = audio2
+    
+    class Executor:
+        def submit(self, fn, job):
+            future = Future()
+            if cancelled:
+                future.cancel()
+                future.set_running_or_notify_cancel()
+            else:
+                future.set_exception(BrokenProcessPool("process died"))
+            return future
+    
+    sharedAudio = SharedArray.fromArray(audio)
+    worker = ProcessWorker(sharedAudio, Executor(), audio, sr, params, 0, 48000, 100)
+    errors, finished = [], []
+    worker.error.connect(errors.append)
+    worker.finished.connect(lambda result, complete: finished.append(complete))
+    worker.start()
+    sharedAudio.unlink()
+    
+    # a cancelled job only gives a partial result, but anything else is an error
+    assert finished == [False]
+    assert len(errors) == (0 if cancelled else 1)
+
+def test_iter_results(audio2, params):
+    engine = Engine()
+    audio, sr = audio2
+    segments = [(0, 48000), (48000, 48000*2), (48000*2, 48000*3)]
+    
+    finished = []
+    engine.finished.connect(lambda: finished.append(True))
+    results = engine.iterResults(audio, sr, params, segments, 100)
+    idx, result, complete = next(results)
+    assert idx == 0
+    assert complete
+    assert result.shape == (25, 480)
+    
+    # closing the generator cancels the rest of the analysis
+    results.close()
+    assert not engine.running
+    assert finished == [True]
+    assert engine.wait()
+
+
+def test_bank_pool(audio2, params):
+    # don't keep banks for continuations, so they are returned to the pool
+    engine = Engine(maxContinuations=0)
+    audio, sr = audio2
+    segments = [(k*24000, (k+1)*24000) for k in range(4)]
+    subsample = 100
+    
+    results = engine.analyse(audio, sr, params, segments, subsample)
+    pool = engine.bankPool
+    assert pool.hits + pool.misses == len(segments)
+    if hasattr(DetectorBank, "setInputBuffer"):
+        # banks are given new audio, rather than being made again
+        assert pool.misses == 1
+        assert len(pool) == 1
+    else:
+        assert pool.misses == len(segments)
+        assert len(pool) == 0
+    
+    for (n0, n1), result in zip(segments, results):
+        worker = Worker(audio, sr, params, n0, n1, subsample)
+        worker.start()
+        assert np.array_equal(result, worker.result)
+    
+    # banks are only reused for the same parameters
+    engine.analyse(audio, sr, dict(params, damping=0.0002), segments[:1], subsample)
+    assert pool.hits + pool.misses == len(segments) + 1
+    assert pool.hits <= len(segments) - 1
+    engine.shutdown()
+    assert len(pool) == 0
+
+
+def test_estimate_continuations(audio2, params):
+    audio, sr = audio2
+    segments = [(0, 24000), (24000, 48000)]
+    kept = Engine(maxContinuations=8).estimateMemory(audio, sr, params, segments, 100)
+    assert kept.continuations == 4 * (2*len(audio) - 24000)
+    
+    engine = Engine(maxContinuations=0)
+    estimate = engine.estimateMemory(audio, sr, params, segments, 100)
+    assert estimate.continuations == 0
+    assert estimate.total == kept.total - kept.continuations
+    # DetectorBanks aren't given the rest of the audio if they won't be kept
+    engine.setParams(audio, sr, params, segments, 100)
+    assert not any(worker.keepAlive for worker in engine.analysers)
+
+
+def test_profile(audio2, default_config):
+    profile = ProfileManager(default_config).getProfile("_test_profile2")
+    params = profile.params()
+    assert profile.matches(params)
+    assert not profile.matches(dict(params, gain=1))
+    assert not profile.matches(dict(params, detChars=params['detChars'][1:]))
+    # number of threads doesn't change the results
+    assert profile.matches(dict(params, numThreads=params['numThreads'] + 1))
+    
+    engine = Engine()
+    audio, sr = audio2
+    segments = [(0, 48000)]
+    expected, = engine.analyse(audio, sr, params, segments, 100)
+    
+    # results are the same whether the bank is made from the profile or the
+    # parameters (which it is if the profile can't be loaded), so they are cached
+    engine.resultCache.clear()
+    result, = engine.analyse(audio, sr, dict(params, profile="_test_profile2"), segments, 100)
+    assert np.allclose(result, expected)
+    engine.analyse(audio, sr, params, segments, 100)
+    assert engine.resultCache.hits == 1
+
+def test_profile_used(audio2, monkeypatch, default_config):
+    audio, sr = audio2
+    try:
+        DetectorBank("_test_profile2", audio[:100])
+    except (TypeError, ValueError, RuntimeError):
+        pytest.skip("DetectorBank can't load profiles")
+    
+    calls = []
+    class RecordingBank(DetectorBank):
+        def __init__(self, *args):
+            calls.append(args[0])
+            super().__init__(*args)
+    monkeypatch.setattr("detectorbankgui.analyser.extraction.DetectorBank", RecordingBank)
+    
+    # bank is made from the profile, without falling back to the parameters
+    params = ProfileManager(default_config).getProfile("_test_profile2").params()
+    result, = Engine().analyse(audio, sr, dict(params, profile="_test_profile2"), [(0, 48000)], 100)
+    assert calls == ["_test_profile2"]
+    expected, = Engine().analyse(audio, sr, params, [(0, 48000)], 100)
+    assert np.allclose(result, expected)
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_rescale_gain(audio2, dtype, params):
+    engine = Engine()
+    audio, sr = audio2
+    segments = [(0, 48000), (24000, 72000)]
+    subsample = 100
+    engine.analyse(audio, sr, params, segments, subsample, dtype=dtype)
+    
+    # only the gain has changed, so cached results are scaled
+    newParams = dict(params, gain=40)
+    results = engine.analyse(audio, sr, newParams, segments, subsample, dtype=dtype)
+    assert engine.analysers == []
+    expected = Engine().analyse(audio, sr, newParams, segments, subsample, dtype=dtype)
+    for result, exp in zip(results, expected):
+        assert result.dtype == dtype
+        assert np.allclose(result, exp, rtol=1e-5, atol=1e-6 * np.abs(exp).max())
+    
+    # normalised amplitude isn't proportional to the gain
+    normParams = dict(params, ampNorm=DetectorBank.amp_normalized)
+    engine.analyse(audio, sr, normParams, segments, subsample, dtype=dtype)
+    engine.analyse(audio, sr, dict(normParams, gain=40), segments, subsample, dtype=dtype)
+    assert len(engine.analysers) == len(segments)
+
+def test_rescale_mapped(audio2, tmp_path, params):
+    scratch = ScratchArray((25, 1000), np.float32, tmp_path)
+    scratch.array[:] = np.random.default_rng(0).random((25, 1000))
+    
+    # memory-mapped results are scaled into another memory-mapped array
+    result = scaleResult(scratch.array, 2, tmp_path, chunkSize=1000)
+    assert isinstance(result, np.memmap)
+    assert result.dtype == np.float32
+    assert np.array_equal(result, 2 * scratch.array)
+    assert not isinstance(scaleResult(np.ones((25, 10)), 2), np.memmap)
+    
+    engine = Engine()
+    engine.setScratchEnabled(True, directory=tmp_path, threshold=0)
+    audio, sr = audio2
+    expected, = engine.analyse(audio, sr, params, [(0, 48000)], 100)
+    result, = engine.analyse(audio, sr, dict(params, gain=50), [(0, 48000)], 100)
+    assert engine.analysers == []
+    assert isinstance(result, np.memmap)
+    assert np.allclose(result, 2 * expected)
+
+@pytest.mark.parametrize("reduction", REDUCTIONS)
+def test_redecimate(audio2, reduction, params):
+    audio, sr = audio2
+    segments = [(0, 48000*2), (24000, 72000)]
+    fine = Engine().analyse(audio, sr, params, segments, 100, reduction)
+    expected = Engine().analyse(audio, sr, params, segments, 500, reduction)
+    for result, exp in zip(fine, expected):
+        decimated = redecimate(result, 5, reduction, chunkSize=1000)
+        assert decimated.shape == exp.shape
+        assert np.allclose(decimated, exp)
+    
+    # streamed blocks of any size give the same result
+    decimator = BlockRedecimator(5, reduction)
+    blocks = [decimator.add(fine[0][:, c0:c1], c0) for c0, c1 in [(0, 3), (3, 4), (4, 17), (17, 960)]]
+    assert blocks[0] is None
+    streamed = np.zeros_like(expected[0])
+    for block, start in filter(None, blocks):
+        streamed[:, start:start+block.shape[1]] = block
+    assert np.allclose(streamed, expected[0])
+    
+    # only the subsample factor has changed, so finer cached result is re-decimated
+    engine = Engine()
+    engine.analyse(audio, sr, params, segments, 100, reduction)
+    results = engine.analyse(audio, sr, params, segments, 500, reduction)
+    assert engine.analysers == []
+    assert all(np.allclose(result, exp) for result, exp in zip(results, expected))
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_base_subsample(audio2, num_processes, params):
+    engine = Engine(numProcesses=num_processes)
+    engine.baseSubsample = 100
+    engine.streamResults = True
+    audio, sr = audio2
+    segments = [(0, 48000*2), (48000, 48000*3)]
+    
+    blocks = {}
+    engine.blockReady.connect(lambda key, block, start, size: blocks.setdefault(key, []).append(
+        (start, size)))
+    results = engine.analyse(audio, sr, params, segments, 1000)
+    expected = Engine().analyse(audio, sr, params, segments, 1000)
+    assert all(np.allclose(result, exp) for result, exp in zip(results, expected))
+    # any partial results are streamed for the requested subsample factor
+    assert set(blocks) <= {0, 1}
+    assert all(start < size == 96 for key in blocks for start, size in blocks[key])
+    
+    # segments were analysed with subsample factor of 100, so 500 doesn't need analysis
+    results = engine.analyse(audio, sr, params, segments, 500)
+    assert engine.analysers == []
+    expected = Engine().analyse(audio, sr, params, segments, 500)
+    assert all(np.allclose(result, exp) for result, exp in zip(results, expected))
+    
+    # not if the finer results wouldn't fit in the budget
+    engine.clearCache()
+    engine.baseResultBudget = 1000
+    engine.analyse(audio, sr, params, segments, 1000)
+    engine.analyse(audio, sr, params, segments, 500)
+    assert len(engine.analysers) == len(segments)
+    engine.shutdown()
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_shard_threads(audio2, monkeypatch, num_processes, params):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    engine = Engine(numProcesses=num_processes)
+    engine.timeShards = 4
+    audio, sr = audio2
+    
+    # with 'Auto' threads, cores are shared between the shards run at the same time
+    engine.setParams(audio, sr, dict(params, numThreads=0), [(0, 48000*3)], 100)
+    assert len(engine.analysers) == 4
+    expected = 4 if num_processes > 1 else 0
+    assert all(worker.params['numThreads'] == expected for worker in engine.analysers)
+    
+    # but a given number of threads is used as it is
+    engine.setParams(audio, sr, params, [(0, 48000*3)], 100)
+    assert all(worker.params['numThreads'] == 1 for worker in engine.analysers)
+    engine.shutdown()
+
+@pytest.mark.parametrize("num_processes,time_shards,expected", [(4, 1, 2), (4, 2, 2), (8, 2, 1)])
+def test_group_threads(audio2, monkeypatch, num_processes, time_shards, expected, params):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    engine = Engine(numProcesses=num_processes)
+    engine.frequencyShards = 3
+    engine.timeShards = time_shards
+    audio, sr = audio2
+    
+    # cores are shared between the groups (and shards) that run at the same time
+    engine.setParams(audio, sr, dict(params, numThreads=0), [(0, 48000*3)], 100)
+    assert len(engine.analysers) == 3 * time_shards
+    assert all(worker.params['numThreads'] == expected for worker in engine.analysers)
+    engine.shutdown()
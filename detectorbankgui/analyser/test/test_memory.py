@@ -0,0 +1,60 @@
+from detectorbankgui.analyser.memory import estimateMemory, suggestSettings, MemoryEstimate
+import numpy as np
+
+def _kwargs(**kwargs):
+    args = {"numSamples":48000*60, 
+            "segments":[(0, 48000*60), (0, 48000*10), (48000*20, 48000*30)],
+            "channels":88, 
+            "blockSize":1440}
+    args.update(kwargs)
+    return args
+
+def test_estimate():
+    estimate = estimateMemory(subsample=1, **_kwargs())
+    assert isinstance(estimate, MemoryEstimate)
+    assert estimate.total == estimate.audio + estimate.blocks + estimate.results + estimate.plots
+    assert estimate.continuations == 0
+    
+    # two passes (segments starting at 0 are analysed together), plus a copy of the shorter one
+    assert estimate.results == 88 * 8 * (48000*60 + 48000*10 + 48000*10)
+    assert estimate.audio == 4 * 48000*60
+    
+    assert estimateMemory(subsample=10, **_kwargs()).results < estimate.results
+    assert estimateMemory(subsample=1, dtype=np.float32, **_kwargs()).results == estimate.results // 2
+    assert estimateMemory(subsample=1, numProcesses=2, **_kwargs()).audio > estimate.audio
+    
+    # each run of a sweep has its own results, but only one is analysed at a time
+    sweep = estimateMemory(subsample=1, runs=3, **_kwargs())
+    assert sweep.results == 3 * estimate.results
+    assert sweep.audio == estimate.audio
+    
+    # the result of the longer pass is memory-mapped, so doesn't count towards the total
+    mapped = estimateMemory(subsample=1, scratchThreshold=88*8*48000*30, **_kwargs())
+    assert mapped.mapped == 88 * 8 * 48000*60
+    assert mapped.results == 88 * 8 * 48000*10
+    assert mapped.total < estimate.total
+    
+    # kept DetectorBanks hold the audio from the start of their pass to the end
+    kept = estimateMemory(subsample=1, maxContinuations=8, **_kwargs())
+    assert kept.continuations == 4 * (48000*60 + 48000*40)
+    assert kept.total == estimate.total + kept.continuations
+    assert estimateMemory(subsample=1, maxContinuations=1, **_kwargs()).continuations == 4 * 48000*60
+    # banks aren't kept by worker processes
+    assert estimateMemory(subsample=1, maxContinuations=8, numProcesses=2, 
+                          **_kwargs()).continuations == 0
+
+def test_suggest():
+    kwargs = _kwargs()
+    budget = 512 * 2**20
+    assert estimateMemory(subsample=1, **kwargs).total > budget
+    
+    subsample, dtype, estimate = suggestSettings(budget, 1, **kwargs)
+    assert estimate.total <= budget
+    assert estimateMemory(subsample=subsample-1, dtype=dtype, **kwargs).total > budget
+    
+    # if a larger factor is needed anyway, that is the smallest one that fits
+    subsample, _, _ = suggestSettings(budget, 1000, **kwargs)
+    assert subsample == 1000
+    
+    # not even the audio fits
+    assert suggestSettings(2**20, 1, **kwargs) is None
@@ -0,0 +1,69 @@
+from detectorbankgui.analyser.planner import (SegmentRequest, AnalysisPass, planPasses, timeShards, 
+                                              channelGroups, relaxationTime, shardErrorBound, 
+                                              preRollForTolerance)
+import numpy as np
+import pytest
+
+def _requests(ranges):
+    return [SegmentRequest(idx, n0, n1, None) for idx, (n0, n1) in enumerate(ranges)]
+
+def test_same_start():
+    requests = _requests([(0, 1000), (500, 800), (0, 400), (600, 2000)])
+    passes = planPasses(requests)
+    assert [(p.n0, p.n1) for p in passes] == [(0, 1000), (500, 800), (600, 2000)]
+    assert [s.key for s in passes[0].segments] == [0, 2]
+    assert all(p.isExact(s) for p in passes for s in p.segments)
+
+def test_merge_overlapping():
+    requests = _requests([(0, 1000), (503, 800), (0, 400), (600, 2000), (3000, 4000)])
+    passes = planPasses(requests, mergeOverlapping=True)
+    assert [(p.n0, p.n1) for p in passes] == [(0, 2000), (3000, 4000)]
+    assert passes[0].tapSkips(10) == [3]
+    assert passes[0].tapSkips(100) == [3]
+    assert passes[0].tapSkips(1) == []
+
+def test_segment_result():
+    requests = _requests([(0, 1000), (503, 800), (0, 400), (600, 1000)])
+    analysisPass, = planPasses(requests, mergeOverlapping=True)
+    subsample = 10
+    
+    # value of each result is the sample index in the pass
+    samples = np.arange(analysisPass.n1 - analysisPass.n0)[np.newaxis, :]
+    result = samples[:, ::subsample]
+    tapResults = {skip:samples[:, skip::subsample] for skip in analysisPass.tapSkips(subsample)}
+    
+    for segment in analysisPass.segments:
+        segResult, complete = analysisPass.segmentResult(segment, result, tapResults, subsample)
+        expected = np.arange(segment.n0, segment.n1, subsample)[:(segment.n1-segment.n0)//subsample]
+        assert complete
+        assert np.array_equal(segResult[0], expected)
+    
+    # cancelled pass
+    segResult, complete = analysisPass.segmentResult(analysisPass.segments[-1], result[:, :70], 
+                                                     {}, subsample)
+    assert not complete
+    assert segResult.shape[1] == 10
+
+def test_time_shards():
+    analysisPass = AnalysisPass(5, 10007, _requests([(5, 10007)]))
+    shards = timeShards(analysisPass, 4, 10, 1000)
+    assert [(s.n0, s.n1, s.preRoll, s.offset) for s in shards] == [
+        (5, 2505, 0, 0), (2505, 5005, 1000, 250), (5005, 7505, 1000, 500), (7505, 10007, 1000, 750)]
+    # shard results make up the pass result
+    assert sum((s.n1 - s.n0) // 10 for s in shards) == (analysisPass.n1 - analysisPass.n0) // 10
+    
+    # pre-roll doesn't go before the start of the pass
+    assert [s.preRoll for s in timeShards(analysisPass, 4, 10, 3000)] == [0, 2500, 3000, 3000]
+    assert len(timeShards(analysisPass, 2000, 10, 0)) == 1000
+
+def test_shard_error_bound():
+    preRoll = preRollForTolerance(1e-4, 48000, 1e-3)
+    assert shardErrorBound(1e-4, 48000, preRoll) == pytest.approx(1e-3)
+    assert shardErrorBound(1e-4, 48000, 0) == 1
+    # detectors with more damping relax faster
+    assert relaxationTime(5e-4, 48000) < relaxationTime(1e-4, 48000)
+
+def test_channel_groups():
+    assert channelGroups(10, 3) == [(0, 3), (3, 7), (7, 10)]
+    assert channelGroups(2, 4) == [(0, 1), (1, 2)]
+    assert channelGroups(5, 1) == [(0, 5)]
@@ -0,0 +1,79 @@
+from detectorbankgui.analyser.resultcache import ResultCache, DiskResultCache, ResultKey, audioHash
+import numpy as np
+import pytest
+import os
+
+def test_key(params):
+    audio = np.linspace(-1, 1, 1000, dtype=np.float32)
+    digest = audioHash(audio)
+    assert digest == audioHash(audio.copy())
+    assert digest != audioHash(audio[::-1])
+    
+    key = ResultKey.make(digest, 0, 1000, params, 10)
+    assert key == ResultKey.make(digest, 0, 1000, dict(params, numThreads=4), 10)
+    assert key != ResultKey.make(digest, 0, 1000, dict(params, gain=20.), 10)
+    assert key != ResultKey.make(digest, 0, 999, params, 10)
+    assert key != ResultKey.make(digest, 0, 1000, params, 100)
+    fewer = dict(params, detChars=params['detChars'][:-1])
+    assert key != ResultKey.make(digest, 0, 1000, fewer, 10)
+    maxKey = ResultKey.make(digest, 0, 1000, params, 10, "max")
+    assert key != maxKey
+    assert key.digest != maxKey.digest
+
+def test_lru(params):
+    result = np.zeros((10, 100))
+    cache = ResultCache(maxBytes=3*result.nbytes)
+    keys = [ResultKey.make("audio", n, n+1000, params, 10) for n in range(4)]
+    
+    for key in keys[:3]:
+        cache.put(key, result.copy())
+    assert len(cache) == 3
+    assert cache.get(keys[0]) is not None # keys[1] is now least recently used
+    
+    cache.put(keys[3], result.copy())
+    assert len(cache) == 3
+    assert keys[1] not in cache
+    assert cache.get(keys[1]) is None
+    assert cache.nbytes == 3*result.nbytes
+    assert (cache.hits, cache.misses) == (1, 1)
+    
+    cache.put(keys[1], np.zeros((10, 1000))) # larger than budget
+    assert keys[1] not in cache
+    
+    cache.maxBytes = result.nbytes
+    assert len(cache) == 1
+    assert keys[3] in cache
+    
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+    
+def test_disk_cache(tmp_path, params):
+    result = np.arange(1000, dtype=np.float64).reshape((10, 100))
+    keys = [ResultKey.make("audio", n, n+1000, params, 10) for n in range(4)]
+    
+    cache = DiskResultCache(maxBytes=3*result.nbytes+1000, directory=tmp_path)
+    for key in keys[:3]:
+        cache.put(key, result)
+    assert len(cache) == 3
+    
+    # new instance should find the same files
+    cache = DiskResultCache(maxBytes=3*result.nbytes+1000, directory=tmp_path)
+    cached = cache.get(keys[0])
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, result)
+    assert cache.get(ResultKey.make("audio", 0, 1000, dict(params, gain=1.), 10)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    
+    # make keys[1] the least recently used
+    for n, key in enumerate(keys[:3]):
+        os.utime(cache._path(key), (n, n))
+    cache.get(keys[0])
+    cache.put(keys[3], result)
+    assert len(cache) == 3
+    assert keys[1] not in cache
+    assert keys[0] in cache
+    
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,29 @@
+from detectorbankgui.analyser.scheduler import JobScheduler
+
+def test_priority():
+    submitted = []
+    scheduler = JobScheduler(submitted.append, maxRunning=2)
+    for worker, keys in [("a", [0]), ("b", [1, 2]), ("c", [3]), ("d", [4]), ("e", [5])]:
+        scheduler.add(worker, keys)
+    scheduler.setPriorityKeys([2, 4])
+    scheduler.dispatch()
+    assert submitted == ["b", "d"]
+    assert scheduler.numRunning == 2 and scheduler.numPending == 3
+    
+    # changing the priority reorders the pending jobs
+    scheduler.setPriorityKeys([5])
+    scheduler.jobFinished("d")
+    assert submitted == ["b", "d", "e"]
+    scheduler.setPriorityKeys([])
+    scheduler.jobFinished("b")
+    assert submitted == ["b", "d", "e", "a"]
+    
+    # jobs can be added while others are running
+    scheduler.add("f", [6])
+    scheduler.setPriorityKeys([6])
+    scheduler.jobFinished("a")
+    assert submitted == ["b", "d", "e", "a", "f"]
+    
+    scheduler.flush()
+    assert submitted == ["b", "d", "e", "a", "f", "c"]
+    assert scheduler.numRunning == 3 and scheduler.numPending == 0
\ No newline at end of file
@@ -0,0 +1,52 @@
+from detectorbankgui.analyser.sweep import sweepVariants, numRuns
+from detectorbankgui.analyser.engine import Engine
+from detectorbank import DetectorBank
+import numpy as np
+import pytest
+
+def test_variants(params):
+    grid = {"damping":[0.0001, 0.0002], "gain":[25, 50, 10]}
+    variants = sweepVariants(dict(params, profile="test"), grid)
+    assert [variant.values for variant in variants] == [
+        {"damping":d, "gain":g} for d in grid["damping"] for g in grid["gain"]]
+    assert all("profile" not in variant.params for variant in variants)
+    assert variants[4].params["damping"] == 0.0002 and variants[4].params["gain"] == 50
+    assert variants[4].label == "Damping 0.0002, Gain 50"
+    
+    # only the first gain for each damping is analysed
+    assert numRuns(variants) == 2
+    assert [variant.source for variant in variants] == [None, 0, 0, None, 3, 3]
+    assert variants[2].scale == pytest.approx(10 / 25)
+    
+    # normalised amplitude isn't proportional to the gain
+    grid = {"gain":[25, 50], "ampNorm":[DetectorBank.amp_unnormalized, DetectorBank.amp_normalized]}
+    variants = sweepVariants(params, grid)
+    assert [variant.analysed for variant in variants] == [True, True, False, True]
+    
+    with pytest.raises(ValueError):
+        sweepVariants(params, {"detChars":[None]})
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_sweep(audio2, num_processes, params):
+    engine = Engine(numProcesses=num_processes)
+    audio, sr = audio2
+    grid = {"damping":[0.0001, 0.0003], "gain":[25, 40]}
+    segment = (24000, 72000)
+    subsample = 100
+    
+    finished = []
+    engine.finished.connect(lambda: finished.append(True))
+    results = engine.sweep(audio, sr, params, grid, segment, subsample)
+    assert finished == [True]
+    assert len(results) == 4
+    # variants that only differ by gain are scaled from one run
+    assert len(engine.analysers) == 2
+    
+    for variant, result in results:
+        expected, = Engine().analyse(audio, sr, variant.params, [segment], subsample)
+        assert np.allclose(result, expected, rtol=1e-6, atol=1e-9 * np.abs(expected).max())
+    
+    # analysed results are cached, and the others are scaled from them again
+    engine.sweep(audio, sr, params, grid, segment, subsample)
+    assert engine.analysers == []
+    engine.shutdown()
@@ -4,7 +4,8 @@
 Form to edit DetectorBank args
 """
 from qtpy.QtWidgets import (QWidget, QVBoxLayout, QPushButton, QLabel, QDialog, 
-                            QSizePolicy, QScrollArea, QMessageBox, QSpinBox, QCheckBox)
+                            QSizePolicy, QScrollArea, QMessageBox, QSpinBox, QCheckBox,
+                            QDoubleSpinBox)
 from qtpy.QtCore import Qt, Slot, Signal
 from customQObjects.widgets import ElideMixin, GroupBox, ComboBox
 from customQObjects.core import Settings
@@ -88,6 +89,12 @@ class DetBankArgsWidget(QScrollArea):
 class _DetBankArgsWidget(QWidget):
     """ Widget containing form for DetectorBank args, including loading and saving profiles """
     
+    # subsample modes, see analyser.extraction.REDUCTIONS
+    reductions = [Feature("Point", "point"), Feature("Max", "max"), 
+                  Feature("Mean", "mean"), Feature("RMS", "rms")]
+    
+    dtypes = [Feature("Double (64 bit)", "float64"), Feature("Single (32 bit)", "float32")]
+    
     def __init__(self, parent=None):
         super().__init__(parent)
          
@@ -113,9 +120,10 @@ class _DetBankArgsWidget(QWidget):
         self.dampingWidget.setDecimals(5)
         
         numCores = os.cpu_count()
-        self.threadsWidget.setMinimum(1)
+        self.threadsWidget.setMinimum(0)
         self.threadsWidget.setMaximum(numCores)
-        self.threadsWidget.setValue(numCores)
+        self.threadsWidget.setSpecialValueText("Auto")
+        self.threadsWidget.setValue(0)
         
         # make dict of widgets
         # Parameter objects automatically make labels and set tool tips
@@ -125,8 +133,8 @@ class _DetBankArgsWidget(QWidget):
             "numThreads":Parameter(
                 self.threadsWidget, "Threads", 
                 "Maximum number of threads to execute concurrently to determine the detector outputs. "
-                "Passing a value of less than 1 causes the number of threads to "
-                "be set according to the number of reported CPU cores",
+                "'Auto' uses the number of threads found by 'Calibrate' in the Analysis menu "
+                "or, if that hasn't been run, the number of reported CPU cores",
                 int), 
             "detChars":Parameter(
                 self.freqBwWidget, "Frequencies and bandwidths", "Detector characteristics"),
@@ -212,6 +220,102 @@ class _DetBankArgsWidget(QWidget):
         extraArgsGroup.addWidget(subsampleLabel, 0, 0)
         extraArgsGroup.addWidget(self.subsampleBox, 0, 1)
         
+        self.reductionBox = ComboBox(values=self.reductions)
+        self.reductionBox.currentTextChanged.connect(self._writeReduction)
+        self.reductionBox.setToolTip("How to reduce each set of subsampled values to one value. "
+                                     "'Max', 'Mean' and 'RMS' won't miss short transients, "
+                                     "even with large subsample factors")
+        
+        reductionLabel = QLabel("Subsample mode")
+        reductionLabel.setAlignment(Qt.AlignRight)
+        reductionLabel.setToolTip(self.reductionBox.toolTip())
+        extraArgsGroup.addWidget(reductionLabel, 1, 0)
+        extraArgsGroup.addWidget(self.reductionBox, 1, 1)
+        
+        self.dtypeBox = ComboBox(values=self.dtypes)
+        self.dtypeBox.currentTextChanged.connect(self._writeResultDtype)
+        self.dtypeBox.setToolTip("Precision of results. Single precision results use half "
+                                 "as much memory")
+        
+        dtypeLabel = QLabel("Result precision")
+        dtypeLabel.setAlignment(Qt.AlignRight)
+        dtypeLabel.setToolTip(self.dtypeBox.toolTip())
+        extraArgsGroup.addWidget(dtypeLabel, 2, 0)
+        extraArgsGroup.addWidget(self.dtypeBox, 2, 1)
+        
+        self.processesBox = QSpinBox()
+        self.processesBox.setMinimum(1)
+        self.processesBox.setMaximum(numCores)
+        self.processesBox.valueChanged.connect(self._writeNumProcesses)
+        self.processesBox.setToolTip("Number of worker processes in which to analyse regions. "
+                                     "If 1, regions are analysed one after another in this process")
+        
+        processesLabel = QLabel("Processes")
+        processesLabel.setAlignment(Qt.AlignRight)
+        processesLabel.setToolTip(self.processesBox.toolTip())
+        extraArgsGroup.addWidget(processesLabel, 3, 0)
+        extraArgsGroup.addWidget(self.processesBox, 3, 1)
+        
+        self.memoryBudgetBox = QSpinBox()
+        self.memoryBudgetBox.setSuffix(" MB")
+        self.memoryBudgetBox.setMinimum(1)
+        self.memoryBudgetBox.setMaximum(2**32//2-1)
+        self.memoryBudgetBox.setSingleStep(256)
+        self.memoryBudgetBox.valueChanged.connect(self._writeMemoryBudget)
+        self.memoryBudgetBox.setToolTip("Warn before starting an analysis that is expected "
+                                        "to use more than this much memory")
+        
+        memoryBudgetLabel = QLabel("Memory budget")
+        memoryBudgetLabel.setAlignment(Qt.AlignRight)
+        memoryBudgetLabel.setToolTip(self.memoryBudgetBox.toolTip())
+        extraArgsGroup.addWidget(memoryBudgetLabel, 4, 0)
+        extraArgsGroup.addWidget(self.memoryBudgetBox, 4, 1)
+        
+        self.timeShardsBox = QSpinBox()
+        self.timeShardsBox.setMinimum(1)
+        self.timeShardsBox.setMaximum(256)
+        self.timeShardsBox.valueChanged.connect(self._writeTimeShards)
+        self.timeShardsBox.setToolTip("Number of parts into which to split each region, so that "
+                                      "they can be analysed in parallel by the worker processes. "
+                                      "Results are then approximate and are not cached")
+        
+        timeShardsLabel = QLabel("Time shards")
+        timeShardsLabel.setAlignment(Qt.AlignRight)
+        timeShardsLabel.setToolTip(self.timeShardsBox.toolTip())
+        extraArgsGroup.addWidget(timeShardsLabel, 5, 0)
+        extraArgsGroup.addWidget(self.timeShardsBox, 5, 1)
+        
+        self.shardPreRollBox = QDoubleSpinBox()
+        self.shardPreRollBox.setSuffix(" s")
+        self.shardPreRollBox.setDecimals(2)
+        self.shardPreRollBox.setMaximum(60)
+        self.shardPreRollBox.setSingleStep(0.5)
+        self.shardPreRollBox.setSpecialValueText("Auto")
+        self.shardPreRollBox.valueChanged.connect(self._writeShardPreRoll)
+        self.shardPreRollBox.setToolTip("Audio before each time shard to analyse, so that the "
+                                        "detectors have settled when the shard starts. 'Auto' "
+                                        "uses enough for the detectors' relaxation time")
+        
+        shardPreRollLabel = QLabel("Shard pre-roll")
+        shardPreRollLabel.setAlignment(Qt.AlignRight)
+        shardPreRollLabel.setToolTip(self.shardPreRollBox.toolTip())
+        extraArgsGroup.addWidget(shardPreRollLabel, 6, 0)
+        extraArgsGroup.addWidget(self.shardPreRollBox, 6, 1)
+        
+        self.frequencyShardsBox = QSpinBox()
+        self.frequencyShardsBox.setMinimum(1)
+        self.frequencyShardsBox.setMaximum(256)
+        self.frequencyShardsBox.valueChanged.connect(self._writeFrequencyShards)
+        self.frequencyShardsBox.setToolTip("Number of groups into which to split the detectors. "
+                                           "Each group is analysed by its own DetectorBank, so "
+                                           "they can be analysed in parallel by the worker processes")
+        
+        frequencyShardsLabel = QLabel("Frequency shards")
+        frequencyShardsLabel.setAlignment(Qt.AlignRight)
+        frequencyShardsLabel.setToolTip(self.frequencyShardsBox.toolTip())
+        extraArgsGroup.addWidget(frequencyShardsLabel, 7, 0)
+        extraArgsGroup.addWidget(self.frequencyShardsBox, 7, 1)
+        
         layout = QVBoxLayout()
         layout.addWidget(detBankGroup)
         layout.addWidget(extraArgsGroup)
@@ -276,6 +380,7 @@ class _DetBankArgsWidget(QWidget):
             self.setParams(**params)
             self._ignoreValueChanged = False
             
+            self.currentProfile = profile
             self.currentProfileAltered = False
     
     def loadProfile(self, profile):
@@ -289,6 +394,25 @@ class _DetBankArgsWidget(QWidget):
         """ Reload current profile """
         self._doLoadProfile(self.currentProfile)
             
+    def getProfileName(self, params=None):
+        """ Return name of current profile, if `params` (or the current args, if
+            not given) are the same as the profile's, otherwise None.
+            
+            The DetectorBank can then be made from the saved profile.
+        """
+        if self.currentProfileAltered or self.currentProfile in (None, "None"):
+            return None
+        prof = ProfileManager().getProfile(self.currentProfile)
+        if prof is None:
+            return None
+        if params is None:
+            try:
+                params = self.getArgs()
+            except InvalidArgException:
+                return None
+        # sample rate is set from the audio file, without marking the profile as altered
+        return self.currentProfile if prof.matches(params) else None
+            
     def saveProfile(self, name, params=None):
         """ Save profile `param` with `name` 
         
@@ -376,7 +500,7 @@ class _DetBankArgsWidget(QWidget):
         
         params = {
             "sr":48000, 
-            "numThreads":os.cpu_count(), 
+            "numThreads":0, 
             "detChars":detChars,
             "damping":0.0001,
             "gain":25,
@@ -398,4 +522,101 @@ class _DetBankArgsWidget(QWidget):
     def getSubsampleFactor(self) -> int:
         """ Return current 'subsample factor' box value """
         return int(self.subsampleBox.value())
-    
\ No newline at end of file
+    
+    def _writeReduction(self):
+        """ Write subsample mode to config file """
+        settings = Settings()
+        settings.setValue("plot/reduction", self.getReduction())
+        
+    def setReduction(self, reduction: str):
+        """ Set 'subsample mode' box to `reduction`, which should be one of 
+            :data:`analyser.extraction.REDUCTIONS`
+        """
+        for feature in self.reductions:
+            if feature.value == reduction:
+                self.reductionBox.setCurrentText(feature.name)
+                
+    def getReduction(self) -> str:
+        """ Return current 'subsample mode' """
+        return self.reductionBox.value
+    
+    def _writeResultDtype(self):
+        """ Write result precision to config file """
+        settings = Settings()
+        settings.setValue("plot/dtype", self.getResultDtype())
+        
+    def setResultDtype(self, dtype: str):
+        """ Set 'result precision' box to numpy `dtype` name, 'float64' or 'float32' """
+        for feature in self.dtypes:
+            if feature.value == np.dtype(dtype).name:
+                self.dtypeBox.setCurrentText(feature.name)
+                
+    def getResultDtype(self) -> str:
+        """ Return name of numpy dtype of current 'result precision' """
+        return self.dtypeBox.value
+    
+    def _writeMemoryBudget(self):
+        """ Write memory budget to config file """
+        settings = Settings()
+        settings.setValue("analysis/memoryBudgetMB", self.memoryBudgetBox.value())
+        
+    def setMemoryBudget(self, budget: int):
+        """ Update 'memory budget' box value, in MB """
+        self.memoryBudgetBox.setValue(budget)
+        
+    def getMemoryBudget(self) -> int:
+        """ Return current 'memory budget' box value, in bytes """
+        return int(self.memoryBudgetBox.value()) * 2**20
+    
+    def _writeNumProcesses(self):
+        """ Write number of processes to config file """
+        settings = Settings()
+        settings.setValue("analysis/processes", self.processesBox.value())
+        
+    def setNumProcesses(self, processes: int):
+        """ Update 'processes' box value """
+        self.processesBox.setValue(processes)
+        
+    def getNumProcesses(self) -> int:
+        """ Return current 'processes' box value """
+        return int(self.processesBox.value())
+    
+    def _writeTimeShards(self):
+        """ Write number of time shards to config file """
+        settings = Settings()
+        settings.setValue("analysis/timeShards", self.timeShardsBox.value())
+        
+    def setTimeShards(self, shards: int):
+        """ Update 'time shards' box value """
+        self.timeShardsBox.setValue(shards)
+        
+    def getTimeShards(self) -> int:
+        """ Return current 'time shards' box value """
+        return int(self.timeShardsBox.value())
+    
+    def _writeShardPreRoll(self):
+        """ Write shard pre-roll to config file """
+        settings = Settings()
+        settings.setValue("analysis/shardPreRoll", self.shardPreRollBox.value())
+        
+    def setShardPreRoll(self, preRoll: float):
+        """ Update 'shard pre-roll' box value, in seconds. 0 is 'Auto' """
+        self.shardPreRollBox.setValue(preRoll)
+        
+    def getShardPreRoll(self):
+        """ Return current 'shard pre-roll' box value in seconds, or None if it is 'Auto' """
+        value = self.shardPreRollBox.value()
+        return value if value > 0 else None
+    
+    def _writeFrequencyShards(self):
+        """ Write number of frequency shards to config file """
+        settings = Settings()
+        settings.setValue("analysis/frequencyShards", self.frequencyShardsBox.value())
+        
+    def setFrequencyShards(self, shards: int):
+        """ Update 'frequency shards' box value """
+        self.frequencyShardsBox.setValue(shards)
+        
+    def getFrequencyShards(self) -> int:
+        """ Return current 'frequency shards' box value """
+        return int(self.frequencyShardsBox.value())
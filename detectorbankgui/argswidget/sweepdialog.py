@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dialog to choose a grid of parameter values to sweep and the region to analyse.
+"""
+from qtpy.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QDialogButtonBox, QLineEdit,
+                            QLabel, QCheckBox, QWidget)
+from qtpy.QtCore import Qt
+from customQObjects.widgets import GroupBox, ComboBox
+from ..analyser.sweep import SWEEP_PARAMS, FEATURE_NAMES, sweepVariants, numRuns
+from detectorbank import DetectorBank
+import numpy as np
+
+class SweepDialog(QDialog):
+    """ Dialog to choose values of the DetectorBank parameters to sweep
+        
+        Parameters
+        ----------
+        params : dict
+            Current DetectorBank parameters, as returned by ArgsWidget.getArgs
+        segments : list
+            Regions, as returned by AudioPlot.getSegments
+    """
+    
+    valueParams = ["damping", "gain"]
+    
+    def __init__(self, params, segments, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.params = params
+        self.segments = segments
+        
+        self.regionBox = ComboBox()
+        sr = params['sr']
+        for idx, segment in enumerate(segments):
+            s0, s1 = segment.samples
+            self.regionBox.addItem(f"Region {idx+1}: {s0/sr:.4g}-{s1/sr:.4g} seconds")
+        
+        grid = GroupBox("Parameter values", layout="grid")
+        
+        # comma separated values for numerical parameters
+        self.valueEdits = {}
+        for row, name in enumerate(self.valueParams):
+            edit = QLineEdit(f"{params[name]:g}")
+            edit.setToolTip("Comma separated values")
+            edit.textChanged.connect(self._validate)
+            label = QLabel(SWEEP_PARAMS[name])
+            label.setAlignment(Qt.AlignRight)
+            grid.addWidget(label, row, 0)
+            grid.addWidget(edit, row, 1)
+            self.valueEdits[name] = edit
+        
+        # check box for each value of features
+        self.featureBoxes = {}
+        for row, (name, features) in enumerate(FEATURE_NAMES.items()):
+            row += len(self.valueParams)
+            widget = QWidget()
+            boxLayout = QHBoxLayout()
+            boxLayout.setContentsMargins(0, 0, 0, 0)
+            boxes = {}
+            for value, featureName in features.items():
+                box = QCheckBox(featureName)
+                box.setChecked(value == params[name])
+                box.stateChanged.connect(self._validate)
+                boxLayout.addWidget(box)
+                boxes[value] = box
+            widget.setLayout(boxLayout)
+            label = QLabel(SWEEP_PARAMS[name])
+            label.setAlignment(Qt.AlignRight)
+            grid.addWidget(label, row, 0)
+            grid.addWidget(widget, row, 1)
+            self.featureBoxes[name] = boxes
+        
+        self.label = QLabel()
+        
+        # buttons
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok|QDialogButtonBox.Cancel)
+        self.okButton = self.buttonBox.button(QDialogButtonBox.Ok)
+        self.okButton.clicked.connect(self.accept)
+        cancelButton = self.buttonBox.button(QDialogButtonBox.Cancel)
+        cancelButton.clicked.connect(self.reject)
+        
+        layout = QVBoxLayout()
+        layout.addWidget(self.regionBox)
+        layout.addWidget(grid)
+        layout.addWidget(self.label)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+        
+        self.setWindowTitle("Parameter sweep")
+        self._validate()
+    
+    @property
+    def segment(self):
+        """ Return selected region """
+        return self.segments[self.regionBox.currentIndex()]
+    
+    @property
+    def grid(self) -> dict:
+        """ Return dict of parameter names and lists of values, for the parameters
+            whose values aren't just the current value.
+            
+            Raises ValueError if any values are invalid.
+        """
+        grid = {}
+        for name, edit in self.valueEdits.items():
+            try:
+                values = [float(value) for value in edit.text().split(",") if value.strip()]
+            except ValueError:
+                raise ValueError(f"Invalid {SWEEP_PARAMS[name].lower()} values") from None
+            if len(values) == 0:
+                raise ValueError(f"Please enter at least one {SWEEP_PARAMS[name].lower()} value")
+            grid[name] = list(dict.fromkeys(values))
+        if any(value <= 0 for value in grid['damping']):
+            raise ValueError("Damping must be greater than 0")
+        for name, boxes in self.featureBoxes.items():
+            values = [value for value, box in boxes.items() if box.isChecked()]
+            if len(values) == 0:
+                raise ValueError(f"Please select at least one {SWEEP_PARAMS[name].lower()}")
+            grid[name] = values
+        if (DetectorBank.central_difference in grid['method']
+                and np.count_nonzero(self.params['detChars'][:,1]) > 0):
+            raise ValueError("Central difference method can only be used with minimum "
+                             "bandwidth detectors (0Hz)")
+        return {name:values for name, values in grid.items() if values != [self.params[name]]}
+    
+    def _validate(self, *args):
+        """ Show number of variants, or why the values are invalid """
+        try:
+            grid = self.grid
+        except ValueError as exc:
+            self.label.setText(str(exc))
+            self.okButton.setEnabled(False)
+            return
+        variants = sweepVariants(self.params, grid)
+        msg = f"{len(variants)} variant{'s' if len(variants) != 1 else ''}"
+        if (runs := numRuns(variants)) != len(variants):
+            msg += f", of which {runs} will be analysed and the rest scaled by gain"
+        self.label.setText(msg)
+        self.okButton.setEnabled(len(grid) > 0)
@@ -6,7 +6,6 @@ from detectorbank import DetectorBank
 from qtpy.QtWidgets import QDialog
 from qtpy.QtCore import Qt
 import pytest 
-import os
 from pathlib import Path
 import shutil
 import numpy as np
@@ -70,7 +69,7 @@ class TestArgsWidget:
         
         test_values = {
             "sr":{"value":48000, "expected":"48000", "default":None},
-            "numThreads":{"value":4, "default":os.cpu_count()},
+            "numThreads":{"value":4, "default":0},
             "damping":{"value":0.0003, "default":0.0001},
             "gain":{"value":20, "default":25},
             "method":{"value":"Central difference", 
@@ -153,6 +152,21 @@ class TestArgsWidget:
         profile_manager = ProfileManager(self.config_file)
         assert profile_name in profile_manager.profiles
         
+    def test_profile_name(self, setup_load_profile, qtbot):
+        self.widget.loadProfileBox.setCurrentText("_test_profile2")
+        assert self.widget.getProfileName() == "_test_profile2"
+        
+        # sample rate doesn't mark the profile as altered, but is checked
+        self.widget.setParams(sr=44100)
+        assert self.widget.getProfileName() is None
+        self.widget.setParams(sr=48000)
+        assert self.widget.getProfileName() == "_test_profile2"
+        
+        param = self.widget.widgets["gain"]
+        with qtbot.waitSignal(param.widget.valueChanged):
+            param.widget.setValue(20)
+        assert self.widget.getProfileName() is None
+        
     def test_reload_profile(self, setup_load_profile, qtbot, monkeypatch):
         profile_name = "default"
         
@@ -187,7 +201,7 @@ class TestArgsWidget:
         det_char = np.column_stack((f,bw))
         expected_values = {
             "sr":48000.0,
-            "numThreads":os.cpu_count(),
+            "numThreads":0,
             "damping":0.0001,
             "gain":25,
             "detChars":det_char,
@@ -0,0 +1,3 @@
+from .batch import runBatch, analyseFile, parseSegment, addArguments, main
+
+__all__ = ["runBatch", "analyseFile", "parseSegment", "addArguments", "main"]
\ No newline at end of file
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analyse many audio files without the GUI.
+
+Each file is analysed by an :class:`..analyser.engine.Engine` in a worker process,
+so a file that fails, or crashes its process, doesn't stop the others. Files are
+only started while the estimated memory use of the files being analysed is within
+a budget (see `runBatch`).
+
+Results are written to an output directory, as one `.npz` file per audio file
+or one `.npy` file per segment, with a `manifest.json` describing the run.
+"""
+from ..analyser.engine import Engine
+from ..analyser.extraction import REDUCTIONS
+from ..analyser.memory import estimateMemory, physicalMemory, formatBytes
+from ..audioread import read_audio
+from ..profilemanager import ProfileManager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+import multiprocessing
+import numpy as np
+import datetime
+import tempfile
+import glob
+import json
+import time
+import wave
+import sys
+import os
+
+FORMATS = ("npz", "npy")
+
+@dataclass
+class BatchFile:
+    """ Audio file to analyse and the name of its results """
+    path: Path
+    name: str # output file name, without extension
+    numSamples: int
+    sr: int
+    memory: int = 0 # estimated peak memory use in bytes
+    retry: bool = False # True if the file's process crashed, so it is run on its own
+
+@dataclass
+class BatchResult:
+    """ Manifest entry for one audio file """
+    input: str
+    status: str = "ok" # 'ok' or 'failed'
+    error: str = None
+    outputs: list = field(default_factory=list)
+    sr: int = None
+    numSamples: int = None
+    segments: list = field(default_factory=list) # (n0, n1) sample ranges
+    seconds: float = 0 # time taken to analyse and write results
+
+def parseSegment(spec) -> tuple:
+    """ Return (start, end) times in seconds from string 'start:end'.
+        
+        Either time can be empty, meaning the start or end of the file, so
+        ':' or 'whole' is the whole file and end is returned as None.
+    """
+    if spec.strip().lower() == "whole":
+        return (0.0, None)
+    try:
+        start, end = spec.split(":")
+        start = float(start) if start.strip() else 0.0
+        end = float(end) if end.strip() else None
+    except ValueError:
+        raise ValueError(f"Segment should be 'start:end' in seconds or 'whole', not '{spec}'")
+    if start < 0 or (end is not None and end <= start):
+        raise ValueError(f"Segment '{spec}' is empty")
+    return (start, end)
+
+def segmentSamples(segments, sr, numSamples) -> list:
+    """ Return list of (n0, n1) sample ranges from list of (start, end) times,
+        clipped to `numSamples`
+    """
+    ranges = []
+    for start, end in segments:
+        n0 = min(int(round(start * sr)), numSamples)
+        n1 = numSamples if end is None else min(int(round(end * sr)), numSamples)
+        ranges.append((n0, n1))
+    return ranges
+
+def findFiles(patterns) -> list:
+    """ Return sorted list of files matching any of the glob `patterns` """
+    files = set()
+    for pattern in patterns:
+        files.update(Path(p) for p in glob.glob(os.path.expanduser(pattern), recursive=True))
+    return sorted(f for f in files if f.is_file())
+
+def outputNames(paths) -> list:
+    """ Return a unique output name for each of `paths`, based on the file name """
+    names = []
+    for path in paths:
+        name, n = path.stem, 1
+        while name in names:
+            n += 1
+            name = f"{path.stem}_{n}"
+        names.append(name)
+    return names
+
+def audioInfo(path, defaultSr):
+    """ Return number of samples and sample rate of audio file `path`.
+        
+        These are read from the header of PCM wav files. For other files, the
+        number of samples is estimated from the file size and `defaultSr` is
+        returned.
+    """
+    try:
+        with wave.open(str(path)) as fileobj:
+            return fileobj.getnframes(), fileobj.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return os.path.getsize(path) // 2, defaultSr
+
+def _writeAtomic(path, write):
+    """ Call `write` with a file object for a temp file, then rename it to `path`,
+        so that a partly written file is never left at `path`
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as fileobj:
+            write(fileobj)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def writeResults(outDir, name, results, ranges, sr, params, subsample, fmt="npz") -> list:
+    """ Write `results` for segments `ranges` and return list of output file names.
+        
+        If `fmt` is 'npz', all results are written to `name`.npz, as 'segment0',
+        'segment1' etc., with the sample ranges, sample rate, subsample factor and
+        detector frequencies and bandwidths. If 'npy', each result is written
+        to `name`_0.npy, `name`_1.npy etc. (or `name`.npy if there is only one).
+    """
+    if fmt == "npz":
+        arrays = {f"segment{k}":result for k, result in enumerate(results)}
+        arrays.update({"samples":np.array(ranges, dtype=np.int64).reshape((-1, 2)),
+                       "sr":np.array(sr), "subsample":np.array(subsample),
+                       "frequencies":params['detChars'][:,0], "bandwidths":params['detChars'][:,1]})
+        filename = f"{name}.npz"
+        _writeAtomic(outDir.joinpath(filename), lambda fileobj: np.savez(fileobj, **arrays))
+        return [filename]
+    elif fmt == "npy":
+        filenames = []
+        for k, result in enumerate(results):
+            filename = f"{name}.npy" if len(results) == 1 else f"{name}_{k}.npy"
+            _writeAtomic(outDir.joinpath(filename), lambda fileobj: np.save(fileobj, result))
+            filenames.append(filename)
+        return filenames
+    raise ValueError(f"Unknown output format '{fmt}'")
+
+def analyseFile(path, outDir, name, params, segments, subsample=1000, reduction="point",
+                dtype="float64", fmt="npz") -> BatchResult:
+    """ Analyse `segments` of audio file `path` and write the results to `outDir`.
+        
+        This is run in a worker process. Any exception is caught and returned
+        in the :class:`BatchResult`, so it is reported with the file.
+        
+        Parameters
+        ----------
+        path : Path
+            Audio file
+        outDir : Path
+            Directory for results
+        name : str
+            Name of results file(s), without extension
+        params : dict
+            DetectorBank parameters, as returned by `Profile.params`. The sample
+            rate of the file is used, rather than 'sr'.
+        segments : list
+            List of (start, end) times, as returned by :func:`parseSegment`
+        
+        Other args are as :func:`runBatch`.
+    """
+    start = time.monotonic()
+    entry = BatchResult(str(path))
+    try:
+        audio, sr = read_audio(path)
+        entry.sr, entry.numSamples = int(sr), len(audio)
+        entry.segments = segmentSamples(segments, sr, len(audio))
+        # each file is only analysed once, so don't keep DetectorBanks to continue segments
+        engine = Engine(maxContinuations=0)
+        results = engine.analyse(audio, sr, params, entry.segments, subsample, reduction, dtype)
+        entry.outputs = writeResults(Path(outDir), name, results, entry.segments, sr, params,
+                                     subsample, fmt)
+    except Exception as err:
+        entry.status = "failed"
+        entry.error = f"{type(err).__name__}: {err}"
+    entry.seconds = time.monotonic() - start
+    return entry
+
+def estimateFileMemory(numSamples, sr, params, segments, subsample, dtype) -> int:
+    """ Return estimated peak memory use, in bytes, of :func:`analyseFile` """
+    ranges = segmentSamples(segments, sr, numSamples)
+    blockSize = max(1, Engine.workerClass.blockDuration * sr // 1000)
+    estimate = estimateMemory(numSamples, ranges, len(params['detChars']), subsample, blockSize,
+                              dtype=dtype)
+    # nothing is plotted, but the file is read and converted to float32
+    return estimate.total - estimate.plots + 8 * numSamples
+
+def runBatch(paths, params, outDir, segments=None, subsample=1000, reduction="point",
+             dtype="float64", fmt="npz", numProcesses=1, memoryBudget=None, manifest=None,
+             callback=None) -> list:
+    """ Analyse all audio files in `paths` in a pool of worker processes
+        
+        Parameters
+        ----------
+        paths : list
+            Audio files
+        params : dict
+            DetectorBank parameters, as returned by `Profile.params`
+        outDir : Path
+            Directory in which to write results and 'manifest.json'
+        segments : list, optional
+            List of (start, end) times in seconds, as returned by :func:`parseSegment`.
+            If not given, the whole of each file is analysed.
+        subsample : int
+            Subsample factor
+        reduction : str
+            Subsample mode, see :data:`..analyser.extraction.REDUCTIONS`
+        dtype : str
+            Result dtype
+        fmt : {'npz', 'npy'}
+            Output format, see :func:`writeResults`
+        numProcesses : int
+            Maximum number of files to analyse at once
+        memoryBudget : int, optional
+            Files are only started if the total estimated memory use of all
+            running files is within this many bytes. A file that needs more
+            than this is analysed on its own. Defaults to half the physical memory.
+        manifest : dict, optional
+            Information about the run to write to the manifest, with the list of
+            :class:`BatchResult` as 'files'
+        callback : callable, optional
+            Called with each :class:`BatchResult`, the number of files done and
+            the total number of files
+        
+        Returns
+        -------
+        results : list
+            :class:`BatchResult` for each file, in the order of `paths`
+    """
+    outDir = Path(outDir)
+    outDir.mkdir(parents=True, exist_ok=True)
+    if segments is None:
+        segments = [(0.0, None)]
+    if memoryBudget is None:
+        memory = physicalMemory()
+        memoryBudget = memory // 2 if memory is not None else 4 * 2**30
+    manifest = dict(manifest) if manifest is not None else {}
+    
+    pending = []
+    for path, name in zip(paths, outputNames(paths)):
+        numSamples, sr = audioInfo(path, int(params['sr']))
+        memory = estimateFileMemory(numSamples, sr, params, segments, subsample, dtype)
+        pending.append(BatchFile(Path(path), name, numSamples, sr, memory))
+    order = {batchFile.path:idx for idx, batchFile in enumerate(pending)}
+    results = [None] * len(pending)
+    
+    def finish(batchFile, entry):
+        results[order[batchFile.path]] = entry
+        done = [result for result in results if result is not None]
+        _writeManifest(outDir, dict(manifest, files=[vars(result) for result in done]))
+        if callback is not None:
+            callback(entry, len(done), len(results))
+    
+    # don't fork, as the caller may have threads
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=max(1, numProcesses), mp_context=context)
+    running = {}
+    try:
+        while pending or running:
+            # start files while within memory budget; files that crashed a process
+            # are run on their own, so they can't take others down with them
+            for batchFile in list(pending):
+                if any(f.retry for f in running.values()) or len(running) >= max(1, numProcesses):
+                    break
+                inUse = sum(f.memory for f in running.values())
+                if running and (batchFile.retry or inUse + batchFile.memory > memoryBudget):
+                    break
+                future = executor.submit(analyseFile, batchFile.path, outDir, batchFile.name,
+                                         dict(params), segments, subsample, reduction, dtype, fmt)
+                running[future] = batchFile
+                pending.remove(batchFile)
+            
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                batchFile = running.pop(future)
+                try:
+                    entry = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if batchFile.retry:
+                        finish(batchFile, BatchResult(str(batchFile.path), status="failed",
+                                                      error="Worker process crashed"))
+                    else:
+                        batchFile.retry = True
+                        pending.insert(0, batchFile)
+                    continue
+                finish(batchFile, entry)
+            if broken:
+                # all running files were lost with the pool, so retry them too
+                for batchFile in running.values():
+                    batchFile.retry = True
+                    pending.insert(0, batchFile)
+                running.clear()
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=max(1, numProcesses), mp_context=context)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return results
+
+def _writeManifest(outDir, manifest):
+    """ Write `manifest` dict to 'manifest.json' in `outDir` """
+    data = json.dumps(manifest, indent=2, default=_jsonDefault).encode()
+    _writeAtomic(outDir.joinpath("manifest.json"), lambda fileobj: fileobj.write(data))
+
+def _jsonDefault(obj):
+    """ Convert numpy values and paths for json """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Path):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def addArguments(parser):
+    """ Add batch command-line arguments to argparse `parser` """
+    parser.add_argument('files', nargs='+',
+                        help='Audio files or glob patterns (quote them to use ** for subdirectories)')
+    parser.add_argument('-p', '--profile', required=True, help='Profile name')
+    parser.add_argument('-o', '--output', required=True, help='Directory for results and manifest')
+    parser.add_argument('-s', '--segment', action='append', type=parseSegment, dest='segments',
+                        help=("Segment to analyse, as 'start:end' in seconds, where either can "
+                              "be omitted, or 'whole'. Can be given more than once. "
+                              "Defaults to the whole file."))
+    parser.add_argument('--subsample', type=int, default=1000, help='Subsample factor')
+    parser.add_argument('--reduction', choices=REDUCTIONS, default="point", help='Subsample mode')
+    parser.add_argument('--dtype', choices=["float64", "float32"], default="float64",
+                        help='Result precision')
+    parser.add_argument('--format', choices=FORMATS, default="npz", dest='fmt',
+                        help="Write one .npz per file or one .npy per segment")
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='Number of files to analyse at once')
+    parser.add_argument('--threads', type=int,
+                        help=('DetectorBank threads for each file. Defaults to the number of '
+                              'cores divided by the number of processes'))
+    parser.add_argument('--memory-budget', type=int, dest='memoryBudget',
+                        help='Memory budget in MB. Defaults to half the physical memory')
+    parser.add_argument('--config', type=Path, help='Profile file. Defaults to the one the app uses')
+
+def main(args) -> int:
+    """ Run batch analysis with argparse `args` and return exit code """
+    profile = ProfileManager(args.config).getProfile(args.profile)
+    if profile is None:
+        print(f"No profile named '{args.profile}'", file=sys.stderr)
+        return 2
+    paths = findFiles(args.files)
+    if len(paths) == 0:
+        print("No audio files found", file=sys.stderr)
+        return 2
+    
+    params = profile.params()
+    processes = max(1, args.processes)
+    threads = args.threads if args.threads is not None else max(1, (os.cpu_count() or 1) // processes)
+    params['numThreads'] = threads
+    if args.config is None and profile.matches(params):
+        # DetectorBank can be made from the saved profile (which it reads from
+        # the default file), rather than normalising again
+        params['profile'] = args.profile
+    memoryBudget = args.memoryBudget * 2**20 if args.memoryBudget is not None else None
+    segments = args.segments if args.segments else [(0.0, None)]
+    
+    manifest = {"profile":args.profile,
+                "started":datetime.datetime.now().isoformat(timespec="seconds"),
+                "params":{name:value for name, value in params.items() if name != 'detChars'},
+                "frequencies":params['detChars'][:,0], "bandwidths":params['detChars'][:,1],
+                "segments":segments, "subsample":args.subsample, "reduction":args.reduction,
+                "dtype":args.dtype, "format":args.fmt}
+    
+    def report(entry, done, total):
+        msg = f"[{done}/{total}] {entry.input}: {entry.status} ({entry.seconds:.1f} s)"
+        if entry.error is not None:
+            msg += f" {entry.error}"
+        print(msg, flush=True)
+    
+    print(f"Analysing {len(paths)} files with {processes} processes and {threads} threads each",
+          flush=True)
+    if memoryBudget is not None:
+        print(f"Memory budget: {formatBytes(memoryBudget)}", flush=True)
+    results = runBatch(paths, params, args.output, segments, args.subsample, args.reduction,
+                       args.dtype, args.fmt, processes, memoryBudget, manifest, callback=report)
+    failed = sum(result.status != "ok" for result in results)
+    print(f"Finished: {len(results) - failed} succeeded, {failed} failed. "
+          f"Manifest: {Path(args.output).joinpath('manifest.json')}")
+    return 1 if failed > 0 else 0
@@ -0,0 +1,99 @@
+from detectorbankgui.batch.batch import (runBatch, parseSegment, segmentSamples, outputNames,
+                                         addArguments, main)
+from detectorbankgui.analyser.engine import Engine
+from detectorbankgui.profilemanager import ProfileManager
+from pathlib import Path
+import numpy as np
+import argparse
+import shutil
+import json
+import pytest
+
+def test_parse_segment():
+    assert parseSegment("1.5:3") == (1.5, 3.0)
+    assert parseSegment(":2") == (0.0, 2.0)
+    assert parseSegment("1:") == (1.0, None)
+    assert parseSegment("whole") == (0.0, None)
+    for spec in ["1", "2:1", "a:b"]:
+        with pytest.raises(ValueError):
+            parseSegment(spec)
+    
+    assert segmentSamples([(0.5, 1), (1, None), (3, 4)], 1000, 2000) == [(500, 1000), (1000, 2000), (2000, 2000)]
+
+def test_output_names():
+    paths = [Path("a", "x.wav"), Path("b", "x.wav"), Path("y.wav"), Path("c", "x.wav")]
+    assert outputNames(paths) == ["x", "x_2", "y", "x_3"]
+
+@pytest.mark.parametrize("fmt", ["npz", "npy"])
+def test_batch(tmp_path, configfile, audiofile2, audio2, fmt):
+    params = ProfileManager(configfile).getProfile("_test_profile2").params()
+    params['numThreads'] = 1
+    inDir = tmp_path.joinpath("audio")
+    inDir.mkdir()
+    shutil.copy(audiofile2, inDir)
+    bad = inDir.joinpath("bad.wav")
+    bad.write_bytes(b"not audio")
+    outDir = tmp_path.joinpath("results")
+    
+    segments = [(0, 0.5), (1, None)]
+    subsample = 100
+    results = runBatch([inDir.joinpath(audiofile2.name), bad], params, outDir, segments, subsample,
+                       fmt=fmt, numProcesses=2, manifest={"profile":"_test_profile2"})
+    
+    # failure is reported for the file, without stopping the other
+    good, failed = results
+    assert good.status == "ok"
+    assert failed.status == "failed" and failed.error is not None
+    
+    audio, sr = audio2
+    ranges = [(0, sr // 2), (sr, len(audio))]
+    assert good.segments == ranges
+    expected = Engine().analyse(audio, sr, params, ranges, subsample)
+    if fmt == "npz":
+        assert good.outputs == ["dre48.npz"]
+        data = np.load(outDir.joinpath("dre48.npz"))
+        arrays = [data["segment0"], data["segment1"]]
+        assert np.array_equal(data["samples"], ranges)
+        assert np.array_equal(data["frequencies"], params['detChars'][:,0])
+    else:
+        assert good.outputs == ["dre48_0.npy", "dre48_1.npy"]
+        arrays = [np.load(outDir.joinpath(name)) for name in good.outputs]
+    for array, result in zip(arrays, expected):
+        assert np.array_equal(array, result)
+    
+    with open(outDir.joinpath("manifest.json")) as fileobj:
+        manifest = json.load(fileobj)
+    assert manifest["profile"] == "_test_profile2"
+    assert [entry["status"] for entry in manifest["files"]] == ["ok", "failed"]
+
+def test_main(tmp_path, configfile, audiofile):
+    parser = argparse.ArgumentParser()
+    addArguments(parser)
+    outDir = tmp_path.joinpath("results")
+    args = parser.parse_args([str(audiofile.parent.joinpath("*.wav")), "-p", "_test_profile2",
+                              "-o", str(outDir), "--config", str(configfile), "-s", ":0.5",
+                              "--threads", "1", "-j", "2"])
+    assert main(args) == 0
+    with open(outDir.joinpath("manifest.json")) as fileobj:
+        manifest = json.load(fileobj)
+    assert sorted(Path(entry["input"]).name for entry in manifest["files"]) == ["a4.wav", "dre48.wav"]
+    assert manifest["segments"] == [[0, 0.5]]
+    for name in ["a4.npz", "dre48.npz"]:
+        assert outDir.joinpath(name).exists()
+    
+    args = parser.parse_args(["nothing*.wav", "-p", "_test_profile2", "-o", str(outDir),
+                              "--config", str(configfile)])
+    assert main(args) == 2
+
+def test_main_profile(tmp_path, default_config, audiofile):
+    parser = argparse.ArgumentParser()
+    addArguments(parser)
+    outDir = tmp_path.joinpath("results")
+    args = parser.parse_args([str(audiofile), "-p", "_test_profile2", "-o", str(outDir), 
+                              "-s", ":0.5", "--threads", "3"])
+    assert main(args) == 0
+    with open(outDir.joinpath("manifest.json")) as fileobj:
+        manifest = json.load(fileobj)
+    # the profile is used, even though the number of threads is different
+    assert manifest["params"]["profile"] == "_test_profile2"
+    assert manifest["params"]["numThreads"] == 3
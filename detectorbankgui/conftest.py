@@ -1,7 +1,10 @@
 import pytest
 from pathlib import Path
+import shutil
 from qtpy.QtCore import QCoreApplication
 from detectorbankgui.audioread import read_audio
+from detectorbank import DetectorBank
+import numpy as np
 
 def _get_data_path():
     p = Path(__file__).parent.joinpath("test", "data")
@@ -42,11 +45,37 @@ def configfile():
     p = _get_data_path()
     return p.joinpath("hopfskipjump.xml")
 
+@pytest.fixture
+def default_config(tmp_path, monkeypatch, configfile):
+    """ Make the test profiles the default config file (which is where 
+        DetectorBank loads profiles from), in a temporary home directory
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    config = tmp_path.joinpath(".config", "hopfskipjump.xml")
+    config.parent.mkdir()
+    shutil.copy(configfile, config)
+    return config
+
 @pytest.fixture
 def atol():
     """ Absolute tolerance for np.isclose """
     return 0.01
 
+@pytest.fixture
+def params():
+    """ DetectorBank parameters for 25 detectors, a semitone apart around 440Hz """
+    f = np.array([440*2**(k/12) for k in range(-12,13)])
+    bw = np.zeros(len(f))
+    return {
+        "numThreads":1,
+        "damping":0.0001,
+        "gain":25,
+        "detChars":np.column_stack((f,bw)),
+        "method":DetectorBank.runge_kutta,
+        "freqNorm":DetectorBank.freq_unnormalized,
+        "ampNorm":DetectorBank.amp_unnormalized
+        }
+
 @pytest.fixture
 def patch_settings():
     """ Don't use actual settings file """
@@ -3,7 +3,8 @@
 """
 Main window
 """
-from qtpy.QtWidgets import QMainWindow, QDockWidget, QAction, QMessageBox, QProgressBar
+from qtpy.QtWidgets import (QMainWindow, QDockWidget, QAction, QMessageBox, QProgressBar, 
+                            QProgressDialog, QDialog)
 from qtpy.QtCore import Qt, QUrl
 from qtpy.QtGui import QKeySequence, QDesktopServices, QIcon
 import qtpy
@@ -12,11 +13,17 @@ from customQObjects.gui import getIconFromTheme
 from .aboutdialog import AboutDialog
 from .audioplot import AudioPlotWidget
 from .analyser import Analyser
+from .analyser.memory import physicalMemory, formatBytes
+from .analyser.calibration import readCalibrations, writeCalibration
+from .analyser.sweep import sweepVariants, numRuns
 from .argswidget import ArgsWidget
+from .argswidget.sweepdialog import SweepDialog
 from .resultsplotwidget import ResultsPlotWidget
 from .invalidargexception import InvalidArgException
 from collections import deque
+import numpy as np
 import sys
+import os
 from pathlib import Path
 
 class DetectorBankGui(QMainWindow):
@@ -38,7 +45,21 @@ class DetectorBankGui(QMainWindow):
         # might need to come up with a better solution than this...
         self.resultsplot = ResultsPlotWidget(self)
         
-        self.analyser = Analyser(self.resultsplot)
+        settings = Settings()
+        cacheSize = settings.value("cache/memoryMB", cast=int, defaultValue=512)
+        self.analyser = Analyser(self.resultsplot, cacheSize=cacheSize*2**20)
+        diskCache = bool(settings.value("cache/disk", cast=int, defaultValue=0))
+        self.diskCacheAction.setChecked(diskCache)
+        merge = bool(settings.value("analysis/mergeOverlapping", cast=int, defaultValue=0))
+        self.mergeOverlappingAction.setChecked(merge)
+        mapResults = bool(settings.value("analysis/mapResults", cast=int, defaultValue=0))
+        self.mapResultsAction.setChecked(mapResults)
+        self.analyser.calibrations = readCalibrations(settings)
+        # optionally analyse at a finer subsample factor, so that it can be changed without 
+        # re-analysing; this is off by default, as the finer results use more memory
+        baseSubsample = settings.value("analysis/baseSubsample", cast=int, defaultValue=0)
+        self.analyser.baseSubsample = baseSubsample if baseSubsample > 0 else None
+        self._calibrationWorker = None
         
         self.statusBar()
         self._statusTimeout = 1500
@@ -50,8 +71,13 @@ class DetectorBankGui(QMainWindow):
         self.audioplot.statusMessage.connect(self._setTemporaryStatus)
         self.audioplot.audioFileOpened.connect(self.setSampleRate)
         
+        self._analysisErrors = []
         self.analyser.progress.connect(self._incrementProgress)
         self.analyser.finished.connect(self._maxProgress)
+        self.analyser.finished.connect(self._analysisFinished)
+        self.analyser.error.connect(self._analysisErrors.append)
+        self._running = False
+        self._analysisCancelled = False
         
         widgets = {"audioinput":('Audio Input', self.audioplot, 'left'),
                    "args":('Parameters',self.argswidget, 'left'),
@@ -101,6 +127,26 @@ class DetectorBankGui(QMainWindow):
         # get saved subsample factor
         subsample = settings.value("plot/subsample", cast=int, defaultValue=1000)
         self.argswidget.setSubsampleFactor(subsample)
+        reduction = settings.value("plot/reduction", cast=str, defaultValue="point")
+        self.argswidget.setReduction(reduction)
+        dtype = settings.value("plot/dtype", cast=str, defaultValue="float64")
+        self.argswidget.setResultDtype(dtype)
+        
+        # by default, warn if analysis would use more than half of the RAM
+        memory = physicalMemory()
+        defaultBudget = memory // 2**21 if memory is not None else 4096
+        budget = settings.value("analysis/memoryBudgetMB", cast=int, defaultValue=defaultBudget)
+        self.argswidget.setMemoryBudget(budget)
+        
+        processes = settings.value("analysis/processes", cast=int, defaultValue=1)
+        self.argswidget.setNumProcesses(processes)
+        
+        shards = settings.value("analysis/timeShards", cast=int, defaultValue=1)
+        self.argswidget.setTimeShards(shards)
+        preRoll = settings.value("analysis/shardPreRoll", cast=float, defaultValue=0)
+        self.argswidget.setShardPreRoll(preRoll)
+        shards = settings.value("analysis/frequencyShards", cast=int, defaultValue=1)
+        self.argswidget.setFrequencyShards(shards)
         
         return super().show()
         
@@ -113,6 +159,9 @@ class DetectorBankGui(QMainWindow):
         profile = self.argswidget.currentProfile #if not self.argswidget.currentProfileAltered else "None"
         settings.setValue("params/currentProfile", profile)
         
+        # don't leave analysis threads or processes running after window has gone
+        self.analyser.shutdown()
+        
         return super().closeEvent(event)
 
     @property
@@ -132,7 +181,13 @@ class DetectorBankGui(QMainWindow):
     @running.setter
     def running(self, value):
         self._running = value
-        self.runToolBar.setEnabled(not value)
+        # more regions can be analysed while the analysis is running, so
+        # analyseAction is always enabled
+        self.calibrateAction.setEnabled(not value)
+        self.pauseAnalysisAction.setEnabled(value)
+        self.cancelAnalysisAction.setEnabled(value)
+        if not value:
+            self.pauseAnalysisAction.setChecked(False)
         
     def setSampleRate(self, sr):
         self.sr = sr
@@ -146,23 +201,247 @@ class DetectorBankGui(QMainWindow):
         except InvalidArgException as exc:
             QMessageBox.warning(self, errorMsgTitle, str(exc))
             return
+        if (profile := self.argswidget.getProfileName(params)) is not None:
+            # make DetectorBank from the saved profile, rather than normalising again
+            params['profile'] = profile
         if self.audioplot.audio is None:
             QMessageBox.warning(self, errorMsgTitle, "Please select an audio input file")
             return
         
-        self._setTemporaryStatus(f"Starting analysis of {self.audioplot.audioFilePath}")
+        if not self.analyser.started:
+            # don't replace the process pool while it is in use
+            self.analyser.numProcesses = self.argswidget.getNumProcesses()
+        self.analyser.timeShards = self.argswidget.getTimeShards()
+        self.analyser.shardPreRoll = self.argswidget.getShardPreRoll()
+        self.analyser.frequencyShards = self.argswidget.getFrequencyShards()
+        segments = self.audioplot.getSegments()
+        if not self._checkMemory(params, segments):
+            return
+        
+        adding = self.analyser.started
+        if adding:
+            self._setTemporaryStatus("Adding regions to the analysis")
+        else:
+            self._setTemporaryStatus(f"Starting analysis of {self.audioplot.audioFilePath}")
         
         numSamples = self.analyser.setParams(
             self.audioplot.audio, 
             self.sr, 
             params, 
-            self.audioplot.getSegments(), 
-            self.argswidget.getSubsampleFactor())
+            segments, 
+            self.argswidget.getSubsampleFactor(),
+            reduction=self.argswidget.getReduction(),
+            dtype=self.argswidget.getResultDtype())
         
-        self._progressBar.setMaximum(numSamples)
-        self._progressQueue.clear()
+        self._startAnalysis(numSamples, adding)
         
+    def _startAnalysis(self, numSamples, adding):
+        """ Set up the progress bar for `numSamples` more samples and start the analysis """
+        if adding:
+            self._progressBar.setMaximum(self._progressBar.maximum() + numSamples)
+        else:
+            self._progressBar.setMaximum(numSamples)
+            self._progressBar.setValue(0)
+            self._progressBar.setFormat("%p%")
+            self._progressQueue.clear()
+        
+        self.running = True
+        self._analysisCancelled = False
+        if not adding:
+            self._analysisErrors.clear()
         self.analyser.start()
+        
+    def _doSweep(self):
+        """ Analyse a region with each combination of a grid of parameter values """
+        errorMsgTitle = "Cannot run parameter sweep"
+        try:
+            params = self.argswidget.getArgs()
+        except InvalidArgException as exc:
+            QMessageBox.warning(self, errorMsgTitle, str(exc))
+            return
+        if self.audioplot.audio is None:
+            QMessageBox.warning(self, errorMsgTitle, "Please select an audio input file")
+            return
+        
+        dialog = SweepDialog(params, self.audioplot.getSegments(), parent=self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        variants = sweepVariants(params, dialog.grid)
+        segment = dialog.segment
+        
+        runs = numRuns(variants)
+        if not self.analyser.started:
+            # analyse the runs in parallel, even if fewer processes are set
+            self.analyser.numProcesses = max(self.argswidget.getNumProcesses(), 
+                                             min(runs, os.cpu_count() or 1))
+        self.analyser.timeShards = self.argswidget.getTimeShards()
+        self.analyser.shardPreRoll = self.argswidget.getShardPreRoll()
+        self.analyser.frequencyShards = self.argswidget.getFrequencyShards()
+        if not self._checkMemory(params, [segment], runs=len(variants)):
+            return
+        
+        adding = self.analyser.started
+        self._setTemporaryStatus(f"Starting parameter sweep of {len(variants)} variants")
+        
+        numSamples = self.analyser.setSweep(
+            self.audioplot.audio, 
+            self.sr, 
+            variants, 
+            segment, 
+            self.argswidget.getSubsampleFactor(),
+            reduction=self.argswidget.getReduction(),
+            dtype=self.argswidget.getResultDtype())
+        
+        self._startAnalysis(numSamples, adding)
+        
+    def _checkMemory(self, params, segments, runs=1) -> bool:
+        """ Check that the estimated memory use of the analysis is within budget.
+        
+            If it isn't, ask the user whether to use a larger subsample factor 
+            and/or lower precision results, analyse anyway or cancel.
+            
+            `runs` is the number of sets of parameters with which the `segments`
+            are analysed, e.g. in a parameter sweep.
+            
+            The rest of the budget can be used for finer results (see 
+            :attr:`.analyser.engine.Engine.baseResultBudget`).
+            
+            Returns True if the analysis should go ahead.
+        """
+        audio, sr = self.audioplot.audio, self.sr
+        subsample = self.argswidget.getSubsampleFactor()
+        dtype = self.argswidget.getResultDtype()
+        budget = self.argswidget.getMemoryBudget()
+        
+        estimate = self.analyser.estimateMemory(audio, sr, params, segments, subsample, dtype, 
+                                                runs)
+        self.analyser.baseResultBudget = max(0, budget - estimate.total)
+        if estimate.total <= budget:
+            return True
+        
+        msg = (f"This analysis is estimated to need {estimate}, "
+               f"which is more than the memory budget of {formatBytes(budget)}.")
+        suggestion = self.analyser.suggestSettings(budget, audio, sr, params, segments, 
+                                                   subsample, dtype, runs)
+        
+        msgBox = QMessageBox(QMessageBox.Warning, "Analysis may use too much memory", msg, 
+                             parent=self)
+        if suggestion is not None:
+            newSubsample, newDtype, newEstimate = suggestion
+            precision = "single" if newDtype == np.float32 else "double"
+            msgBox.setInformativeText(f"With a subsample factor of {newSubsample} and {precision} "
+                                      f"precision results, it would need {formatBytes(newEstimate.total)}.")
+            applyButton = msgBox.addButton("Use these settings", QMessageBox.AcceptRole)
+        else:
+            msgBox.setInformativeText("Try analysing fewer or shorter regions, or fewer frequencies.")
+            applyButton = None
+        anywayButton = msgBox.addButton("Analyse anyway", QMessageBox.DestructiveRole)
+        msgBox.addButton(QMessageBox.Cancel)
+        msgBox.exec_()
+        
+        clicked = msgBox.clickedButton()
+        if applyButton is not None and clicked == applyButton:
+            self.argswidget.setSubsampleFactor(newSubsample)
+            self.argswidget.setResultDtype(newDtype.name)
+            return True
+        return clicked == anywayButton
+        
+    def _analysisFinished(self):
+        self.running = False
+        if self._analysisErrors:
+            errors, self._analysisErrors = self._analysisErrors, []
+            self._setTemporaryStatus("Analysis failed")
+            msg = ("Some regions could not be analysed, so their results are incomplete."
+                   f"\n\n{errors[0]}")
+            QMessageBox.warning(self, "Analysis failed", msg)
+            return
+        msg = "Analysis cancelled" if self._analysisCancelled else "Analysis finished"
+        self._setTemporaryStatus(f"{msg}. Result cache {self.analyser.cacheStats}")
+        
+    def _pauseAnalysis(self, pause):
+        """ Pause or resume analysis, depending on bool `pause` """
+        if pause:
+            self.analyser.pause()
+            self._setStatus("Analysis paused")
+        else:
+            self.analyser.resume()
+            self._setTemporaryStatus("Analysis resumed")
+            
+    def _cancelAnalysis(self):
+        """ Stop analysis; partial results will still be plotted """
+        self._analysisCancelled = True
+        self.analyser.cancel()
+        self._progressBar.setValue(0)
+            
+    def _setDiskCacheEnabled(self, enable):
+        """ Turn on-disk result cache on or off and save the choice """
+        settings = Settings()
+        settings.setValue("cache/disk", int(enable))
+        size = settings.value("cache/diskMB", cast=int, defaultValue=2048)
+        self.analyser.setDiskCacheEnabled(enable, maxBytes=size*2**20)
+        
+    def _setMergeOverlapping(self, merge):
+        """ Set whether overlapping regions are analysed together and save the choice """
+        Settings().setValue("analysis/mergeOverlapping", int(merge))
+        self.analyser.mergeOverlapping = merge
+        
+    def _setMapResults(self, enable):
+        """ Set whether large results are memory-mapped to scratch files and save the choice """
+        settings = Settings()
+        settings.setValue("analysis/mapResults", int(enable))
+        threshold = settings.value("analysis/mapThresholdMB", cast=int, defaultValue=256)
+        self.analyser.setScratchEnabled(enable, threshold=threshold*2**20)
+        
+    def _calibrate(self):
+        """ Time analysis with the current detectors, to find the fastest number
+            of threads and block duration
+        """
+        try:
+            params = self.argswidget.getArgs()
+        except InvalidArgException as exc:
+            QMessageBox.warning(self, "Cannot calibrate", str(exc))
+            return
+        sr = int(params['sr'])
+        
+        self._calibrationDialog = QProgressDialog(
+            f"Timing analysis with {len(params['detChars'])} detectors...", "Cancel", 0, 1, self)
+        self._calibrationDialog.setWindowTitle("Calibrating")
+        self._calibrationDialog.setWindowModality(Qt.WindowModal)
+        self._calibrationDialog.setMinimumDuration(0)
+        self._calibrationDialog.setValue(0)
+        
+        self.analyseAction.setEnabled(False)
+        self.calibrateAction.setEnabled(False)
+        self._calibrationWorker = self.analyser.calibrate(
+            sr, params, progress=self._calibrationProgress, finished=self._calibrationFinished)
+        self._calibrationDialog.canceled.connect(self._calibrationWorker.cancel)
+        
+    def _calibrationProgress(self, done, total):
+        self._calibrationDialog.setMaximum(total)
+        self._calibrationDialog.setValue(done)
+        
+    def _calibrationFinished(self, calibration):
+        """ Store and use `calibration`, if calibration wasn't cancelled """
+        self._calibrationWorker = None
+        self._calibrationDialog.reset()
+        self.analyseAction.setEnabled(True)
+        self.calibrateAction.setEnabled(True)
+        if calibration is None:
+            self._setTemporaryStatus("Calibration cancelled")
+            return
+        writeCalibration(Settings(), calibration)
+        self.analyser.calibrations = [c for c in self.analyser.calibrations if c.key != calibration.key]
+        self.analyser.calibrations.append(calibration)
+        # use calibrated number of threads
+        self.argswidget.setParams(numThreads=0)
+        QMessageBox.information(self, "Calibration finished", 
+                                f"Fastest configuration: {calibration}.\n"
+                                "This will be used when 'Threads' is set to 'Auto'.")
+        
+    def _clearCache(self):
+        """ Remove all cached results """
+        self.analyser.clearCache()
+        self._setTemporaryStatus("Result cache cleared")
             
     def _incrementProgress(self, inc):
         self._progressQueue.append(inc)
@@ -170,11 +449,15 @@ class DetectorBankGui(QMainWindow):
         
     def _maxProgress(self):
         self._progressBar.setValue(self._progressBar.maximum())
+        self._progressBar.setFormat("%p%")
         
     def _checkProgressQueue(self):
         while len(self._progressQueue) > 0:
             inc = self._progressQueue.popleft()
             self._progressBar.setValue(self._progressBar.value()+inc)
+        if (eta := self.analyser.eta) is not None:
+            mins, secs = divmod(int(round(eta)), 60)
+            self._progressBar.setFormat(f"%p% ({mins}:{secs:02d} remaining)")
             
     def createDockWidget(self, widget, area, title, key=None):
         if area in self.dockAreas:
@@ -220,6 +503,56 @@ class DetectorBankGui(QMainWindow):
         if (icon := getIconFromTheme("system-run")) is not None:
             self.analyseAction.setIcon(icon)
             
+        self.pauseAnalysisAction = QAction(
+            "&Pause analysis", self, shortcut="F6", checkable=True, enabled=False,
+            statusTip="Pause or resume the current analysis",
+            toggled=self._pauseAnalysis)
+        if (icon := getIconFromTheme("media-playback-pause")) is not None:
+            self.pauseAnalysisAction.setIcon(icon)
+            
+        self.cancelAnalysisAction = QAction(
+            "&Cancel analysis", self, shortcut="Esc", enabled=False,
+            statusTip="Stop the current analysis, keeping any results so far",
+            triggered=self._cancelAnalysis)
+        if (icon := getIconFromTheme("process-stop")) is not None:
+            self.cancelAnalysisAction.setIcon(icon)
+            
+        self.diskCacheAction = QAction(
+            "Cache results on &disk", self, checkable=True,
+            statusTip="Keep analysis results on disk, so they can be reloaded in later sessions",
+            toggled=self._setDiskCacheEnabled)
+            
+        self.mergeOverlappingAction = QAction(
+            "&Merge overlapping regions", self, checkable=True,
+            statusTip=("Analyse overlapping regions in one pass. This is faster, but results "
+                       "for later regions include the response to the audio before them"),
+            toggled=self._setMergeOverlapping)
+            
+        self.mapResultsAction = QAction(
+            "Memory-map large &results", self, checkable=True,
+            statusTip=("Store large results in temporary files rather than in memory, "
+                       "so that long recordings can be analysed at low subsample factors"),
+            toggled=self._setMapResults)
+            
+        self.sweepAction = QAction(
+            "Parameter &sweep", self,
+            statusTip=("Analyse a region with each combination of a set of parameter values, "
+                       "to compare them"),
+            triggered=self._doSweep)
+            
+        self.calibrateAction = QAction(
+            "Calibra&te", self,
+            statusTip=("Find the number of threads and block size that analyse the current "
+                       "detectors fastest"),
+            triggered=self._calibrate)
+            
+        self.clearCacheAction = QAction(
+            "C&lear result cache", self,
+            statusTip="Remove all cached analysis results from memory and disk",
+            triggered=self._clearCache)
+        if (icon := getIconFromTheme("edit-clear")) is not None:
+            self.clearCacheAction.setIcon(icon)
+            
         self.exitAction = QAction(
             "&Quit", self, shortcut=QKeySequence.Quit,
             statusTip="Quit application",
@@ -253,6 +586,16 @@ class DetectorBankGui(QMainWindow):
         
         self.analyseMenu = self.menuBar().addMenu("&Analysis")
         self.analyseMenu.addAction(self.analyseAction)
+        self.analyseMenu.addAction(self.pauseAnalysisAction)
+        self.analyseMenu.addAction(self.cancelAnalysisAction)
+        self.analyseMenu.addAction(self.sweepAction)
+        self.analyseMenu.addSeparator()
+        self.analyseMenu.addAction(self.mergeOverlappingAction)
+        self.analyseMenu.addAction(self.mapResultsAction)
+        self.analyseMenu.addAction(self.diskCacheAction)
+        self.analyseMenu.addAction(self.clearCacheAction)
+        self.analyseMenu.addSeparator()
+        self.analyseMenu.addAction(self.calibrateAction)
         
         self.helpMenu = self.menuBar().addMenu("&Help")
         self.helpMenu.addActions([self.openGuiDocsAction, self.openDocsAction, self.reportBugAction])
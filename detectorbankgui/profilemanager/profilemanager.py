@@ -5,11 +5,22 @@ ProfileManager object to return extant profile and save new ones.
 """
 
 from bs4 import BeautifulSoup
+from detectorbank import DetectorBank
 import numpy as np
 from pathlib import Path
 
 class Profile:
     lookup = {"numThreads":"maxThreads", "damping":"d"}
+    # feature strings in profile, with DetectorBank value and text in combobox
+    featureTable = {"Runge-Kutta method":(DetectorBank.runge_kutta, "Fourth order Runge-Kutta"),
+                    "Central difference method":(DetectorBank.central_difference, "Central difference"),
+                    "Frequency unnormalized":(DetectorBank.freq_unnormalized, "Unnormalized"),
+                    "Search-normalized":(DetectorBank.search_normalized, "Search normalized"),
+                    "Amplitude unnormalized":(DetectorBank.amp_unnormalized, "Unnormalized"),
+                    "Amplitude normalized":(DetectorBank.amp_normalized, "Normalized")}
+    features = {feature:value for feature, (value, _) in featureTable.items()}
+    featureText = {feature:text for feature, (_, text) in featureTable.items()}
+    
     def __init__(self, profile):
         self.p = profile
 
@@ -19,14 +30,8 @@ class Profile:
         
     def _parseFeatures(self):
         """ Return text of method, frequency normalisation and amplitude normalisation to be sent to combobox """
-        d = {"Runge-Kutta method":"Fourth order Runge-Kutta",
-             "Central difference method":"Central difference",
-             "Frequency unnormalized":"Unnormalized",
-             "Search-normalized":"Search normalized",
-             "Amplitude unnormalized":"Unnormalized",
-             "Amplitude normalized":"Normalized"}
         featuresStr = self.p.find("featureSet").text
-        features = [d.get(feature, feature) for feature in featuresStr.split(',')]
+        features = [self.featureText.get(feature, feature) for feature in featuresStr.split(',')]
         return features
     
     def _parseFreqsBws(self):
@@ -53,6 +58,33 @@ class Profile:
             return self._parseFreqsBws()
         else:
             return None
+        
+    def params(self) -> dict:
+        """ Return dict of DetectorBank args, as returned by ArgsWidget.getArgs """
+        featuresStr = self.p.find("featureSet").text
+        method, freqNorm, ampNorm = [self.features[feature] for feature in featuresStr.split(',')]
+        params = {name:self.value(name) for name in ["sr", "numThreads", "detChars", "damping", "gain"]}
+        params.update({"method":method, "freqNorm":freqNorm, "ampNorm":ampNorm})
+        return params
+    
+    def matches(self, params) -> bool:
+        """ Return True if dict of DetectorBank `params` are the same as this profile's 
+        
+            The number of threads isn't compared, as it doesn't change the results.
+        """
+        profileParams = self.params()
+        for name, value in profileParams.items():
+            if name == "numThreads":
+                continue
+            if name not in params:
+                return False
+            if name == "detChars":
+                other = np.asarray(params[name])
+                if other.shape != value.shape or not np.allclose(other, value, rtol=1e-9, atol=0):
+                    return False
+            elif not np.isclose(params[name], value, rtol=1e-9, atol=0):
+                return False
+        return True
 
 class ProfileManager:
     def __init__(self, configfile=None):
@@ -14,6 +14,11 @@ class PlotWidget(QWidget):
     
     highlightChannel = Signal(object)
     
+    mappedPoints = 5000
+    """ Maximum number of points of each line read from memory-mapped data in
+        the visible range, and either side of it (see :meth:`setMappedData`)
+    """
+    
     def __init__(self, parent, *args, freqs=None, **kwargs):
         super().__init__(parent)
         self.freqs = freqs
@@ -35,7 +40,18 @@ class PlotWidget(QWidget):
         self._noHoverLineWidth = None
         self._hoverLine = None
         
+        # curves and buffers for results that are plotted as they are calculated
+        self._curves = []
+        self._xBuffer = None
+        self._yBuffer = None
+        self._numPoints = 0
+        
+        # (x0, dx, data) of memory-mapped results and range of columns plotted
+        self._mapped = None
+        self._mappedRange = None
+        
         self.plotWidget.scene().sigMouseMoved.connect(self.mouseMoved)
+        self.plotWidget.plotItem.vb.sigXRangeChanged.connect(self._updateMappedView)
         
         plotLayout = QVBoxLayout()
         plotLayout.addWidget(self.plotWidget)
@@ -93,6 +109,106 @@ class PlotWidget(QWidget):
         self._hoverLine = channel
         self.highlightChannel.emit(channel)
             
+    def setData(self, x, data, pens):
+        """ Plot each row of `data` against `x`, with the given `pens`
+            
+            If there are already curves from :meth:`appendData`, they are updated. 
+        """
+        self._plotCurves(x, data, pens)
+        # final data has been set, so streaming buffers aren't needed
+        self._xBuffer = None
+        self._yBuffer = None
+        self._numPoints = 0
+        self._mapped = None
+    
+    def setMappedData(self, x0, dx, data, pens):
+        """ Plot each row of `data` against x values `x0 + k*dx`, only reading 
+            the part of `data` that is visible.
+            
+            This is for memory-mapped results, which may not fit in memory. 
+            At most :attr:`mappedPoints` columns are read from the visible range
+            whenever it changes. Either side of it, columns are read at a coarser
+            spacing, so that the whole result is still shown when zoomed out.
+        """
+        self._mapped = (x0, dx, data)
+        self._mappedRange = None
+        self._xBuffer = None
+        self._yBuffer = None
+        self._numPoints = 0
+        self._updateMappedView(pens=pens)
+        
+    def _updateMappedView(self, *args, pens=None):
+        """ Read and plot the visible columns of data from :meth:`setMappedData` """
+        if self._mapped is None:
+            return
+        x0, dx, data = self._mapped
+        size = data.shape[1]
+        if pens is None and dx > 0:
+            xMin, xMax = self.plotWidget.plotItem.vb.viewRange()[0]
+            i0 = int(np.clip(np.floor((xMin - x0) / dx), 0, size))
+            i1 = int(np.clip(np.ceil((xMax - x0) / dx) + 1, i0, size))
+        else:
+            # when data is first set, show all of it
+            i0, i1 = 0, size
+        if (i0, i1) == self._mappedRange:
+            return
+        self._mappedRange = (i0, i1)
+        
+        coarse = max(1, -(-size // self.mappedPoints))
+        fine = max(1, -(-(i1 - i0) // self.mappedPoints))
+        idx = np.concatenate((np.arange(0, i0, coarse), np.arange(i0, i1, fine), 
+                              np.arange(i1, size, coarse)))
+        if pens is None:
+            pens = [curve.opts['pen'] for curve in self._curves]
+        self._plotCurves(x0 + idx * dx, data[:, idx], pens)
+    
+    def _plotCurves(self, x, data, pens):
+        """ Update existing curves with rows of `data` or, if the number of 
+            curves has changed, make new ones
+        """
+        if len(self._curves) == len(data):
+            for curve, y in zip(self._curves, data):
+                curve.setData(x, y)
+        else:
+            self._curves = [self.plotWidget.plot(x, y, pen=pen, name=self.freqs[k]) 
+                            for k, (y, pen) in enumerate(zip(data, pens))]
+    
+    def appendData(self, x, data, start, pens, size=None):
+        """ Add partial results to the plot
+            
+            Parameters
+            ----------
+            x : np.ndarray
+                x values of `data`
+            data : np.ndarray
+                Partial results, one row per curve
+            start : int
+                Index at which `data` starts
+            pens : list
+                Pen for each curve
+            size : int, optional
+                Expected total number of points. If given, buffers of this size are
+                allocated when the first data is added, otherwise they are grown 
+                as needed.
+        """
+        stop = start + data.shape[1]
+        if self._yBuffer is None:
+            capacity = max(stop, size if size is not None else 0)
+            self._xBuffer = np.zeros(capacity)
+            self._yBuffer = np.zeros((len(data), capacity))
+        elif stop > self._xBuffer.shape[0]:
+            capacity = max(stop, 2*self._xBuffer.shape[0])
+            xBuffer, yBuffer = self._xBuffer, self._yBuffer
+            self._xBuffer = np.zeros(capacity)
+            self._yBuffer = np.zeros((len(data), capacity))
+            self._xBuffer[:self._numPoints] = xBuffer[:self._numPoints]
+            self._yBuffer[:, :self._numPoints] = yBuffer[:, :self._numPoints]
+        self._xBuffer[start:stop] = x
+        self._yBuffer[:, start:stop] = data
+        self._numPoints = max(self._numPoints, stop)
+        
+        self._plotCurves(self._xBuffer[:self._numPoints], self._yBuffer[:, :self._numPoints], pens)
+    
     def __getattr__(self, name):
         return getattr(self.plotWidget, name)
     
@@ -5,6 +5,7 @@ Display multiple output plots
 """
 from qtpy.QtWidgets import (QWidget, QVBoxLayout, QLabel, QToolBar, QSpinBox, 
                             QStackedWidget)
+from qtpy.QtCore import Signal
 
 from .legendwidget import LegendWidget
 from .plotpage import PlotPage
@@ -17,6 +18,13 @@ import itertools
 
 class ResultsPlotWidget(QWidget):
     """ Widget containing QStackedWidget of PlotPages """
+    
+    pageChanged = Signal(int)
+    """ **signal** pageChanged(int `page`)
+    
+        Emitted with the index of the page shown when it is changed
+    """
+    
     def __init__(self, parent, *args, sr=None, **kwargs):
         super().__init__()
         
@@ -37,6 +45,8 @@ class ResultsPlotWidget(QWidget):
         
         ## toolbar ##
         self.toolbar.addAction(parent.analyseAction)
+        self.toolbar.addAction(parent.pauseAnalysisAction)
+        self.toolbar.addAction(parent.cancelAnalysisAction)
         self.toolbar.addSeparator()
         self.toolbar.addWidget(self.rowsBox)
         self.toolbar.addWidget(self.colsBox)
@@ -79,6 +89,8 @@ class ResultsPlotWidget(QWidget):
                         '#8B008B', '#C71585', '#008000', '#00FF00', '#2F4F4F',
                         '#778899', '#87CEEB', '#0000FF']
         self._plots = [] # list of (PlotWidget, audioplot Segment) pairs
+        # show the page of each result as it arrives, unless the user has chosen a page
+        self._followResults = True
         
         self.page = 0
         
@@ -115,8 +127,11 @@ class ResultsPlotWidget(QWidget):
             idx = 0
         elif idx >= self._pageCount:
             idx = self._pageCount - 1
+        changed = idx != self.stack.currentIndex()
         self.stack.setCurrentIndex(idx)
         self.pageLabel.setText(f"Page {idx+1}/{self._pageCount}")
+        if changed:
+            self.pageChanged.emit(idx)
         
     def _newPage(self):
         page = PlotPage()
@@ -125,12 +140,23 @@ class ResultsPlotWidget(QWidget):
     
     def _previousPage(self):
         """ Go to previous page """
+        self._followResults = False
         self.page -= 1
         
     def _nextPage(self):
         """ Go to next page """
+        self._followResults = False
         self.page += 1
         
+    def pageKeys(self, page=None) -> list[int]:
+        """ Return indices of the plots on `page`, or the current page if not given """
+        if page is None:
+            page = self.page
+        widget = self.stack.widget(page)
+        if widget is None:
+            return []
+        return [idx for idx, (p, _) in enumerate(self._plots) if p in widget]
+        
     @property
     def rows(self):
         """ Return user's chosen number of rows for plot grid """
@@ -198,7 +224,9 @@ class ResultsPlotWidget(QWidget):
         self.page = 0
         
     def _ensurePlotVisible(self, plot):
-        """ Show page containing `plot` """
+        """ Show page containing `plot`, unless the user has chosen a page """
+        if not self._followResults:
+            return None
         for idx in range(self._pageCount):
             page = self.stack.widget(idx)
             if plot in page:
@@ -206,11 +234,17 @@ class ResultsPlotWidget(QWidget):
                 return idx
         return None
         
-    def addPlots(self, freqs, segments) -> list[int]:
+    def addPlots(self, freqs, segments, labels=None) -> list[int]:
         """ Create empty plots for the given segments, which will contain data for the given frequencies 
         
+            If given, `labels` is a list of strings to add to the plot titles, 
+            e.g. to tell apart plots of the same segment with different parameters.
+        
             Return list of indices of the plots.
         """
+        if labels is None:
+            labels = [None] * len(segments)
+        self._followResults = True
         
         if self._pageCount == 0:
             page = self._newPage()
@@ -224,7 +258,7 @@ class ResultsPlotWidget(QWidget):
         
         idx = []
         
-        for segment in segments:
+        for segment, label in zip(segments, labels):
         
             if row >= self.rows:
                 page = self._newPage()
@@ -238,6 +272,8 @@ class ResultsPlotWidget(QWidget):
                 title = f"{s0}-{s1} samples"
             if segment.colour is not None:
                 title = f'<span style="color:{segment.colour}">{title}</span>'
+            if label is not None:
+                title = f"{title}<br>{label}"
                 
             p = PlotWidget(self, title=title, freqs=freqs)
             p.highlightChannel.connect(self.legendWidget.highlightLabel)
@@ -257,23 +293,71 @@ class ResultsPlotWidget(QWidget):
                 
         return idx
     
-    def addData(self, idx, data):
-        """ Plot `data` on plot for `segment` """
+    def _timeAxis(self, s0, s1, size):
+        """ Return first x value and spacing of `size` points from sample `s0` to `s1` """
+        if self.sr is not None:
+            s0, s1 = s0/self.sr, s1/self.sr
+        step = (s1 - s0) / (size - 1) if size > 1 else 0
+        return s0, step
+    
+    def _times(self, s0, s1, size, start=0, stop=None):
+        """ Return x values `start` to `stop` of `size` points from sample `s0` to `s1` """
+        x0, step = self._timeAxis(s0, s1, size)
+        stop = size if stop is None else stop
+        return x0 + np.arange(start, stop) * step
+    
+    def _pens(self, num):
+        """ Return list of `num` colours for curves """
+        return list(itertools.islice(itertools.cycle(self.colours), num))
+    
+    def updateData(self, idx, block, start, size):
+        """ Add partial result `block` to plot `idx` while the analysis is running
+            
+            Parameters
+            ----------
+            idx : int
+                Index of plot
+            block : np.ndarray
+                Array of partial results
+            start : int
+                Index in the result at which `block` starts
+            size : int
+                Expected size of the complete result
+        """
+        p, segment = self._plots[idx]
+        s0, s1 = segment.samples
+        t = self._times(s0, s1, size, start, start+block.shape[1])
+        p.appendData(t, block, start, self._pens(len(block)), size=size)
+        if start == 0:
+            self._ensurePlotVisible(p)
+    
+    def addData(self, idx, data, complete=True, stop=None):
+        """ Plot `data` on plot for `segment` 
+        
+            If `complete` is False, the plot title is marked as incomplete. In this 
+            case, `stop` can be given as the sample at which `data` ends, 
+            if it does not cover the whole segment.
+            
+            Any partial results added with :meth:`updateData` are replaced.
+            
+            If `data` is memory-mapped, only the part that is visible is read.
+        """
         p, segment = self._plots[idx]
         
         chans, size = data.shape
         
         s0, s1 = segment.samples
+        if stop is not None:
+            s1 = stop
         
-        if self.sr is not None:
-            t = np.linspace(s0/self.sr, s1/self.sr, size)
+        if isinstance(data, np.memmap):
+            x0, step = self._timeAxis(s0, s1, size)
+            p.setMappedData(x0, step, data, self._pens(chans))
         else:
-            t = np.linspace(s0, s1, size)
-        
-        colours = itertools.cycle(self.colours)
+            t = self._times(s0, s1, size)
+            p.setData(t, data, self._pens(chans))
         
-        for k, resp in enumerate(data):
-            pen = next(colours)
-            p.plot(t, resp, pen=pen, name=p.freqs[k])
+        if not complete:
+            p.setTitle(f"{p.title} (incomplete)")
             
         self._ensurePlotVisible(p)
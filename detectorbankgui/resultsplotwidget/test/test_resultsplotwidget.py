@@ -16,6 +16,8 @@ class Segment:
 class MockParent:
     def __init__(self):
         self.analyseAction = QAction("analyse")
+        self.pauseAnalysisAction = QAction("pause")
+        self.cancelAnalysisAction = QAction("cancel")
 
 def test_resultsplot(audio2, qtbot):
     
@@ -102,4 +104,102 @@ def test_resultsplot(audio2, qtbot):
     assert resultWidget._pageCount == 0
     assert resultWidget.page == -1 # empty stack
     assert resultWidget.pageLabel.text() == "Page 0/0"
-    assert len(resultWidget._plots) == 0
\ No newline at end of file
+    assert len(resultWidget._plots) == 0
+    
+def test_update_data(qtbot):
+    sr = 48000
+    segments = [Segment(0, sr, "#0000ff")]
+    freqs = np.array([220, 440, 880])
+    
+    parent = MockParent()
+    resultWidget = ResultsPlotWidget(parent, sr=sr)
+    qtbot.addWidget(resultWidget)
+    idx, = resultWidget.addPlots(freqs, segments)
+    plot, _ = resultWidget._plots[idx]
+    
+    size = 100
+    data = np.random.default_rng(0).random((len(freqs), size))
+    
+    # partial results are plotted as they arrive
+    resultWidget.updateData(idx, data[:, :30], 0, size)
+    resultWidget.updateData(idx, data[:, 30:70], 30, size)
+    items = plot.plotWidget.plotItem.dataItems
+    assert len(items) == len(freqs)
+    for k, item in enumerate(items):
+        assert np.array_equal(item.yData, data[k, :70])
+    
+    # final result updates the same curves
+    resultWidget.addData(idx, data)
+    assert plot.plotWidget.plotItem.dataItems == items
+    for k, item in enumerate(items):
+        assert np.array_equal(item.yData, data[k])
+    assert np.allclose(items[0].xData, np.linspace(0, 1, size))
+
+def test_mapped_data(qtbot, tmp_path):
+    sr = 48000
+    segments = [Segment(0, 10*sr, "#0000ff")]
+    freqs = np.array([220, 440, 880])
+    
+    parent = MockParent()
+    resultWidget = ResultsPlotWidget(parent, sr=sr)
+    qtbot.addWidget(resultWidget)
+    idx, = resultWidget.addPlots(freqs, segments)
+    plot, _ = resultWidget._plots[idx]
+    plot.mappedPoints = 1000
+    
+    size = 100000
+    data = np.memmap(tmp_path.joinpath("result.dat"), dtype=np.float64, mode="w+", 
+                     shape=(len(freqs), size))
+    data[:] = np.random.default_rng(0).random(data.shape)
+    
+    # only mappedPoints of the memory-mapped result are read
+    resultWidget.addData(idx, data)
+    items = plot.plotWidget.plotItem.dataItems
+    assert len(items) == len(freqs)
+    assert len(items[0].xData) == plot.mappedPoints
+    x = np.linspace(0, 10, size)
+    idxx = np.round(items[0].xData / x[1]).astype(int)
+    assert np.allclose(items[0].xData, x[idxx])
+    for k, item in enumerate(items):
+        assert np.array_equal(item.yData, data[k, idxx])
+    
+    # zooming in reads the visible range at a finer spacing
+    plot.plotWidget.plotItem.vb.setXRange(1, 1.01, padding=0)
+    items = plot.plotWidget.plotItem.dataItems
+    idxx = np.round(items[0].xData / x[1]).astype(int)
+    visible = idxx[(items[0].xData >= 1) & (items[0].xData <= 1.01)]
+    assert np.all(np.diff(visible) == 1)
+    assert len(visible) >= 0.01 * size / 10
+    assert idxx[0] == 0
+    assert idxx[-1] > 0.9 * size
+    for k, item in enumerate(items):
+        assert np.array_equal(item.yData, data[k, idxx])
+
+
+def test_pages(qtbot):
+    sr = 48000
+    segments = [Segment(k*sr, (k+1)*sr, "#0000ff") for k in range(6)]
+    freqs = np.array([220, 440, 880])
+    data = np.zeros((len(freqs), 10))
+    
+    parent = MockParent()
+    resultWidget = ResultsPlotWidget(parent, sr=sr)
+    qtbot.addWidget(resultWidget)
+    resultWidget.addPlots(freqs, segments)
+    assert resultWidget.pageKeys() == [0, 1, 2, 3]
+    assert resultWidget.pageKeys(1) == [4, 5]
+    
+    # results show their page, until the user chooses one
+    with qtbot.waitSignal(resultWidget.pageChanged) as blocker:
+        resultWidget.addData(4, data)
+    assert blocker.args == [1]
+    resultWidget.previousPageAction.trigger()
+    assert resultWidget.page == 0
+    resultWidget.addData(5, data)
+    assert resultWidget.page == 0
+    
+    # plots of the same segment can be labelled, e.g. with sweep parameters
+    idx = resultWidget.addPlots(freqs, segments[:2], labels=["Gain 25", "Gain 50"])
+    assert idx == [6, 7]
+    titles = [resultWidget._plots[k][0].title for k in idx]
+    assert titles[0].endswith("<br>Gain 25") and titles[1].endswith("<br>Gain 50")
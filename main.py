@@ -38,9 +38,30 @@ import sys
 import os
 from pathlib import Path
 import argparse
-from qtpy.QtWidgets import QApplication, QSplashScreen
-from qtpy.QtGui import QPixmap
-from detectorbankgui.mainwindow import DetectorBankGui
+from detectorbankgui.profilemanager import ProfileManager
+from detectorbankgui.analyser.calibration import calibrate as calibrateAnalysis, writeCalibration
+from detectorbankgui import batch
+
+def calibrate(profile=None):
+    """ Find fastest number of threads and block duration for the detectors in 
+        `profile` (or the default profile), then print and save them
+    """
+    from customQObjects.core import Settings
+    settings = Settings()
+    if profile is None:
+        profile = settings.value("params/defaultProfile", cast=str, defaultValue="default")
+    prof = ProfileManager().getProfile(profile)
+    if prof is None:
+        print(f"No profile named '{profile}'", file=sys.stderr)
+        return 1
+    params = prof.params()
+    sr = int(params['sr'])
+    print(f"Calibrating with {len(params['detChars'])} detectors at {sr} Hz from profile '{profile}'")
+    progress = lambda done, total: print(f"{done}/{total}", end="\r", flush=True)
+    calibration = calibrateAnalysis(sr, params, callback=progress)
+    writeCalibration(settings, calibration)
+    print(f"Fastest configuration: {calibration}")
+    return 0
 
 if __name__ == '__main__':
     
@@ -48,12 +69,32 @@ if __name__ == '__main__':
     
     parser.add_argument('-i', '--input', help='Audio input')
     parser.add_argument('-p', '--profile', help='Profile name')
+    parser.add_argument('--calibrate', action='store_true', 
+                        help=('Find the fastest number of threads and block size for the '
+                              'detectors in the profile, save them and exit'))
+    
+    subparsers = parser.add_subparsers(dest='command')
+    batchParser = subparsers.add_parser(
+        'batch', help='Analyse audio files without the GUI',
+        description='Analyse audio files without the GUI, writing results to an output directory')
+    batch.addArguments(batchParser)
 
     args = parser.parse_args()
+    
+    if args.command == 'batch':
+        # batch analysis doesn't need Qt
+        sys.exit(batch.main(args))
+    
+    from qtpy.QtWidgets import QApplication, QSplashScreen
+    from qtpy.QtGui import QPixmap
+    from detectorbankgui.mainwindow import DetectorBankGui
 
     QApplication.setApplicationName("DetectorBank")
     QApplication.setOrganizationName("SMRG")
     
+    if args.calibrate:
+        sys.exit(calibrate(args.profile))
+    
     app = QApplication(sys.argv)
     
     local_share = Path.home().joinpath(".local", "share")